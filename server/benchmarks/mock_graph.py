@@ -0,0 +1,597 @@
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qsl, urlencode
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import argparse
+import asyncio
+import base64
+import io
+import json
+import uvicorn
+import zipfile
+
+# A local stand-in for the parts of Microsoft Graph the server uses
+
+
+# the folders messages are filed in
+INBOX = "AAMk-folder-0"
+SENT_ITEMS = "AAMk-folder-2"
+
+WORDS = (
+    "quarterly report budget review meeting notes project update sync "
+    "planning roadmap customer launch invoice schedule agenda follow up"
+).split()
+
+
+def _text(i: int, size: int) -> str:
+    words = []
+    length = 0
+    while length < size:
+        word = WORDS[(i + len(words)) % len(WORDS)]
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:size]
+
+
+def _html(i: int, size: int) -> str:
+    # roughly <size> bytes of the kind of markup outlook sends
+    paragraphs = []
+    length = 0
+    while length < size:
+        paragraph = (
+            f'<p style="margin:0;font-family:Calibri">{_text(i + len(paragraphs), 200)}'
+            "</p>"
+        )
+        paragraphs.append(paragraph)
+        length += len(paragraph)
+    return (
+        "<html><head><style>p{margin:0}</style></head><body>"
+        + "".join(paragraphs)
+        + "</body></html>"
+    )
+
+
+def _docx(size: int) -> bytes:
+    # a minimal word document with roughly <size> bytes of text
+    paragraphs = []
+    length = 0
+    while length < size:
+        paragraph = _text(len(paragraphs), 200)
+        paragraphs.append(f"<w:p><w:r><w:t>{paragraph}</w:t></w:r></w:p>")
+        length += len(paragraph)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr(
+            "word/document.xml",
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/'
+            'wordprocessingml/2006/main"><w:body>'
+            + "".join(paragraphs)
+            + "</w:body></w:document>",
+        )
+    return buffer.getvalue()
+
+
+def _token_claims(headers: dict) -> dict:
+    authorization = " ".join(
+        value for name, value in headers.items() if name.lower() == "authorization"
+    )
+    try:
+        payload = authorization.removeprefix("Bearer ").split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload))
+    except (IndexError, ValueError):
+        return {}
+
+
+class MockGraph:
+    """
+    Generates a mailbox of <messages> messages with bodies of about
+    <body_size> bytes, every seventh with attachments of up to
+    <attachment_size> bytes, a folder tree <folder_depth> levels deep with
+    <folder_fanout> subfolders in each, and a calendar of <events>
+    events, and answers graph requests for them after <latency> seconds.
+    """
+
+    def __init__(
+        self,
+        messages: int = 500,
+        events: int = 50,
+        body_size: int = 4096,
+        latency: float = 0.02,
+        folder_depth: int = 2,
+        folder_fanout: int = 12,
+        attachment_size: int = 4_194_304,
+    ):
+        self.latency = latency
+        self.attachments = self._attachments(attachment_size)
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        self.messages = [self._message(i, now, body_size) for i in range(messages)]
+        self.events = [self._event(i, now, body_size) for i in range(events)]
+        self.folders = [
+            self._folder(f"AAMk-folder-{i}", name, "AAMk-folder-root", i)
+            for i, name in enumerate(
+                ["Inbox", "Drafts", "Sent Items", "Deleted Items", "Archive"]
+            )
+        ]
+        # subfolders under the inbox and archive
+        self.child_folders: dict = {}
+        for folder in (self.folders[0], self.folders[4]):
+            self._add_child_folders(folder, folder_depth, folder_fanout)
+        self.categories = [
+            {"id": f"c{i}", "displayName": name, "color": f"preset{i}"}
+            for i, name in enumerate(["Red", "Orange", "Yellow", "Green", "Blue"])
+        ]
+
+    @staticmethod
+    def _schedule(address: str, start: dict, end: dict) -> dict:
+        # a few meetings a working day, placed by a hash of the address
+        if address.endswith("@invalid.example"):
+            return {
+                "scheduleId": address,
+                "error": {"message": "mailbox not found", "responseCode": "Error"},
+            }
+        seed = sum(address.encode())
+        day = datetime.fromisoformat(start["dateTime"][:10])
+        last = datetime.fromisoformat(end["dateTime"][:19])
+        items = []
+        while day < last:
+            if day.weekday() < 5:
+                for j in range(4):
+                    begin = day + timedelta(
+                        hours=9 + (seed + 3 * j + day.day) % 8,
+                        minutes=30 * ((seed + j) % 2),
+                    )
+                    items.append(
+                        {
+                            "status": ("busy", "tentative", "oof")[(seed + j) % 3],
+                            "start": {
+                                "dateTime": begin.strftime("%Y-%m-%dT%H:%M:%S.0000000"),
+                                "timeZone": start["timeZone"],
+                            },
+                            "end": {
+                                "dateTime": (begin + timedelta(minutes=30)).strftime(
+                                    "%Y-%m-%dT%H:%M:%S.0000000"
+                                ),
+                                "timeZone": start["timeZone"],
+                            },
+                        }
+                    )
+            day += timedelta(days=1)
+        return {"scheduleId": address, "availabilityView": "", "scheduleItems": items}
+
+    @staticmethod
+    def _attachments(size: int) -> list:
+        # the same attachments on every message that has any
+        files = [
+            ("notes.txt", "text/plain", _text(0, 2048).encode()),
+            ("page.html", "text/html", _html(0, 8192).encode()),
+            ("large.log", "text/plain", _text(1, size).encode()),
+            (
+                "report.docx",
+                "application/vnd.openxmlformats-officedocument"
+                ".wordprocessingml.document",
+                _docx(size),
+            ),
+            ("logo.png", "image/png", b"\x89PNG\r\n\x1a\n" + bytes(1024)),
+        ]
+        attachments = [
+            {
+                "@odata.type": "#microsoft.graph.fileAttachment",
+                "id": f"AAMk-attachment-{i}",
+                "name": name,
+                "contentType": content_type,
+                "size": len(content),
+                "isInline": False,
+                "_content": content,
+            }
+            for i, (name, content_type, content) in enumerate(files)
+        ]
+        attachments.append(
+            {
+                "@odata.type": "#microsoft.graph.itemAttachment",
+                "id": f"AAMk-attachment-{len(files)}",
+                "name": "Forwarded message",
+                "contentType": None,
+                "size": 4096,
+                "isInline": False,
+            }
+        )
+        return attachments
+
+    def _find_attachment(self, message_id: str, attachment_id: str):
+        for message in self.messages:
+            if message["id"] == message_id and message["hasAttachments"]:
+                for attachment in self.attachments:
+                    if attachment["id"] == attachment_id:
+                        return attachment
+        return None
+
+    @staticmethod
+    def _message(i: int, now: datetime, body_size: int) -> dict:
+        received = (now - timedelta(minutes=30 * i)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        sender = {
+            "emailAddress": {
+                "name": f"Sender {i % 25}",
+                "address": f"sender{i % 25}@example.com",
+            }
+        }
+        return {
+            "id": f"AAMk-message-{i}",
+            # every tenth message is one the user sent, the rest came in
+            "parentFolderId": SENT_ITEMS if i % 10 == 5 else INBOX,
+            "subject": f"{_text(i, 40).title()} #{i}",
+            "receivedDateTime": received,
+            "sentDateTime": received,
+            "isRead": i % 3 != 0,
+            "importance": "normal",
+            "hasAttachments": i % 7 == 0,
+            "bodyPreview": _text(i, 255),
+            "sender": sender,
+            "from": sender,
+            "toRecipients": [
+                {
+                    "emailAddress": {
+                        "name": "Benchmark User",
+                        "address": "user@example.com",
+                    }
+                }
+            ],
+            "body": {"contentType": "html", "content": _html(i, body_size)},
+            "_text": _text(i, body_size),
+        }
+
+    @staticmethod
+    def _event(i: int, now: datetime, body_size: int) -> dict:
+        start = now.replace(minute=0, second=0) + timedelta(hours=2 * i - 24)
+        return {
+            "id": f"AAMk-event-{i}",
+            "subject": f"{_text(i, 20).title()} sync",
+            "start": {
+                "dateTime": start.strftime("%Y-%m-%dT%H:%M:%S.0000000"),
+                "timeZone": "UTC",
+            },
+            "end": {
+                "dateTime": (start + timedelta(hours=1)).strftime(
+                    "%Y-%m-%dT%H:%M:%S.0000000"
+                ),
+                "timeZone": "UTC",
+            },
+            "location": {"displayName": f"Room {i % 10}"},
+            "organizer": {
+                "emailAddress": {
+                    "name": f"Organizer {i % 5}",
+                    "address": f"organizer{i % 5}@example.com",
+                }
+            },
+            "attendees": [
+                {
+                    "type": "required",
+                    "status": {"response": "accepted", "time": "0001-01-01T00:00:00Z"},
+                    "emailAddress": {
+                        "name": f"Attendee {j}",
+                        "address": f"attendee{j}@example.com",
+                    },
+                }
+                for j in range(i % 6)
+            ],
+            "body": {"contentType": "html", "content": _html(i, min(body_size, 2048))},
+            "bodyPreview": _text(i, 255),
+            "isAllDay": False,
+            "isCancelled": False,
+            "categories": [],
+            "webLink": f"https://outlook.office365.com/owa/?itemid=AAMk-event-{i}",
+        }
+
+    @staticmethod
+    def _folder(folder_id: str, name: str, parent_id: str, i: int) -> dict:
+        return {
+            "id": folder_id,
+            "displayName": name,
+            "parentFolderId": parent_id,
+            "childFolderCount": 0,
+            "unreadItemCount": 10 * i,
+            "totalItemCount": 100 * i,
+            "isHidden": False,
+        }
+
+    def _add_child_folders(self, parent: dict, depth: int, fanout: int):
+        if depth <= 0:
+            return
+        children = [
+            self._folder(
+                f"{parent['id']}-{i}", f"{_text(i, 12).title()} {i}", parent["id"], i
+            )
+            for i in range(fanout)
+        ]
+        parent["childFolderCount"] = len(children)
+        self.child_folders[parent["id"]] = children
+        for child in children:
+            self._add_child_folders(child, depth - 1, fanout)
+
+    @staticmethod
+    def _render_message(message: dict, text_body: bool, select: str = "") -> dict:
+        rendered = {key: value for key, value in message.items() if key != "_text"}
+        if text_body:
+            rendered["body"] = {"contentType": "text", "content": message["_text"]}
+        if select:
+            # like graph, the id always comes back
+            fields = set(select.split(",")) | {"id"}
+            rendered = {key: value for key, value in rendered.items() if key in fields}
+        return rendered
+
+    def _page(self, base: str, items: list, params: dict, default_top: int) -> dict:
+        top = int(params.get("$top", default_top))
+        skip = int(params.get("$skip", 0))
+        body = {"value": items[skip : skip + top]}
+        if skip + top < len(items):
+            next_params = {k: v for k, v in params.items() if k != "$skip"}
+            next_params.update({"$top": top, "$skip": skip + top})
+            body["@odata.nextLink"] = f"{base}?{urlencode(next_params)}"
+        return body
+
+    def respond(self, method: str, url: str, headers: dict, body) -> tuple:
+        """answers one graph request with a (status, json body) pair"""
+        base, _, query = url.partition("?")
+        params = dict(parse_qsl(query, keep_blank_values=True))
+        path = base.split("/v1.0", 1)[-1].replace("/users/me-token-to-replace", "/me")
+        prefer = " ".join(
+            value for name, value in headers.items() if name.lower() == "prefer"
+        )
+        text_body = 'outlook.body-content-type="text"' in prefer
+
+        if method == "GET" and path == "/me":
+            # answer as whichever benchmark user the token belongs to
+            claims = _token_claims(headers)
+            return 200, {
+                "id": claims.get("oid", "benchmark-user"),
+                "displayName": claims.get("name", "Benchmark User"),
+                "mail": claims.get("email", "user@example.com"),
+            }
+
+        if (
+            method == "GET"
+            and path.startswith("/me/mailFolders/")
+            and "/messages/delta" in path
+        ):
+            if "$deltatoken" in params:
+                return 200, {"value": [], "@odata.deltaLink": f"{base}?$deltatoken=1"}
+            folder_id = path.split("/")[3]
+            folder_id = {"inbox": INBOX, "sentitems": SENT_ITEMS}.get(
+                folder_id, folder_id
+            )
+            # messages are already newest first, and $top caps the round
+            skip, _, top = params.get("$skiptoken", "0").partition("|")
+            skip = int(skip)
+            messages = [
+                message
+                for message in self.messages
+                if message["parentFolderId"] == folder_id
+            ]
+            top = int(top or params.get("$top", len(messages)))
+            messages = messages[:top]
+            page = [
+                self._render_message(message, text_body)
+                for message in messages[skip : skip + 100]
+            ]
+            if skip + 100 < len(messages):
+                return 200, {
+                    "value": page,
+                    "@odata.nextLink": f"{base}?$skiptoken={skip + 100}|{top}",
+                }
+            return 200, {"value": page, "@odata.deltaLink": f"{base}?$deltatoken=1"}
+
+        if method == "GET" and path == "/me/messages":
+            messages = self.messages
+            if "isRead eq false" in params.get("$filter", ""):
+                messages = [message for message in messages if not message["isRead"]]
+            messages = [
+                self._render_message(message, text_body, params.get("$select", ""))
+                for message in messages
+            ]
+            return 200, self._page(base, messages, params, 10)
+
+        if (
+            method == "GET"
+            and path.startswith("/me/messages/")
+            and "/attachments" in path
+        ):
+            parts = path.split("/")
+            if len(parts) == 5:
+                message = next((m for m in self.messages if m["id"] == parts[3]), None)
+                if message is not None:
+                    attachments = self.attachments if message["hasAttachments"] else []
+                    return 200, self._page(
+                        base,
+                        [
+                            {k: v for k, v in a.items() if not k.startswith("_")}
+                            for a in attachments
+                        ],
+                        params,
+                        10,
+                    )
+            elif len(parts) == 6:
+                attachment = self._find_attachment(parts[3], parts[5])
+                if attachment is not None:
+                    return 200, {
+                        k: v for k, v in attachment.items() if not k.startswith("_")
+                    }
+            return 404, {"error": {"code": "ErrorItemNotFound", "message": path}}
+
+        if method == "GET" and path.startswith("/me/messages/"):
+            message_id = path.removeprefix("/me/messages/")
+            for message in self.messages:
+                if message["id"] == message_id:
+                    return 200, self._render_message(
+                        message, text_body, params.get("$select", "")
+                    )
+
+        if method == "GET" and path == "/me/mailFolders":
+            return 200, self._page(base, self.folders, params, 10)
+
+        if (
+            method == "GET"
+            and path.startswith("/me/mailFolders/")
+            and path.endswith("/childFolders")
+        ):
+            parent_id = path.split("/")[3]
+            return 200, self._page(
+                base, self.child_folders.get(parent_id, []), params, 10
+            )
+
+        if method == "GET" and path.startswith("/me/mailFolders/delta"):
+            # the folders never change, so later rounds come back empty
+            folders = [] if "$deltatoken" in params else self.folders
+            return 200, {
+                "value": folders,
+                "@odata.deltaLink": f"{base}?$deltatoken=1",
+            }
+
+        if (
+            method == "GET"
+            and path.startswith("/me/mailFolders/")
+            and len(path.split("/")) == 4
+        ):
+            folder_id = path.split("/")[3]
+            folder_id = {"inbox": INBOX, "sentitems": SENT_ITEMS}.get(
+                folder_id, folder_id
+            )
+            for folder in self.folders:
+                if folder["id"] == folder_id:
+                    return 200, folder
+
+        if method == "GET" and path.startswith("/me/calendarView/delta"):
+            # the calendar never changes, so later rounds come back empty
+            if "$deltatoken" in params:
+                return 200, {"value": [], "@odata.deltaLink": f"{base}?$deltatoken=1"}
+            if "$skiptoken" in params:
+                window_start, window_end, skip = params["$skiptoken"].split("|")
+                skip = int(skip)
+            else:
+                window_start = params["startDateTime"][:19]
+                window_end = params["endDateTime"][:19]
+                skip = 0
+            events = [
+                event
+                for event in self.events
+                if event["start"]["dateTime"][:19] < window_end
+                and event["end"]["dateTime"][:19] > window_start
+            ]
+            page = events[skip : skip + 10]
+            if skip + 10 < len(events):
+                skiptoken = urlencode(
+                    {"$skiptoken": f"{window_start}|{window_end}|{skip + 10}"}
+                )
+                return 200, {"value": page, "@odata.nextLink": f"{base}?{skiptoken}"}
+            return 200, {"value": page, "@odata.deltaLink": f"{base}?$deltatoken=1"}
+
+        if method == "GET" and path in (
+            "/me/calendar/calendarView",
+            "/me/calendar/events",
+        ):
+            return 200, self._page(base, self.events, params, 10)
+
+        if method == "POST" and path == "/me/calendar/events":
+            event = dict(body or {})
+            event.update(
+                {
+                    "id": f"AAMk-event-new-{len(self.events)}",
+                    "webLink": "https://outlook.office365.com/owa/?itemid=new",
+                }
+            )
+            return 201, event
+
+        if method == "POST" and path == "/me/calendar/getSchedule":
+            return 200, {
+                "value": [
+                    self._schedule(address, body["startTime"], body["endTime"])
+                    for address in body.get("schedules", [])
+                ]
+            }
+
+        if method == "GET" and path == "/me/outlook/masterCategories":
+            return 200, {"value": self.categories}
+
+        return 404, {"error": {"code": "ResourceNotFound", "message": path}}
+
+    async def handle(self, request: Request) -> Response:
+        await asyncio.sleep(self.latency)
+        url = str(request.url)
+
+        if request.url.path.endswith("/$value"):
+            # attachment content, streamed like graph does
+            parts = request.url.path.split("/v1.0", 1)[-1].split("/")
+            attachment = self._find_attachment(parts[3], parts[5])
+            if attachment is None or "_content" not in attachment:
+                return JSONResponse(
+                    {"error": {"code": "ErrorItemNotFound", "message": url}},
+                    status_code=404,
+                )
+            content = attachment["_content"]
+            chunks = (
+                content[offset : offset + 65536]
+                for offset in range(0, len(content), 65536)
+            )
+            return StreamingResponse(chunks, media_type=attachment["contentType"])
+
+        body = await request.json() if request.method == "POST" else None
+
+        if request.url.path.endswith("/$batch"):
+            root = url.split("/$batch", 1)[0]
+            responses = []
+            for sub in body.get("requests", []):
+                status, content = self.respond(
+                    sub["method"],
+                    root + sub["url"],
+                    sub.get("headers") or {},
+                    sub.get("body"),
+                )
+                responses.append(
+                    {
+                        "id": sub["id"],
+                        "status": status,
+                        "headers": {"Content-Type": "application/json"},
+                        "body": content,
+                    }
+                )
+            return JSONResponse({"responses": responses})
+
+        status, content = self.respond(request.method, url, dict(request.headers), body)
+        return JSONResponse(content, status_code=status)
+
+    def app(self) -> Starlette:
+        return Starlette(
+            routes=[Route("/{path:path}", self.handle, methods=["GET", "POST"])]
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="serve a mock microsoft graph")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--events", type=int, default=50)
+    parser.add_argument("--body-size", type=int, default=4096)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--attachment-size", type=int, default=4_194_304)
+    parser.add_argument("--folder-depth", type=int, default=2)
+    parser.add_argument("--folder-fanout", type=int, default=12)
+    args = parser.parse_args()
+
+    graph = MockGraph(
+        messages=args.messages,
+        events=args.events,
+        body_size=args.body_size,
+        latency=args.latency_ms / 1000,
+        attachment_size=args.attachment_size,
+        folder_depth=args.folder_depth,
+        folder_fanout=args.folder_fanout,
+    )
+    uvicorn.run(graph.app(), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+from fastmcp import Client
+from fastmcp.client.transports import StreamableHttpTransport
+
+from benchmarks.server import user_token
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+# Offline load benchmark of the MCP server against a mock graph
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# target name -> (tool, arguments)
+TOOL_CALLS = {
+    "search_emails": (
+        "search_emails",
+        {"subject": "quarterly report", "max_results": 20},
+    ),
+    "search_emails/headers": (
+        "search_emails",
+        {"subject": "quarterly report", "max_results": 20, "include_body": False},
+    ),
+    "search_calendar_events": (
+        "search_calendar_events",
+        {"title": "sync", "max_results": 20},
+    ),
+    "create_calendar_event": (
+        "create_calendar_event",
+        {
+            "subject": "Benchmark",
+            "start_datetime": "2030-01-01T10:00:00",
+            "end_datetime": "2030-01-01T11:00:00",
+            "location": "Room 1",
+            "attendees": ["attendee@example.com"],
+        },
+    ),
+    "find_free_slots": (
+        "find_free_slots",
+        {
+            "attendees": [f"attendee{i}@example.com" for i in range(40)],
+            "start_datetime": "2030-01-07",
+            "end_datetime": "2030-01-28",
+            "duration_minutes": 30,
+        },
+    ),
+    "create_calendar_events": (
+        "create_calendar_events",
+        {
+            "events": [
+                {
+                    "subject": f"Benchmark {i}",
+                    "start_datetime": f"2030-01-{i + 1:02d}T10:00:00",
+                    "end_datetime": f"2030-01-{i + 1:02d}T11:00:00",
+                    "location": "Room 1",
+                    "attendees": ["attendee@example.com"],
+                }
+                for i in range(25)
+            ]
+        },
+    ),
+}
+
+# values for the parameters of resource templates
+TEMPLATE_ARGUMENTS = {"count": "20", "id": "AAMk-message-0"}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start(module: str, port: int, args: list, env: dict) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, "-m", module, "--port", str(port), *map(str, args)],
+        cwd=SERVER_DIR,
+        env=env,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{module} exited with {process.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"{module} didn't start listening on {port}")
+
+
+def _percentile(values: list, percent: float) -> float:
+    """nearest-rank percentile of already sorted values"""
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, round(percent / 100 * len(values) + 0.5) - 1))
+    return values[rank]
+
+
+async def _targets(client: Client) -> list:
+    """every tool being benchmarked and every outlook:// resource, as
+    (name, call) pairs
+    """
+    targets = [
+        (name, lambda c, tool=tool, args=args: c.call_tool(tool, args))
+        for name, (tool, args) in TOOL_CALLS.items()
+    ]
+
+    uris = [str(resource.uri) for resource in await client.list_resources()]
+    for template in await client.list_resource_templates():
+        uri = template.uriTemplate
+        for name, value in TEMPLATE_ARGUMENTS.items():
+            uri = uri.replace("{" + name + "}", value)
+        uris.append(uri)
+
+    targets += [
+        (uri, lambda c, uri=uri: c.read_resource(uri))
+        for uri in sorted(uris)
+        if uri.startswith("outlook://") and "{" not in uri
+    ]
+    return targets
+
+
+async def _run_level(clients: list, call, requests: int, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    issued = 0
+
+    async def worker():
+        nonlocal errors, issued
+        while issued < requests:
+            client = clients[issued % len(clients)]
+            issued += 1
+            start = time.perf_counter()
+            try:
+                await call(client)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": _percentile(latencies, 50) * 1000,
+        "p95_ms": _percentile(latencies, 95) * 1000,
+        "p99_ms": _percentile(latencies, 99) * 1000,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+    }
+
+
+async def benchmark(url: str, args) -> list:
+    clients = [
+        Client(StreamableHttpTransport(url, auth=user_token(i)))
+        for i in range(args.users)
+    ]
+    for client in clients:
+        await client.__aenter__()
+
+    results = []
+    try:
+        for name, call in await _targets(clients[0]):
+            if args.targets and not any(t in name for t in args.targets):
+                continue
+            # one call per user first, so caches are warm for every user
+            for client in clients:
+                try:
+                    await call(client)
+                except Exception:
+                    pass
+            for concurrency in args.concurrency:
+                result = await _run_level(clients, call, args.requests, concurrency)
+                results.append({"target": name, **result})
+                _print_row(results[-1])
+    finally:
+        for client in clients:
+            await client.__aexit__(None, None, None)
+    return results
+
+
+def _print_row(result: dict):
+    print(
+        f"{result['target']:<36} {result['concurrency']:>5} {result['requests']:>7}"
+        f" {result['errors']:>6} {result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f}"
+        f" {result['p99_ms']:>9.1f} {result['rps']:>9.1f}",
+        flush=True,
+    )
+
+
+def _int_list(value: str) -> list:
+    return [int(item) for item in value.split(",") if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="benchmark outlook mcp against a local mock graph"
+    )
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--users", type=int, default=16)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--events", type=int, default=50)
+    parser.add_argument("--body-size", type=int, default=4096)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--auth",
+        choices=["static", "graph"],
+        default="static",
+        help="verify tokens against the mock graph, to include auth overhead",
+    )
+    parser.add_argument(
+        "--targets", nargs="*", help="only run targets whose name contains these"
+    )
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    graph_port = _free_port()
+    server_port = _free_port()
+
+    env = dict(os.environ)
+    env["GRAPH_BASE_URL"] = f"http://127.0.0.1:{graph_port}/v1.0"
+    # the mock never throttles, so don't measure our own rate limits
+    # unless they've been set explicitly
+    env.setdefault("GRAPH_USER_RATE", "1000000")
+    env.setdefault("GRAPH_TENANT_RATE", "1000000")
+    env.setdefault("PYTHONWARNINGS", "ignore")
+    # so the server splits graph limits between its workers
+    env["WORKERS"] = str(args.workers)
+
+    processes = []
+    try:
+        processes.append(
+            _start(
+                "benchmarks.mock_graph",
+                graph_port,
+                [
+                    "--messages",
+                    args.messages,
+                    "--events",
+                    args.events,
+                    "--body-size",
+                    args.body_size,
+                    "--latency-ms",
+                    args.latency_ms,
+                ],
+                env,
+            )
+        )
+        processes.append(
+            _start(
+                "benchmarks.server",
+                server_port,
+                [
+                    "--users",
+                    args.users,
+                    "--workers",
+                    args.workers,
+                    "--auth",
+                    args.auth,
+                ],
+                env,
+            )
+        )
+
+        print(
+            f"{'target':<36} {'conc':>5} {'reqs':>7} {'errors':>6} {'p50 ms':>9}"
+            f" {'p95 ms':>9} {'p99 ms':>9} {'rps':>9}"
+        )
+        results = asyncio.run(benchmark(f"http://127.0.0.1:{server_port}/mcp/", args))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "parameters": {k: v for k, v in vars(args).items()},
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
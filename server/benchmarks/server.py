@@ -0,0 +1,101 @@
+from fastmcp.server.auth.providers.jwt import StaticTokenVerifier
+
+import argparse
+import base64
+import json
+import os
+import uvicorn
+
+# The MCP server from main.py, with azure auth swapped for static tokens
+
+TENANT_ID = "benchmark-tenant"
+# fixed so every process derives the same tokens
+TOKEN_EXPIRY = 4102444800
+
+
+def _b64(data: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+
+
+def user_claims(i: int) -> dict:
+    return {
+        "sub": f"benchmark-user-{i}",
+        "oid": f"benchmark-user-{i}",
+        "tid": TENANT_ID,
+        "email": f"user{i}@example.com",
+        "name": f"Benchmark User {i}",
+        "exp": TOKEN_EXPIRY,
+    }
+
+
+def user_token(i: int) -> str:
+    """an unsigned JWT for benchmark user <i>, shaped like the tokens
+    azure issues so the server can read its claims the same way
+    """
+    return f"{_b64({'alg': 'none', 'typ': 'JWT'})}.{_b64(user_claims(i))}.benchmark"
+
+
+def create_benchmark_server(users: int, auth: str = "static"):
+    """<auth> is "static" to accept the benchmark tokens without checking
+    them, or "graph" to verify them against (mock) graph the way the
+    real server does
+    """
+    from main import create_server
+    from utils.auth import create_token_verifier
+
+    if auth == "graph":
+        return create_server(auth=create_token_verifier())
+
+    verifier = StaticTokenVerifier(
+        tokens={
+            user_token(i): {
+                "client_id": "benchmark",
+                "scopes": [],
+                **user_claims(i),
+            }
+            for i in range(users)
+        }
+    )
+    return create_server(auth=verifier)
+
+
+def create_benchmark_app():
+    """the benchmark server as an ASGI app, for each worker process"""
+    users = int(os.environ.get("BENCHMARK_USERS", "16"))
+    auth = os.environ.get("BENCHMARK_AUTH", "static")
+    return create_benchmark_server(users, auth).http_app(transport="streamable-http")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="serve outlook mcp with stub auth")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--users", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--auth", choices=["static", "graph"], default="static")
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        os.environ["BENCHMARK_USERS"] = str(args.users)
+        os.environ["BENCHMARK_AUTH"] = args.auth
+        uvicorn.run(
+            "benchmarks.server:create_benchmark_app",
+            factory=True,
+            workers=args.workers,
+            host=args.host,
+            port=args.port,
+            log_level="warning",
+        )
+        return
+
+    mcp = create_benchmark_server(args.users, args.auth)
+    uvicorn.run(
+        mcp.http_app(transport="streamable-http"),
+        host=args.host,
+        port=args.port,
+        log_level="warning",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Cold start benchmark of importing and building the MCP server
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# runs in a fresh interpreter, and prints the seconds each step took
+SCRIPT = """
+import json, os, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.create_server()
+created = time.perf_counter()
+from utils.preload import preload_graph_sdk
+preload_graph_sdk()
+preloaded = time.perf_counter()
+print(json.dumps({
+    "import_main": imported - start,
+    "create_server": created - imported,
+    "preload_graph_sdk": preloaded - created,
+}))
+"""
+
+
+def _packages(importtime: str) -> dict:
+    """self time in seconds per top level package, from -X importtime output"""
+    packages = {}
+    for line in importtime.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:") :].split("|")
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0.0) + int(self_us) / 1e6
+    return packages
+
+
+def run_once(mode: str) -> dict:
+    env = dict(os.environ)
+    env["GRAPH_SDK_PRELOAD"] = mode
+    env.setdefault("PYTHONWARNINGS", "ignore")
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", SCRIPT],
+        cwd=SERVER_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    timings = json.loads(process.stdout.strip().splitlines()[-1])
+    return {"timings": timings, "packages": _packages(process.stderr)}
+
+
+def benchmark(mode: str, runs: int, top: int) -> dict:
+    samples = [run_once(mode) for _ in range(runs)]
+    timings = {
+        step: statistics.median(sample["timings"][step] for sample in samples)
+        for step in samples[0]["timings"]
+    }
+    packages = {}
+    for sample in samples:
+        for package, seconds in sample["packages"].items():
+            packages.setdefault(package, []).append(seconds)
+    packages = sorted(
+        (
+            (package, statistics.median(seconds))
+            for package, seconds in packages.items()
+        ),
+        key=lambda item: item[1],
+        reverse=True,
+    )[:top]
+    return {"mode": mode, "timings": timings, "packages": dict(packages)}
+
+
+def _print_result(result: dict):
+    print(f"GRAPH_SDK_PRELOAD={result['mode']}")
+    for step, seconds in result["timings"].items():
+        print(f"  {step:<24} {seconds * 1000:>9.1f} ms")
+    print("  top packages by import time")
+    for package, seconds in result["packages"].items():
+        print(f"    {package:<22} {seconds * 1000:>9.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="benchmark how long the outlook mcp server takes to start"
+    )
+    parser.add_argument(
+        "--modes", nargs="*", default=["lazy", "startup"], help="GRAPH_SDK_PRELOAD"
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = []
+    for mode in args.modes:
+        results.append(benchmark(mode, args.runs, args.top))
+        _print_result(results[-1])
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {"parameters": vars(args), "results": results},
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
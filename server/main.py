@@ -4,14 +4,17 @@ from fastmcp import FastMCP
 from fastmcp.server.dependencies import get_access_token
 from fastmcp.server.context import Context
 
-from msgraph import GraphServiceClient
-from msgraph.generated.users.item.messages.messages_request_builder import (
-    MessagesRequestBuilder,
-)
-from kiota_abstractions.base_request_configuration import RequestConfiguration
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+
+import uvicorn
 
 from utils.config import load_config
-from utils.auth import PatchedAzureProvider, get_graph_client
+from utils.auth import PatchedAzureProvider, create_token_verifier, get_graph_client
+from utils.metrics import MetricsMiddleware, get_metrics
+from utils.oauth_state import SQLiteStateStore
+from utils.prefetch import PrefetchMiddleware, get_prefetch_scheduler
+from utils.preload import preload_graph_sdk, start_graph_sdk_preload
 
 from resources.mail import setup_mail_resources
 from resources.calendar import setup_calendar_resources
@@ -22,30 +25,31 @@ from tools.calendar import setup_calendar_tools
 load_dotenv()
 
 
-def main():
-    config = load_config()
+def create_server(auth=None) -> FastMCP:
+    """builds the MCP server with every resource and tool registered"""
 
-    # initialize oidc proxy
-    auth = PatchedAzureProvider(
-        client_id=config.get("azure_client_id"),
-        tenant_id=config.get("azure_tenant_id"),
-        client_secret=config.get("azure_client_secret"),
-        base_url=config.get("base_url"),
-        redirect_path=config.get("azure_redirect_url"),
-        required_scopes=[
-            "User.Read",
-            "email",
-            "openid",
-            "profile",
-            "Calendars.ReadWrite",
-            "Mail.Read",
-            "MailboxFolder.Read",
-        ],
-    )
+    config = load_config()
 
     # initialize server
     mcp = FastMCP(name="Outlook MCP", auth=auth, stateless_http=True)
 
+    # * METRICS
+    # time every tool and resource, and serve the results for prometheus
+    if config.get("metrics"):
+        mcp.add_middleware(MetricsMiddleware())
+
+        @mcp.custom_route("/metrics", methods=["GET"])
+        async def get_metrics_text(request: Request) -> PlainTextResponse:
+            return PlainTextResponse(
+                get_metrics().render(), media_type="text/plain; version=0.0.4"
+            )
+
+    # * PREFETCH
+    # keep the caches of recently active users warm in the background
+    prefetch_scheduler = get_prefetch_scheduler()
+    if prefetch_scheduler:
+        mcp.add_middleware(PrefetchMiddleware(prefetch_scheduler))
+
     @mcp.resource(
         "config://whoami",
         title="Who Am I",
@@ -71,7 +75,71 @@ def main():
     setup_mail_tools(mcp=mcp)
     setup_calendar_tools(mcp=mcp)
 
-    # start the server
+    # * GRAPH SDK
+    # the sdk is imported on first use unless it's preloaded here
+    preload = config.get("graph_sdk_preload")
+    if preload == "startup":
+        preload_graph_sdk()
+    elif preload == "background":
+        start_graph_sdk_preload()
+
+    return mcp
+
+
+def create_auth() -> PatchedAzureProvider:
+    """builds the azure OAuth proxy the server signs users in with"""
+    config = load_config()
+
+    # workers share the proxy's state through sqlite, otherwise it's
+    # kept in this process's memory
+    state_store = None
+    if config.get("auth_state_backend") == "sqlite":
+        state_store = SQLiteStateStore(config.get("auth_state_path"))
+
+    required_scopes = [
+        "User.Read",
+        "email",
+        "openid",
+        "profile",
+        "Calendars.ReadWrite",
+        "Mail.Read",
+        "MailboxFolder.Read",
+    ]
+
+    # initialize oidc proxy
+    return PatchedAzureProvider(
+        client_id=config.get("azure_client_id"),
+        tenant_id=config.get("azure_tenant_id"),
+        client_secret=config.get("azure_client_secret"),
+        base_url=config.get("base_url"),
+        redirect_path=config.get("azure_redirect_url"),
+        required_scopes=required_scopes,
+        state_store=state_store,
+        # verified tokens are cached, so bursts of calls verify once
+        token_verifier=create_token_verifier(required_scopes),
+    )
+
+
+def create_app():
+    """the server as an ASGI app, built once in every worker process"""
+    return create_server(auth=create_auth()).http_app(transport="streamable-http")
+
+
+def main():
+    config = load_config()
+
+    # start the server, in several processes on one port if asked to
+    if config.get("workers") > 1:
+        uvicorn.run(
+            "main:create_app",
+            factory=True,
+            workers=config.get("workers"),
+            host=config.get("host"),
+            port=int(config.get("port")),
+        )
+        return
+
+    mcp = create_server(auth=create_auth())
     mcp.run(
         transport="streamable-http",
         host=config.get("host"),
@@ -1,14 +1,17 @@
+from contextlib import aclosing
 from datetime import datetime, timedelta
 from typing import List, TypedDict
 
 from fastmcp import FastMCP
 from fastmcp.server.dependencies import get_access_token
-from kiota_abstractions.base_request_configuration import RequestConfiguration
-from msgraph.generated.users.item.calendar_view.calendar_view_request_builder import (
-    CalendarViewRequestBuilder,
-)
 
-from utils.auth import get_graph_client
+from utils.auth import get_graph_client, get_user_id
+from utils.calendar_cache import get_calendar_cache
+from utils.config import load_config
+from utils.paging import GRAPH_PAGE_SIZE, iterate_pages
+from utils.raw import get_json
+from utils.resource_cache import get_resource_cache
+from utils.singleflight import single_flight
 
 
 class CalendarEvent(TypedDict):
@@ -27,91 +30,114 @@ class CalendarCategory(TypedDict):
 def setup_calendar_resources(mcp: FastMCP):
     """Register all calendar-related resources"""
 
-    @mcp.resource("outlook://calendar/week", name="Get Week's Events")
-    async def get_week_events() -> List[CalendarEvent]:
-        """get events for the current week from your calendar."""
-        token = get_access_token()
-        client = get_graph_client(token.token)
-
-        now = datetime.now()
-        start_of_week = now - timedelta(days=now.weekday())
-        end_of_week = start_of_week + timedelta(days=6)
-
-        start_time = start_of_week.isoformat()
-        end_time = end_of_week.isoformat()
+    config = load_config()
+    raw_json = config.get("graph_raw_json")
+    categories_ttl = config.get("resource_cache_categories_ttl")
+
+    async def list_events(
+        client, start: datetime, end: datetime
+    ) -> List[CalendarEvent]:
+        """lists the events overlapping <start> to <end> from graph,
+        following paging
+        """
+        from kiota_abstractions.base_request_configuration import RequestConfiguration
+        from msgraph.generated.users.item.calendar_view.calendar_view_request_builder import (
+            CalendarViewRequestBuilder,
+        )
 
         query_params = (
             CalendarViewRequestBuilder.CalendarViewRequestBuilderGetQueryParameters(
-                start_date_time=start_time,
-                end_date_time=end_time,
+                start_date_time=start.isoformat(),
+                end_date_time=end.isoformat(),
                 select=["subject", "start", "end", "location", "organizer"],
+                top=GRAPH_PAGE_SIZE,
             )
         )
         request_configuration = RequestConfiguration(query_parameters=query_params)
 
-        events_resp = await client.me.calendar.calendar_view.get(
-            request_configuration=request_configuration
-        )
-
         events = []
-        if events_resp and events_resp.value:
-            for event in events_resp.value:
-                events.append(
-                    {
-                        "subject": event.subject,
-                        "start_time": event.start.date_time,
-                        "end_time": event.end.date_time,
-                        "location": event.location.display_name,
-                        "organizer": event.organizer.email_address.name,
-                    }
-                )
+        pages = iterate_pages(
+            client.me.calendar.calendar_view, request_configuration, raw=raw_json
+        )
+        async with aclosing(pages):
+            async for page in pages:
+                if raw_json:
+                    events.extend(
+                        {
+                            "subject": event.get("subject"),
+                            "start_time": event["start"]["dateTime"],
+                            "end_time": event["end"]["dateTime"],
+                            "location": event["location"].get("displayName"),
+                            "organizer": event["organizer"]["emailAddress"].get("name"),
+                        }
+                        for event in page
+                    )
+                else:
+                    events.extend(
+                        {
+                            "subject": event.subject,
+                            "start_time": event.start.date_time,
+                            "end_time": event.end.date_time,
+                            "location": event.location.display_name,
+                            "organizer": event.organizer.email_address.name,
+                        }
+                        for event in page
+                    )
         return events
 
-    @mcp.resource("outlook://calendar/today", name="Get Today's Events")
-    async def get_today_events() -> List[CalendarEvent]:
-        """get events for today from your calendar."""
+    async def get_events(start: datetime, end: datetime) -> List[CalendarEvent]:
         token = get_access_token()
         client = get_graph_client(token.token)
 
-        now = datetime.now()
-        start_of_day = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        end_of_day = start_of_day + timedelta(days=1)
+        # today and this week are both answered from the same
+        # delta-synced copy of the week
+        calendar_cache = get_calendar_cache()
+        if calendar_cache:
+            events = await calendar_cache.get_events(
+                get_user_id(token), client, start, end
+            )
+            if events is not None:
+                return events
 
-        start_time = start_of_day.isoformat()
-        end_time = end_of_day.isoformat()
+        return await list_events(client, start, end)
 
-        query_params = (
-            CalendarViewRequestBuilder.CalendarViewRequestBuilderGetQueryParameters(
-                start_date_time=start_time,
-                end_date_time=end_time,
-                select=["subject", "start", "end", "location", "organizer"],
-            )
-        )
-        request_configuration = RequestConfiguration(query_parameters=query_params)
+    @mcp.resource("outlook://calendar/week", name="Get Week's Events")
+    @single_flight
+    async def get_week_events() -> List[CalendarEvent]:
+        """get events for the current week from your calendar."""
+        now = datetime.now()
+        start_of_week = now - timedelta(days=now.weekday())
+        end_of_week = start_of_week + timedelta(days=6)
 
-        events_resp = await client.me.calendar.calendar_view.get(
-            request_configuration=request_configuration
-        )
+        return await get_events(start_of_week, end_of_week)
 
-        events = []
-        if events_resp and events_resp.value:
-            for event in events_resp.value:
-                events.append(
-                    {
-                        "subject": event.subject,
-                        "start_time": event.start.date_time,
-                        "end_time": event.end.date_time,
-                        "location": event.location.display_name,
-                        "organizer": event.organizer.email_address.name,
-                    }
-                )
-        return events
+    @mcp.resource("outlook://calendar/today", name="Get Today's Events")
+    @single_flight
+    async def get_today_events() -> List[CalendarEvent]:
+        """get events for today from your calendar."""
+        now = datetime.now()
+        start_of_day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        end_of_day = start_of_day + timedelta(days=1)
 
-    @mcp.resource("outlook://calendar/categories", name="Get Calendar Categories")
-    async def get_calendar_categories() -> List[CalendarCategory]:
-        """gets the user's calendar categories"""
-        token = get_access_token()
-        client = get_graph_client(token.token)
+        return await get_events(start_of_day, end_of_day)
+
+    async def fetch_categories(client) -> List[CalendarCategory]:
+        """lists the user's calendar categories from graph"""
+        from msgraph.generated.models.category_color import CategoryColor
+
+        if raw_json:
+            categories_resp = await get_json(client.me.outlook.master_categories)
+            return [
+                {
+                    "name": category.get("displayName"),
+                    "color": str(
+                        CategoryColor(category["color"])
+                        if category.get("color")
+                        else None
+                    ),
+                }
+                for category in categories_resp.get("value") or []
+            ]
 
         categories_resp = await client.me.outlook.master_categories.get()
 
@@ -123,3 +149,24 @@ def setup_calendar_resources(mcp: FastMCP):
                 )
 
         return categories
+
+    @mcp.resource("outlook://calendar/categories", name="Get Calendar Categories")
+    @single_flight
+    async def get_calendar_categories() -> List[CalendarCategory]:
+        """gets the user's calendar categories"""
+        token = get_access_token()
+        client = get_graph_client(token.token)
+
+        # categories hardly ever change. graph has no delta or etag for
+        # them, so an expired entry is simply fetched again
+        resource_cache = get_resource_cache()
+        if resource_cache:
+
+            async def load(state):
+                return await fetch_categories(client), None
+
+            return await resource_cache.get(
+                get_user_id(token), "calendar_categories", categories_ttl, load
+            )
+
+        return await fetch_categories(client)
@@ -1,15 +1,17 @@
-from bs4 import BeautifulSoup
+from contextlib import aclosing
 
 from fastmcp import FastMCP
 from fastmcp.server.dependencies import get_access_token
 
-from msgraph.generated.users.item.messages.messages_request_builder import (
-    MessagesRequestBuilder,
-)
-from kiota_abstractions.base_request_configuration import RequestConfiguration
-
-from utils.auth import get_graph_client
-from utils.parser import parse_email_html
+from utils.auth import get_graph_client, get_user_id
+from utils.config import load_config
+from utils.folders import crawl_mail_folders, sync_mail_folders, top_level_folders
+from utils.mailbox import get_mailbox_cache
+from utils.paging import iterate_pages
+from utils.parser import apply_body_budget, parse_email_bodies
+from utils.raw import get_json
+from utils.resource_cache import get_resource_cache
+from utils.singleflight import single_flight
 
 from typing import List, TypedDict
 
@@ -24,15 +26,137 @@ class Email(TypedDict):
     delivery_time: str
     from_address: FromAddress
     body: str
+    body_truncated: bool
 
 
 MailList = List[Email]
 
 
+class EmailHeader(TypedDict):
+    id: str
+    subject: str
+    delivery_time: str
+    from_address: FromAddress
+    preview: str
+
+
+class EmailMessage(TypedDict):
+    id: str
+    subject: str
+    delivery_time: str
+    from_address: FromAddress
+    body: str
+    body_truncated: bool
+
+
+class MailFolderNode(TypedDict):
+    name: str
+    path: str
+    id: str
+    unread_item_count: int
+    total_item_count: int
+    child_folder_count: int
+    children: List["MailFolderNode"]
+
+
+# everything a headers-only listing needs, and nothing it doesn't
+HEADER_FIELDS = ["id", "sender", "subject", "receivedDateTime", "bodyPreview"]
+
+
 def setup_mail_resources(mcp: FastMCP):
     """Register all mail-related resources"""
 
+    config = load_config()
+    body_field = "uniqueBody" if config.get("mail_unique_body") else "body"
+    raw_json = config.get("graph_raw_json")
+    folders_ttl = config.get("resource_cache_folders_ttl")
+    folder_tree_concurrency = config.get("mail_folder_tree_concurrency")
+
+    async def messages_from_json(message_resp: dict) -> MailList:
+        """projects graph's raw message JSON straight into the output"""
+        values = message_resp.get("value") or []
+        bodies = await parse_email_bodies([msg.get(body_field) for msg in values])
+        return [
+            {
+                "subject": msg.get("subject"),
+                "delivery_time": msg.get("receivedDateTime"),
+                "from_address": {
+                    "name": msg["sender"]["emailAddress"].get("name"),
+                    "address": msg["sender"]["emailAddress"].get("address"),
+                },
+                "body": body_text,
+                "body_truncated": truncated,
+            }
+            for msg, (body_text, truncated) in zip(values, bodies)
+        ]
+
+    def header_from_model(msg) -> EmailHeader:
+        return {
+            "id": msg.id,
+            "subject": msg.subject,
+            "delivery_time": msg.received_date_time,
+            "from_address": {
+                "name": msg.sender.email_address.name,
+                "address": msg.sender.email_address.address,
+            },
+            "preview": msg.body_preview or "",
+        }
+
+    def header_from_json(msg: dict) -> EmailHeader:
+        return {
+            "id": msg.get("id"),
+            "subject": msg.get("subject"),
+            "delivery_time": msg.get("receivedDateTime"),
+            "from_address": {
+                "name": msg["sender"]["emailAddress"].get("name"),
+                "address": msg["sender"]["emailAddress"].get("address"),
+            },
+            "preview": msg.get("bodyPreview") or "",
+        }
+
+    async def list_headers(count: int, unread_only: bool) -> List[EmailHeader]:
+        """the <count> most recent (unread) emails, without their bodies"""
+        token = get_access_token()
+        client = get_graph_client(token.token)
+
+        # serve from the delta-synced cache when we can
+        mailbox_cache = get_mailbox_cache()
+        if mailbox_cache:
+            cached = await mailbox_cache.get_messages(
+                get_user_id(token),
+                client,
+                int(count),
+                unread_only=unread_only,
+                headers_only=True,
+            )
+            if cached is not None:
+                return cached
+
+        from kiota_abstractions.base_request_configuration import RequestConfiguration
+        from msgraph.generated.users.item.messages.messages_request_builder import (
+            MessagesRequestBuilder,
+        )
+
+        query_params = MessagesRequestBuilder.MessagesRequestBuilderGetQueryParameters(
+            filter="isRead eq false" if unread_only else None,
+            select=HEADER_FIELDS,
+            top=count,
+        )
+        request_configuration = RequestConfiguration(query_parameters=query_params)
+
+        if raw_json:
+            message_resp = await get_json(client.me.messages, request_configuration)
+            return [header_from_json(msg) for msg in message_resp.get("value") or []]
+
+        message_resp = await client.me.messages.get(
+            request_configuration=request_configuration
+        )
+        if not message_resp or not message_resp.value:
+            return []
+        return [header_from_model(msg) for msg in message_resp.value]
+
     @mcp.resource("outlook://mail/recent/{count}", name="Get Recent Mail")
+    @single_flight
     async def get_recent_mail(count: int = 20) -> MailList:
         """get <count> (default of 20) most recent emails from your inbox.
         returns: email subject, delivery time, from address, and body
@@ -40,21 +164,51 @@ def setup_mail_resources(mcp: FastMCP):
         token = get_access_token()
         client = get_graph_client(token.token)
 
+        # serve from the delta-synced cache when we can
+        mailbox_cache = get_mailbox_cache()
+        if mailbox_cache:
+            cached = await mailbox_cache.get_messages(
+                get_user_id(token), client, int(count)
+            )
+            if cached is not None:
+                return apply_body_budget(cached)
+
         # get recent emails
+        from kiota_abstractions.base_request_configuration import RequestConfiguration
+        from msgraph.generated.users.item.messages.messages_request_builder import (
+            MessagesRequestBuilder,
+        )
+
         query_params = MessagesRequestBuilder.MessagesRequestBuilderGetQueryParameters(
-            select=["sender", "subject", "receivedDateTime", "body"], top=count
+            select=["sender", "subject", "receivedDateTime", body_field], top=count
         )
 
         request_configuration = RequestConfiguration(
             query_parameters=query_params,
         )
+        # have graph convert bodies to text so we don't have to parse html
+        request_configuration.headers.add("Prefer", 'outlook.body-content-type="text"')
+
+        if raw_json:
+            return apply_body_budget(
+                await messages_from_json(
+                    await get_json(client.me.messages, request_configuration)
+                )
+            )
+
         message_resp = await client.me.messages.get(
             request_configuration=request_configuration
         )
 
         messages = []
         if message_resp and message_resp.value:
-            for msg in message_resp.value:
+            bodies = await parse_email_bodies(
+                [
+                    msg.unique_body if body_field == "uniqueBody" else msg.body
+                    for msg in message_resp.value
+                ]
+            )
+            for msg, (body_text, truncated) in zip(message_resp.value, bodies):
                 messages.append(
                     {
                         "subject": msg.subject,
@@ -63,13 +217,15 @@ def setup_mail_resources(mcp: FastMCP):
                             "name": msg.sender.email_address.name,
                             "address": msg.sender.email_address.address,
                         },
-                        "body": parse_email_html(msg.body.content),
+                        "body": body_text,
+                        "body_truncated": truncated,
                     }
                 )
 
-        return messages
+        return apply_body_budget(messages)
 
     @mcp.resource("outlook://mail/unread/{count}", name="Get Unread Emails")
+    @single_flight
     async def get_unread_mail(count=20) -> MailList:
         """get <count> (default of 20) most recent unread emails from your inbox.
         returns: email subject, delivery time, from address, and body
@@ -77,10 +233,24 @@ def setup_mail_resources(mcp: FastMCP):
         token = get_access_token()
         client = get_graph_client(token.token)
 
+        # serve from the delta-synced cache when we can
+        mailbox_cache = get_mailbox_cache()
+        if mailbox_cache:
+            cached = await mailbox_cache.get_messages(
+                get_user_id(token), client, int(count), unread_only=True
+            )
+            if cached is not None:
+                return apply_body_budget(cached)
+
         # get the number of unread emails
+        from kiota_abstractions.base_request_configuration import RequestConfiguration
+        from msgraph.generated.users.item.messages.messages_request_builder import (
+            MessagesRequestBuilder,
+        )
+
         query_params = MessagesRequestBuilder.MessagesRequestBuilderGetQueryParameters(
             filter="isRead eq false",
-            select=["sender", "subject", "receivedDateTime", "body"],
+            select=["sender", "subject", "receivedDateTime", body_field],
             top=count,
         )
 
@@ -91,13 +261,29 @@ def setup_mail_resources(mcp: FastMCP):
         request_configuration = RequestConfiguration(
             query_parameters=query_params,
         )
+        # have graph convert bodies to text so we don't have to parse html
+        request_configuration.headers.add("Prefer", 'outlook.body-content-type="text"')
+
+        if raw_json:
+            return apply_body_budget(
+                await messages_from_json(
+                    await get_json(client.me.messages, request_configuration)
+                )
+            )
+
         message_resp = await client.me.messages.get(
             request_configuration=request_configuration
         )
 
         messages = []
         if message_resp and message_resp.value:
-            for msg in message_resp.value:
+            bodies = await parse_email_bodies(
+                [
+                    msg.unique_body if body_field == "uniqueBody" else msg.body
+                    for msg in message_resp.value
+                ]
+            )
+            for msg, (body_text, truncated) in zip(message_resp.value, bodies):
                 messages.append(
                     {
                         "subject": msg.subject,
@@ -106,13 +292,83 @@ def setup_mail_resources(mcp: FastMCP):
                             "name": msg.sender.email_address.name,
                             "address": msg.sender.email_address.address,
                         },
-                        "body": parse_email_html(msg.body.content),
+                        "body": body_text,
+                        "body_truncated": truncated,
                     }
                 )
 
-        return messages
+        return apply_body_budget(messages)
+
+    @mcp.resource(
+        "outlook://mail/recent/{count}/headers", name="Get Recent Mail Headers"
+    )
+    @single_flight
+    async def get_recent_mail_headers(count: int = 20) -> List[EmailHeader]:
+        """get <count> (default of 20) most recent emails from your inbox,
+        without their bodies. read one in full with outlook://mail/message/{id}
+        returns: email id, subject, delivery time, from address, and preview
+        """
+        return await list_headers(int(count), unread_only=False)
+
+    @mcp.resource(
+        "outlook://mail/unread/{count}/headers", name="Get Unread Email Headers"
+    )
+    @single_flight
+    async def get_unread_mail_headers(count: int = 20) -> List[EmailHeader]:
+        """get <count> (default of 20) most recent unread emails from your
+        inbox, without their bodies. read one in full with
+        outlook://mail/message/{id}
+        returns: email id, subject, delivery time, from address, and preview
+        """
+        return await list_headers(int(count), unread_only=True)
+
+    @mcp.resource("outlook://mail/message/{id}", name="Get Email")
+    @single_flight
+    async def get_message(id: str) -> EmailMessage:
+        """get a single email by its id, e.g. one from a headers listing
+        returns: email id, subject, delivery time, from address, and body
+        """
+        token = get_access_token()
+
+        # inbox messages are usually in the delta-synced cache already
+        mailbox_cache = get_mailbox_cache()
+        if mailbox_cache:
+            cached = mailbox_cache.get_message(get_user_id(token), id)
+            if cached is not None:
+                return cached
+
+        client = get_graph_client(token.token)
+
+        from kiota_abstractions.base_request_configuration import RequestConfiguration
+        from msgraph.generated.users.item.messages.item.message_item_request_builder import (
+            MessageItemRequestBuilder,
+        )
+
+        query_params = (
+            MessageItemRequestBuilder.MessageItemRequestBuilderGetQueryParameters(
+                select=["id", "sender", "subject", "receivedDateTime", body_field],
+            )
+        )
+        request_configuration = RequestConfiguration(query_parameters=query_params)
+        # have graph convert bodies to text so we don't have to parse html
+        request_configuration.headers.add("Prefer", 'outlook.body-content-type="text"')
+
+        message_builder = client.me.messages.by_message_id(id)
+        if raw_json:
+            msg = await get_json(message_builder, request_configuration)
+            header = header_from_json(msg)
+            body = msg.get(body_field)
+        else:
+            msg = await message_builder.get(request_configuration=request_configuration)
+            header = header_from_model(msg)
+            body = msg.unique_body if body_field == "uniqueBody" else msg.body
+
+        ((body_text, truncated),) = await parse_email_bodies([body])
+        header.pop("preview")
+        return {**header, "body": body_text, "body_truncated": truncated}
 
     @mcp.resource("outlook://mail/folders", name="Get Folders In Mailbox")
+    @single_flight
     async def get_mail_folders() -> list:
         """gets folders in your mailbox
         returns: folder name, path, and ID
@@ -120,18 +376,77 @@ def setup_mail_resources(mcp: FastMCP):
         token = get_access_token()
         client = get_graph_client(token.token)
 
-        # Fetch mail folders
-        folders_resp = await client.me.mail_folders.get()
+        # folders hardly ever change, so keep them in sync with
+        # mailFolders/delta rather than listing them every time
+        resource_cache = get_resource_cache()
+        if resource_cache:
 
-        folders = []
-        if folders_resp and folders_resp.value:
-            for folder in folders_resp.value:
-                folders.append(
+            async def load(state):
+                state = await sync_mail_folders(client, state)
+                folders = [
                     {
-                        "name": folder.display_name,
-                        "id": folder.id,
-                        "path": getattr(folder, "parent_folder_id", None),
+                        "name": folder["name"],
+                        "id": folder["id"],
+                        "path": folder["parent_id"],
                     }
-                )
+                    for folder in top_level_folders(state["folders"])
+                ]
+                return folders, state
+
+            return await resource_cache.get(
+                get_user_id(token), "mail_folders", folders_ttl, load
+            )
+
+        # Fetch mail folders, every page of them
+        folders = []
+        pages = iterate_pages(client.me.mail_folders, raw=raw_json)
+        async with aclosing(pages):
+            async for page in pages:
+                for folder in page:
+                    if raw_json:
+                        folders.append(
+                            {
+                                "name": folder.get("displayName"),
+                                "id": folder.get("id"),
+                                "path": folder.get("parentFolderId"),
+                            }
+                        )
+                    else:
+                        folders.append(
+                            {
+                                "name": folder.display_name,
+                                "id": folder.id,
+                                "path": getattr(folder, "parent_folder_id", None),
+                            }
+                        )
 
         return folders
+
+    @mcp.resource("outlook://mail/folders/tree", name="Get Mail Folder Tree")
+    @single_flight
+    async def get_mail_folder_tree() -> List[MailFolderNode]:
+        """gets every folder in your mailbox, nested under its parent
+        returns: folder name, full path, ID, unread and total item counts,
+        and child folders
+        """
+        token = get_access_token()
+        client = get_graph_client(token.token)
+
+        async def crawl() -> List[MailFolderNode]:
+            return await crawl_mail_folders(
+                client, concurrency=folder_tree_concurrency, raw=raw_json
+            )
+
+        # crawling the tree takes a request per folder with subfolders,
+        # so it's kept for as long as the folder list is
+        resource_cache = get_resource_cache()
+        if resource_cache:
+
+            async def load(state):
+                return await crawl(), None
+
+            return await resource_cache.get(
+                get_user_id(token), "mail_folder_tree", folders_ttl, load
+            )
+
+        return await crawl()
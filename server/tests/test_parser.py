@@ -0,0 +1,134 @@
+from utils.parser import _extract_text_soup, _extract_text_stream, parse_email_html
+
+import random
+import unittest
+
+# Parity of the streaming tokenizer with the BeautifulSoup extractor
+
+CORPUS = [
+    # a typical outlook message
+    """<html xmlns:o="urn:schemas-microsoft-com:office:office">
+    <head><meta http-equiv="Content-Type" content="text/html; charset=utf-8">
+    <style>p.MsoNormal{margin:0cm;font-family:"Calibri",sans-serif}</style>
+    <!--[if gte mso 9]><xml><o:shapedefaults v:ext="edit"/></xml><![endif]-->
+    </head><body lang="EN-US"><div class="WordSection1">
+    <p class="MsoNormal">Hi team,<o:p></o:p></p>
+    <p class="MsoNormal"><o:p>&nbsp;</o:p></p>
+    <p class="MsoNormal">The Q3 report is attached &amp; ready for review.<br>
+    Thanks,<br>Alex</p></div></body></html>""",
+    # a marketing newsletter laid out with tables
+    """<!DOCTYPE html><html><head><title>Weekly deals</title>
+    <script type="text/javascript">var tracking = "<p>not text</p>";</script>
+    </head><body><table width="600"><tr><td align="center">
+    <img src="logo.png" alt="Logo"><h1>50% off &mdash; this week only</h1>
+    </td></tr><tr><td><a href="#">Shop now &raquo;</a></td><td>&copy; 2024</td>
+    </tr></table><p style="display:none">preheader</p>
+    <template><p>template content</p></template><p>Unsubscribe</p></body></html>""",
+    # a reply quoting the previous message
+    """<div dir="ltr">Sounds good!</div><br><div class="gmail_quote">
+    <div dir="ltr" class="gmail_attr">On Mon, Bob wrote:<br></div>
+    <blockquote style="margin:0 0 0 .8ex"><div>Can we meet at 3?</div>
+    </blockquote></div>""",
+    # ruby annotations, with and without their end tags
+    "<p><ruby>漢<rp>(</rp><rt>kan</rt><rp>)</rp>字<rp>(<rt>ji<rp>)</ruby> done</p>",
+    # elements whose text is dropped, left open
+    "<html><body><p>a<template>hidden<p>b</body></html>after",
+    "<div><template><b>t</b></div><p>out</p>",
+    "<table><tr><td>1<template>q</td><td>2</td></tr></table>end",
+    "<p>one<template>two</p>three</template>four",
+    "<p>x<rt>ruby<p>y</p><div>z</div>",
+    "<script>x<p>still script</p>",
+    "<style>a{}</div>y",
+    # stray, redundant and self-closing tags
+    "<rt>a</rp>b</rt>c",
+    "text<br></br>more<img></img>end</br>tail",
+    "<p/>a<template/>b<br/>c",
+    # comments, declarations, processing instructions and cdata
+    "a<!-- comment -->b<?xml version='1.0'?>c<!DOCTYPE x>d",
+    "<template><![CDATA[kept]]></template><![CDATA[  also kept  ]]>",
+    # entities and whitespace
+    "&lt;tag&gt; &quot;quoted&quot; &#169; &#x263A; &nbsp; x",
+    "  \n  <p>\n\n  spaced   out  \n</p>  \n ",
+    "",
+]
+
+TAGS = [
+    "p",
+    "div",
+    "span",
+    "b",
+    "td",
+    "tr",
+    "table",
+    "template",
+    "rt",
+    "rp",
+    "ruby",
+    "script",
+    "style",
+    "br",
+    "img",
+    "hr",
+    "body",
+    "html",
+    "a",
+    "li",
+    "ul",
+    "TEMPLATE",
+    "Div",
+]
+
+
+def random_markup(rng: random.Random, length: int) -> str:
+    """tag soup made of unbalanced, stray and self-closing tags"""
+    pieces = []
+    for _ in range(length):
+        roll = rng.random()
+        tag = rng.choice(TAGS)
+        if roll < 0.3:
+            pieces.append(f"<{tag}>")
+        elif roll < 0.5:
+            pieces.append(f"</{tag}>")
+        elif roll < 0.55:
+            pieces.append(f"<{tag}/>")
+        elif roll < 0.6:
+            pieces.append(f'<{tag} class="x" style="a:b">')
+        elif roll < 0.63:
+            pieces.append("<!-- c -->")
+        elif roll < 0.65:
+            pieces.append("&amp; &lt;&#169;&nbsp;")
+        elif roll < 0.67:
+            pieces.append("<![CDATA[cd]]>")
+        else:
+            pieces.append(rng.choice(["hello", " world ", "  ", "x\ny", "text"]))
+    return "".join(pieces)
+
+
+class ExtractorParityTest(unittest.TestCase):
+    def test_corpus(self):
+        for html in CORPUS:
+            with self.subTest(html=html[:60]):
+                self.assertEqual(_extract_text_stream(html), _extract_text_soup(html))
+
+    def test_random_markup(self):
+        rng = random.Random(0)
+        for _ in range(2000):
+            html = random_markup(rng, rng.randint(1, 60))
+            with self.subTest(html=html):
+                self.assertEqual(_extract_text_stream(html), _extract_text_soup(html))
+
+    def test_max_chars_stops_early(self):
+        # one paragraph, so the text is never ended by a tag
+        html = "<p>" + "word " * 100000
+        text = _extract_text_stream(html, max_chars=1000)
+        self.assertGreater(len(text), 1000)
+        self.assertLess(len(text), len(html) // 4)
+        self.assertTrue(html[3:].startswith(text))
+
+    def test_open_template_doesnt_hide_the_rest(self):
+        html = "<body><p>Hello<template>x</body><p>after the body</p>"
+        self.assertEqual(parse_email_html(html), "Hello\nafter the body")
+
+
+if __name__ == "__main__":
+    unittest.main()
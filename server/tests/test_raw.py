@@ -0,0 +1,37 @@
+from kiota_serialization_json.json_parse_node import JsonParseNode
+
+from utils.raw import to_isoformat
+
+import unittest
+
+# Parity of raw timestamps with the sdk's parsed datetimes
+
+TIMESTAMPS = [
+    "2024-01-01T10:00:00Z",
+    "2024-01-01T10:00:00.12Z",
+    "2024-01-01T10:00:00.123Z",
+    # graph's usual precision, which fromisoformat() rejects before 3.11
+    "2024-01-01T10:00:00.1234567Z",
+    "2024-01-01T10:00:00.9999999",
+    "2024-01-01T10:00:00.0000000+02:00",
+]
+
+
+class ToIsoformatTest(unittest.TestCase):
+    def test_same_as_sdk(self):
+        for value in TIMESTAMPS:
+            with self.subTest(value=value):
+                self.assertEqual(
+                    to_isoformat(value),
+                    JsonParseNode(value).get_datetime_value().isoformat(),
+                )
+
+    def test_seven_fractional_digits(self):
+        self.assertEqual(
+            to_isoformat("2024-01-01T10:00:00.1234567Z"),
+            "2024-01-01T10:00:00.123456+00:00",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
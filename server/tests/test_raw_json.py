@@ -0,0 +1,108 @@
+from fastmcp import Client
+from fastmcp.client.transports import StreamableHttpTransport
+
+from benchmarks.run import TEMPLATE_ARGUMENTS, _free_port, _start
+from benchmarks.server import user_token
+
+import asyncio
+import os
+import unittest
+
+# Parity of the raw JSON read path with the SDK model path
+
+# every tool with a raw JSON path, with arguments
+TOOL_CALLS = [
+    ("search_emails", {"subject": "quarterly report", "max_results": 30}),
+    (
+        "search_emails",
+        {"subject": "quarterly report", "max_results": 30, "include_body": False},
+    ),
+    ("search_emails", {"sender": "sender3@example.com", "max_results": 10}),
+    ("search_calendar_events", {"title": "sync", "max_results": 30}),
+    ("list_attachments", {"message_id": "AAMk-message-0"}),
+    (
+        "read_attachment",
+        {"message_id": "AAMk-message-0", "attachment_id": "AAMk-attachment-0"},
+    ),
+]
+
+
+async def _read_everything(url: str) -> dict:
+    """every outlook:// resource and every tool call above, as text"""
+    outputs = {}
+    async with Client(StreamableHttpTransport(url, auth=user_token(0))) as client:
+        uris = [str(resource.uri) for resource in await client.list_resources()]
+        for template in await client.list_resource_templates():
+            uri = template.uriTemplate
+            for name, value in TEMPLATE_ARGUMENTS.items():
+                uri = uri.replace("{" + name + "}", value)
+            uris.append(uri)
+        for uri in sorted(uris):
+            if uri.startswith("outlook://") and "{" not in uri:
+                contents = await client.read_resource(uri)
+                outputs[uri] = [content.text for content in contents]
+        for i, (tool, arguments) in enumerate(TOOL_CALLS):
+            result = await client.call_tool(tool, arguments)
+            outputs[f"{i}:{tool}"] = [content.text for content in result.content]
+    return outputs
+
+
+class RawJsonParityTest(unittest.TestCase):
+    """runs two servers against one mock graph, one deserializing
+    sdk models and one projecting graph's JSON directly, and compares
+    everything they return
+    """
+
+    def test_same_output_as_sdk_models(self):
+        graph_port = _free_port()
+        env = dict(os.environ)
+        env.update(
+            {
+                "GRAPH_BASE_URL": f"http://127.0.0.1:{graph_port}/v1.0",
+                "PYTHONWARNINGS": "ignore",
+                # the caches are filled through sdk models in either
+                # mode, so turn them off to exercise the raw reads
+                "MAIL_CACHE": "false",
+                "CALENDAR_CACHE": "false",
+                "RESOURCE_CACHE": "false",
+                "PREFETCH": "false",
+            }
+        )
+        processes = [
+            _start(
+                "benchmarks.mock_graph",
+                graph_port,
+                ["--messages", 60, "--events", 30, "--latency-ms", 0],
+                env,
+            )
+        ]
+        try:
+            outputs = []
+            for raw in ("false", "true"):
+                port = _free_port()
+                processes.append(
+                    _start(
+                        "benchmarks.server",
+                        port,
+                        ["--users", 1],
+                        {**env, "GRAPH_RAW_JSON": raw},
+                    )
+                )
+                outputs.append(
+                    asyncio.run(_read_everything(f"http://127.0.0.1:{port}/mcp/"))
+                )
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait()
+
+        sdk, raw = outputs
+        self.assertEqual(sdk.keys(), raw.keys())
+        self.assertGreater(len(sdk), len(TOOL_CALLS))
+        for name in sdk:
+            with self.subTest(name=name):
+                self.assertEqual(sdk[name], raw[name])
+
+
+if __name__ == "__main__":
+    unittest.main()
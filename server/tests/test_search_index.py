@@ -0,0 +1,91 @@
+from fastmcp import Client
+from fastmcp.client.transports import StreamableHttpTransport
+
+from benchmarks.run import _free_port, _start
+from benchmarks.server import user_token
+
+import asyncio
+import httpx
+import json
+import os
+import time
+import unittest
+
+# Searches answered from the local index
+
+
+async def _search(url: str, **arguments) -> list:
+    async with Client(StreamableHttpTransport(url, auth=user_token(0))) as client:
+        result = await client.call_tool("search_emails", arguments)
+    return json.loads(result.content[0].text)
+
+
+def _wait_for_cache(metrics_url: str, messages: int, timeout: float = 30):
+    """waits until the mailbox cache holds <messages> messages"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if f"outlook_mcp_mail_cache_messages {messages}" in httpx.get(metrics_url).text:
+            return
+        time.sleep(0.2)
+    raise AssertionError(f"the mailbox cache never held {messages} messages")
+
+
+class SearchIndexTest(unittest.TestCase):
+    """warms the index of one user against a mock graph that files
+    every tenth message in Sent Items, and searches it
+    """
+
+    def test_finds_messages_outside_the_inbox(self):
+        graph_port = _free_port()
+        port = _free_port()
+        env = dict(os.environ)
+        env.update(
+            {
+                "GRAPH_BASE_URL": f"http://127.0.0.1:{graph_port}/v1.0",
+                "PYTHONWARNINGS": "ignore",
+                "MAIL_CACHE": "true",
+                "MAIL_SEARCH_INDEX": "true",
+                "PREFETCH": "false",
+            }
+        )
+        processes = [
+            _start(
+                "benchmarks.mock_graph",
+                graph_port,
+                [
+                    "--messages",
+                    60,
+                    "--latency-ms",
+                    0,
+                    "--folder-depth",
+                    1,
+                    "--folder-fanout",
+                    2,
+                ],
+                env,
+            ),
+            _start("benchmarks.server", port, ["--users", 1], env),
+        ]
+        try:
+            url = f"http://127.0.0.1:{port}/mcp/"
+            # the first search goes to graph and starts warming the index
+            asyncio.run(_search(url, sender="sender5@example.com"))
+            _wait_for_cache(f"http://127.0.0.1:{port}/metrics", 60)
+            results = asyncio.run(
+                _search(url, sender="sender5@example.com", include_body=False)
+            )
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait()
+
+        # the mock ignores $search, so only the index narrows it down;
+        # message 5 and 55 are in Sent Items, 30 in the inbox
+        self.assertEqual(
+            sorted(result["id"] for result in results),
+            ["AAMk-message-30", "AAMk-message-5", "AAMk-message-55"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
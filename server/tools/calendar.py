@@ -1,35 +1,231 @@
+from contextlib import aclosing
 from typing import Optional, List
-from datetime import datetime
+from datetime import date, datetime, timedelta
 
 from fastmcp import FastMCP
+from fastmcp.server.context import Context
 from fastmcp.server.dependencies import get_access_token
-
-from msgraph.generated.users.item.calendar.events.events_request_builder import (
-    EventsRequestBuilder,
+from pydantic import BaseModel, Field
+
+from utils.auth import get_client_pool, get_graph_client
+from utils.batch import send_batch
+from utils.config import load_config
+from utils.paging import GRAPH_PAGE_SIZE, iterate_pages
+from utils.schedule import (
+    MAX_SCHEDULES,
+    free_slots,
+    merge_busy,
+    parse_schedule_time,
+    split_span,
 )
-from msgraph.generated.models.event import Event
-from msgraph.generated.models.date_time_time_zone import DateTimeTimeZone
-from msgraph.generated.models.location import Location
-from msgraph.generated.models.attendee import Attendee
-from msgraph.generated.models.email_address import EmailAddress
-from msgraph.generated.models.attendee_type import AttendeeType
-from msgraph.generated.models.item_body import ItemBody
-from msgraph.generated.models.body_type import BodyType
-from kiota_abstractions.base_request_configuration import RequestConfiguration
-
-from utils.auth import get_graph_client
+from utils.singleflight import single_flight
+
+
+class CalendarEventSpec(BaseModel):
+    """one event for create_calendar_events, with the same fields as
+    create_calendar_event takes
+    """
+
+    subject: str = Field(description="The title/subject of the event")
+    start_datetime: str = Field(
+        description="Start date and time in ISO format (YYYY-MM-DDTHH:MM:SS or YYYY-MM-DD for all-day events)"
+    )
+    end_datetime: str = Field(
+        description="End date and time in ISO format (YYYY-MM-DDTHH:MM:SS or YYYY-MM-DD for all-day events)"
+    )
+    timezone: str = Field(default="UTC", description="Timezone for the event")
+    location: Optional[str] = Field(default=None, description="Location of the event")
+    body: Optional[str] = Field(
+        default=None, description="Description/body of the event"
+    )
+    attendees: Optional[List[str]] = Field(
+        default=None, description="List of attendee email addresses"
+    )
+    is_all_day: bool = Field(
+        default=False, description="Whether this is an all-day event"
+    )
+
+
+def _parse_event_time(value: str, is_all_day: bool) -> datetime:
+    """parses an event's start or end, raising ValueError if graph
+    wouldn't accept it
+    """
+    if len(value) == 10:
+        # a bare date is midnight, the same as graph reads it
+        parsed = datetime.combine(date.fromisoformat(value), datetime.min.time())
+    else:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    # all-day events have to start and end at midnight
+    if is_all_day and parsed.time() != datetime.min.time():
+        raise ValueError(f"all-day events must start and end on a date: {value}")
+    return parsed
+
+
+def validate_event(spec: CalendarEventSpec) -> Optional[str]:
+    """checks an event before it's sent to graph, returning what's
+    wrong with it or None if it looks fine
+    """
+    if not spec.subject.strip():
+        return "subject is empty"
+    if not spec.timezone.strip():
+        return "timezone is empty"
+    try:
+        start = _parse_event_time(spec.start_datetime, spec.is_all_day)
+        end = _parse_event_time(spec.end_datetime, spec.is_all_day)
+    except ValueError as e:
+        return f"invalid date/time: {e}"
+    if (start.tzinfo is None) != (end.tzinfo is None):
+        return "start and end must both have a UTC offset, or neither"
+    if end <= start:
+        return "end must be after start"
+    invalid = [address for address in spec.attendees or [] if "@" not in address]
+    if invalid:
+        return f"invalid attendee addresses: {', '.join(invalid)}"
+    return None
+
+
+def event_json(spec: CalendarEventSpec) -> dict:
+    """the graph JSON body that creates <spec>'s event"""
+    start, end = spec.start_datetime, spec.end_datetime
+    if spec.is_all_day:
+        start, end = f"{start[:10]}T00:00:00", f"{end[:10]}T00:00:00"
+    event = {
+        "subject": spec.subject,
+        "isAllDay": spec.is_all_day,
+        "start": {"dateTime": start, "timeZone": spec.timezone},
+        "end": {"dateTime": end, "timeZone": spec.timezone},
+    }
+    if spec.location:
+        event["location"] = {"displayName": spec.location}
+    if spec.body:
+        event["body"] = {"contentType": "text", "content": spec.body}
+    if spec.attendees:
+        event["attendees"] = [
+            {"emailAddress": {"address": address}, "type": "required"}
+            for address in spec.attendees
+        ]
+    return event
 
 
 def setup_calendar_tools(mcp: FastMCP):
     """Register all calendar-related tools"""
 
+    config = load_config()
+    search_max_results = config.get("search_max_results")
+    bulk_max_events = config.get("calendar_bulk_max_events")
+    max_retries = config.get("graph_max_retries")
+    raw_json = config.get("graph_raw_json")
+
+    def event_from_model(event) -> dict:
+        """turns an sdk Event model into a search result"""
+        # Process attendees
+        attendees_list = []
+        if event.attendees:
+            for attendee_obj in event.attendees:
+                if attendee_obj.email_address:
+                    attendees_list.append(
+                        {
+                            "name": attendee_obj.email_address.name,
+                            "address": attendee_obj.email_address.address,
+                            "status": (
+                                attendee_obj.status.response.value
+                                if attendee_obj.status and attendee_obj.status.response
+                                else None
+                            ),
+                        }
+                    )
+
+        # Process location
+        location_str = None
+        if event.location:
+            if event.location.display_name:
+                location_str = event.location.display_name
+            elif event.location.unique_id:
+                location_str = event.location.unique_id
+
+        return {
+            "subject": event.subject,
+            "start": (
+                {
+                    "dateTime": event.start.date_time,
+                    "timeZone": event.start.time_zone,
+                }
+                if event.start
+                else None
+            ),
+            "end": (
+                {
+                    "dateTime": event.end.date_time,
+                    "timeZone": event.end.time_zone,
+                }
+                if event.end
+                else None
+            ),
+            "location": location_str,
+            "is_all_day": event.is_all_day,
+            "organizer": (
+                {
+                    "name": event.organizer.email_address.name,
+                    "address": event.organizer.email_address.address,
+                }
+                if event.organizer and event.organizer.email_address
+                else None
+            ),
+            "attendees": attendees_list,
+            "body_preview": (event.body_preview or "")[:200] or None,
+            "web_link": event.web_link,
+        }
+
+    def event_from_json(event: dict) -> dict:
+        """projects graph's raw event JSON into a search result"""
+        attendees_list = [
+            {
+                "name": attendee["emailAddress"].get("name"),
+                "address": attendee["emailAddress"].get("address"),
+                "status": (attendee.get("status") or {}).get("response"),
+            }
+            for attendee in event.get("attendees") or []
+            if attendee.get("emailAddress")
+        ]
+
+        location = event.get("location") or {}
+        organizer = (event.get("organizer") or {}).get("emailAddress")
+        start = event.get("start")
+        end = event.get("end")
+
+        return {
+            "subject": event.get("subject"),
+            "start": (
+                {"dateTime": start.get("dateTime"), "timeZone": start.get("timeZone")}
+                if start
+                else None
+            ),
+            "end": (
+                {"dateTime": end.get("dateTime"), "timeZone": end.get("timeZone")}
+                if end
+                else None
+            ),
+            "location": location.get("displayName") or location.get("uniqueId"),
+            "is_all_day": event.get("isAllDay"),
+            "organizer": (
+                {"name": organizer.get("name"), "address": organizer.get("address")}
+                if organizer
+                else None
+            ),
+            "attendees": attendees_list,
+            "body_preview": (event.get("bodyPreview") or "")[:200] or None,
+            "web_link": event.get("webLink"),
+        }
+
     @mcp.tool()
+    @single_flight
     async def search_calendar_events(
         title: Optional[str] = None,
         attendee: Optional[str] = None,
         start_date: Optional[str] = None,
         end_date: Optional[str] = None,
         max_results: int = 20,
+        ctx: Context = None,
     ) -> List[dict]:
         """
         Search for calendar events based on various criteria.
@@ -39,10 +235,10 @@ def setup_calendar_tools(mcp: FastMCP):
             attendee: Email address or name of an attendee to search for
             start_date: Search for events starting on or after this date (ISO format: YYYY-MM-DD)
             end_date: Search for events starting on or before this date (ISO format: YYYY-MM-DD)
-            max_results: Maximum number of results to return (default: 20, max: 100)
+            max_results: Maximum number of results to return (default: 20, max: 1000)
 
         Returns:
-            List of calendar events matching the search criteria, including subject, start/end times, location, attendees, and body
+            List of calendar events matching the search criteria, including subject, start/end times, location, attendees, and a plain-text preview of the body
         """
         token = get_access_token()
         client = get_graph_client(token.token)
@@ -76,11 +272,16 @@ def setup_calendar_tools(mcp: FastMCP):
                 "error": "Please provide at least one search criterion (title, attendee, start_date, or end_date)"
             }
 
-        # Limit max_results to 100
-        if max_results > 100:
-            max_results = 100
+        # Limit max_results
+        if max_results > search_max_results:
+            max_results = search_max_results
 
         # Build the query parameters
+        from kiota_abstractions.base_request_configuration import RequestConfiguration
+        from msgraph.generated.users.item.calendar.events.events_request_builder import (
+            EventsRequestBuilder,
+        )
+
         query_params = EventsRequestBuilder.EventsRequestBuilderGetQueryParameters(
             filter=filter_query,
             search=search_query,
@@ -91,11 +292,12 @@ def setup_calendar_tools(mcp: FastMCP):
                 "location",
                 "attendees",
                 "organizer",
-                "body",
+                # only a preview is returned, so don't page in whole bodies
+                "bodyPreview",
                 "isAllDay",
                 "webLink",
             ],
-            top=max_results,
+            top=min(max_results, GRAPH_PAGE_SIZE),
             orderby=["start/dateTime"],
         )
 
@@ -103,79 +305,30 @@ def setup_calendar_tools(mcp: FastMCP):
             query_parameters=query_params,
         )
 
-        # Execute the search
-        events_resp = await client.me.calendar.events.get(
-            request_configuration=request_configuration
-        )
-
-        # Process the results
+        # Execute the search, following next links until we have enough;
+        # each page is cut down to results as it arrives and then dropped
         events = []
-        if events_resp and events_resp.value:
-            for event in events_resp.value:
-                # Process attendees
-                attendees_list = []
-                if event.attendees:
-                    for attendee_obj in event.attendees:
-                        if attendee_obj.email_address:
-                            attendees_list.append(
-                                {
-                                    "name": attendee_obj.email_address.name,
-                                    "address": attendee_obj.email_address.address,
-                                    "status": (
-                                        attendee_obj.status.response.value
-                                        if attendee_obj.status
-                                        and attendee_obj.status.response
-                                        else None
-                                    ),
-                                }
-                            )
-
-                # Process location
-                location_str = None
-                if event.location:
-                    if event.location.display_name:
-                        location_str = event.location.display_name
-                    elif event.location.unique_id:
-                        location_str = event.location.unique_id
-
-                events.append(
-                    {
-                        "subject": event.subject,
-                        "start": (
-                            {
-                                "dateTime": event.start.date_time,
-                                "timeZone": event.start.time_zone,
-                            }
-                            if event.start
-                            else None
-                        ),
-                        "end": (
-                            {
-                                "dateTime": event.end.date_time,
-                                "timeZone": event.end.time_zone,
-                            }
-                            if event.end
-                            else None
-                        ),
-                        "location": location_str,
-                        "is_all_day": event.is_all_day,
-                        "organizer": (
-                            {
-                                "name": event.organizer.email_address.name,
-                                "address": event.organizer.email_address.address,
-                            }
-                            if event.organizer and event.organizer.email_address
-                            else None
-                        ),
-                        "attendees": attendees_list,
-                        "body_preview": (
-                            event.body.content[:200]
-                            if event.body and event.body.content
-                            else None
-                        ),
-                        "web_link": event.web_link,
-                    }
-                )
+        pages = iterate_pages(
+            client.me.calendar.events,
+            request_configuration,
+            max_items=max_results,
+            raw=raw_json,
+        )
+        page_count = 0
+        async with aclosing(pages):
+            async for page in pages:
+                page_count += 1
+                if raw_json:
+                    events.extend(event_from_json(event) for event in page)
+                else:
+                    events.extend(event_from_model(event) for event in page)
+
+                if ctx:
+                    await ctx.report_progress(
+                        progress=len(events),
+                        total=max_results,
+                        message=f"page {page_count}: {len(events)} of up to {max_results} events",
+                    )
 
         return events
 
@@ -206,6 +359,15 @@ def setup_calendar_tools(mcp: FastMCP):
         Returns:
             Created event details including event ID, subject, start/end times, and web link
         """
+        from msgraph.generated.models.attendee import Attendee
+        from msgraph.generated.models.attendee_type import AttendeeType
+        from msgraph.generated.models.body_type import BodyType
+        from msgraph.generated.models.date_time_time_zone import DateTimeTimeZone
+        from msgraph.generated.models.email_address import EmailAddress
+        from msgraph.generated.models.event import Event
+        from msgraph.generated.models.item_body import ItemBody
+        from msgraph.generated.models.location import Location
+
         token = get_access_token()
         client = get_graph_client(token.token)
 
@@ -281,3 +443,257 @@ def setup_calendar_tools(mcp: FastMCP):
             "web_link": created_event.web_link,
             "message": "Event created successfully",
         }
+
+    @mcp.tool()
+    async def find_free_slots(
+        attendees: List[str],
+        start_datetime: str,
+        end_datetime: str,
+        duration_minutes: int = 30,
+        timezone: str = "UTC",
+        include_self: bool = True,
+        tentative_is_busy: bool = True,
+        max_results: int = 20,
+    ) -> dict:
+        """
+        Find times when all attendees are free, e.g. to schedule a meeting.
+
+        Args:
+            attendees: List of attendee email addresses whose calendars to check
+            start_datetime: Start of the window to search, in ISO format (YYYY-MM-DDTHH:MM:SS or YYYY-MM-DD)
+            end_datetime: End of the window to search, in ISO format (YYYY-MM-DDTHH:MM:SS or YYYY-MM-DD)
+            duration_minutes: How long the free slots need to be (default: 30)
+            timezone: Timezone of the window and the returned slots (default: UTC). Examples: "UTC", "Pacific Standard Time"
+            include_self: Whether to check the signed in user's calendar too (default: True)
+            tentative_is_busy: Whether tentatively accepted events count as busy (default: True)
+            max_results: Maximum number of slots to return (default: 20)
+
+        Returns:
+            The free slots everyone shares, earliest first, each with a start and end, and any attendees whose calendars couldn't be read
+        """
+        try:
+            window_start = _parse_event_time(start_datetime, False)
+            window_end = _parse_event_time(end_datetime, False)
+        except ValueError as e:
+            return {"error": f"Invalid date/time: {e}"}
+        if window_start.tzinfo or window_end.tzinfo:
+            return {
+                "error": "Please give the window without a UTC offset and set timezone instead"
+            }
+        if window_end <= window_start:
+            return {"error": "end_datetime must be after start_datetime"}
+        if duration_minutes <= 0:
+            return {"error": "duration_minutes must be positive"}
+
+        token = get_access_token()
+        schedules = list(dict.fromkeys(address.lower() for address in attendees))
+        me = (token.claims or {}).get("email")
+        if include_self and me and me.lower() not in schedules:
+            schedules.insert(0, me.lower())
+        if not schedules:
+            return {"error": "Please provide at least one attendee"}
+
+        # one getSchedule per group of schedules and stretch of the window,
+        # all sent together through $batch
+        requests = [
+            {
+                "method": "POST",
+                "url": "/me/calendar/getSchedule",
+                "headers": {"Prefer": f'outlook.timezone="{timezone}"'},
+                "body": {
+                    "schedules": schedules[i : i + MAX_SCHEDULES],
+                    "startTime": {
+                        "dateTime": span_start.isoformat(),
+                        "timeZone": timezone,
+                    },
+                    "endTime": {"dateTime": span_end.isoformat(), "timeZone": timezone},
+                    # only the schedule items are used, so keep the
+                    # availability view as short as graph allows
+                    "availabilityViewInterval": 1440,
+                },
+            }
+            for i in range(0, len(schedules), MAX_SCHEDULES)
+            for span_start, span_end in split_span(window_start, window_end)
+        ]
+        pool = get_client_pool()
+        responses = await send_batch(
+            pool.http_client,
+            pool.base_url,
+            token.token,
+            requests,
+            max_retries=max_retries,
+        )
+
+        busy_statuses = {"busy", "oof"} | (
+            {"tentative"} if tentative_is_busy else set()
+        )
+        busy = {address: [] for address in schedules}
+        unavailable = {}
+        for request, response in zip(requests, responses):
+            body = response["body"] if isinstance(response["body"], dict) else {}
+            if response["status"] != 200:
+                error = (body.get("error") or {}).get("message") or (
+                    f"graph returned {response['status']}"
+                )
+                for address in request["body"]["schedules"]:
+                    unavailable[address] = error
+                continue
+
+            for schedule in body.get("value") or []:
+                address = (schedule.get("scheduleId") or "").lower()
+                if schedule.get("error"):
+                    unavailable[address] = schedule["error"].get("message")
+                    continue
+                busy.setdefault(address, []).extend(
+                    (
+                        parse_schedule_time(item["start"]["dateTime"]),
+                        parse_schedule_time(item["end"]["dateTime"]),
+                    )
+                    for item in schedule.get("scheduleItems") or []
+                    if item.get("status") in busy_statuses
+                )
+
+        # a calendar we could only read part of is left out entirely
+        slots = free_slots(
+            merge_busy(
+                interval
+                for address, intervals in busy.items()
+                if address not in unavailable
+                for interval in intervals
+            ),
+            window_start,
+            window_end,
+            timedelta(minutes=duration_minutes),
+        )
+        return {
+            "timezone": timezone,
+            "duration_minutes": duration_minutes,
+            "checked": [address for address in schedules if address not in unavailable],
+            "unavailable": [
+                {"address": address, "error": error}
+                for address, error in unavailable.items()
+            ],
+            "slots": [
+                {"start": start.isoformat(), "end": end.isoformat()}
+                for start, end in slots[:max_results]
+            ],
+            "more_slots": len(slots) > max_results,
+        }
+
+    @mcp.tool()
+    async def create_calendar_events(
+        events: List[CalendarEventSpec], ctx: Context = None
+    ) -> dict:
+        """
+        Create several calendar events at once, e.g. a series of sessions or an imported agenda.
+        Every event is checked before any are created; if one is invalid, nothing is created.
+        One event failing to be created doesn't stop the others.
+
+        Args:
+            events: The events to create, each with the same fields as create_calendar_event (subject, start_datetime, end_datetime, timezone, location, body, attendees, is_all_day)
+
+        Returns:
+            How many events were created and failed, and a result for every event in order: its index and status, and either the created event's ID, subject, start/end times and web link, or the error
+        """
+        if not events:
+            return {"error": "Please provide at least one event"}
+        if len(events) > bulk_max_events:
+            return {
+                "error": f"At most {bulk_max_events} events can be created at once, got {len(events)}"
+            }
+
+        invalid = [
+            {"index": i, "error": error}
+            for i, error in enumerate(validate_event(spec) for spec in events)
+            if error
+        ]
+        if invalid:
+            return {
+                "error": "Some events are invalid, none were created",
+                "invalid": invalid,
+            }
+
+        sent = 0
+        created = 0
+
+        async def report(indices: List[int], responses: List[dict]):
+            nonlocal sent, created
+            sent += len(indices)
+            created += sum(
+                1 for response in responses if response["status"] in (200, 201)
+            )
+            if ctx:
+                await ctx.report_progress(
+                    progress=sent,
+                    total=len(events),
+                    message=f"created {created} of {len(events)} events",
+                )
+
+        token = get_access_token()
+        pool = get_client_pool()
+        # writes to one mailbox are throttled per mailbox, so batches are
+        # sent one at a time instead of competing with each other
+        responses = await send_batch(
+            pool.http_client,
+            pool.base_url,
+            token.token,
+            [
+                {
+                    "method": "POST",
+                    "url": "/me/calendar/events",
+                    "body": event_json(spec),
+                }
+                for spec in events
+            ],
+            concurrency=1,
+            max_retries=max_retries,
+            on_chunk=report,
+        )
+
+        results = []
+        for i, response in enumerate(responses):
+            body = response["body"] if isinstance(response["body"], dict) else {}
+            if response["status"] in (200, 201):
+                start = body.get("start")
+                end = body.get("end")
+                results.append(
+                    {
+                        "index": i,
+                        "status": "created",
+                        "id": body.get("id"),
+                        "subject": body.get("subject"),
+                        "start": (
+                            {
+                                "dateTime": start.get("dateTime"),
+                                "timeZone": start.get("timeZone"),
+                            }
+                            if start
+                            else None
+                        ),
+                        "end": (
+                            {
+                                "dateTime": end.get("dateTime"),
+                                "timeZone": end.get("timeZone"),
+                            }
+                            if end
+                            else None
+                        ),
+                        "web_link": body.get("webLink"),
+                    }
+                )
+            else:
+                error = body.get("error") or {}
+                results.append(
+                    {
+                        "index": i,
+                        "status": "failed",
+                        "error": error.get("message")
+                        or f"graph returned {response['status']}",
+                    }
+                )
+
+        return {
+            "created": created,
+            "failed": len(results) - created,
+            "results": results,
+        }
@@ -1,22 +1,143 @@
+from contextlib import aclosing
 from typing import Optional, List
 from datetime import datetime
 
 from fastmcp import FastMCP
+from fastmcp.server.context import Context
 from fastmcp.server.dependencies import get_access_token
 
-from msgraph.generated.users.item.messages.messages_request_builder import (
-    MessagesRequestBuilder,
+from utils.attachments import (
+    attachment_format,
+    attachment_value_url,
+    read_attachment_text,
 )
-from kiota_abstractions.base_request_configuration import RequestConfiguration
+from utils.auth import get_client_pool, get_graph_client, get_user_id
+from utils.config import load_config
+from utils.mailbox import get_mailbox_cache
+from utils.paging import GRAPH_PAGE_SIZE, iterate_pages
+from utils.parser import apply_body_budget, parse_email_bodies
+from utils.raw import get_json, to_isoformat
+from utils.search_index import get_search_index
+from utils.singleflight import single_flight
 
-from utils.auth import get_graph_client
-from utils.parser import parse_email_html
+import httpx
 
 
 def setup_mail_tools(mcp: FastMCP):
     """Register all mail-related tools"""
 
+    config = load_config()
+    body_field = "uniqueBody" if config.get("mail_unique_body") else "body"
+    search_max_results = config.get("search_max_results")
+    raw_json = config.get("graph_raw_json")
+    body_max_chars = config.get("parser_max_body_chars") or None
+    response_max_chars = config.get("parser_max_response_chars") or None
+    attachment_max_chars = config.get("attachment_max_chars")
+    attachment_chunk_size = config.get("attachment_chunk_size")
+    attachment_spill_size = config.get("attachment_spill_size")
+    attachment_max_size = config.get("attachment_max_size")
+
+    async def messages_from_models(
+        page: list, max_chars: Optional[int] = None
+    ) -> List[dict]:
+        """turns a page of sdk Message models into search results"""
+        bodies = await parse_email_bodies(
+            [
+                msg.unique_body if body_field == "uniqueBody" else msg.body
+                for msg in page
+            ],
+            max_chars,
+        )
+        return [
+            {
+                "subject": msg.subject,
+                "delivery_time": (
+                    msg.received_date_time.isoformat()
+                    if msg.received_date_time
+                    else None
+                ),
+                "from_address": {
+                    "name": (
+                        msg.sender.email_address.name
+                        if msg.sender and msg.sender.email_address
+                        else None
+                    ),
+                    "address": (
+                        msg.sender.email_address.address
+                        if msg.sender and msg.sender.email_address
+                        else None
+                    ),
+                },
+                "body": body_text,
+                "body_truncated": truncated,
+            }
+            for msg, (body_text, truncated) in zip(page, bodies)
+        ]
+
+    async def messages_from_json(
+        page: list, max_chars: Optional[int] = None
+    ) -> List[dict]:
+        """projects a page of graph's raw message JSON into search results"""
+        bodies = await parse_email_bodies(
+            [msg.get(body_field) for msg in page], max_chars
+        )
+        return [
+            {
+                "subject": msg.get("subject"),
+                "delivery_time": to_isoformat(msg.get("receivedDateTime")),
+                "from_address": {
+                    "name": (msg.get("sender") or {})
+                    .get("emailAddress", {})
+                    .get("name"),
+                    "address": (msg.get("sender") or {})
+                    .get("emailAddress", {})
+                    .get("address"),
+                },
+                "body": body_text,
+                "body_truncated": truncated,
+            }
+            for msg, (body_text, truncated) in zip(page, bodies)
+        ]
+
+    def header_from_model(msg) -> dict:
+        """turns an sdk Message model into a headers-only search result"""
+        return {
+            "id": msg.id,
+            "subject": msg.subject,
+            "delivery_time": (
+                msg.received_date_time.isoformat() if msg.received_date_time else None
+            ),
+            "from_address": {
+                "name": (
+                    msg.sender.email_address.name
+                    if msg.sender and msg.sender.email_address
+                    else None
+                ),
+                "address": (
+                    msg.sender.email_address.address
+                    if msg.sender and msg.sender.email_address
+                    else None
+                ),
+            },
+            "preview": msg.body_preview or "",
+        }
+
+    def header_from_json(msg: dict) -> dict:
+        """projects graph's raw message JSON into a headers-only search result"""
+        sender = (msg.get("sender") or {}).get("emailAddress", {})
+        return {
+            "id": msg.get("id"),
+            "subject": msg.get("subject"),
+            "delivery_time": to_isoformat(msg.get("receivedDateTime")),
+            "from_address": {
+                "name": sender.get("name"),
+                "address": sender.get("address"),
+            },
+            "preview": msg.get("bodyPreview") or "",
+        }
+
     @mcp.tool()
+    @single_flight
     async def search_emails(
         sender: Optional[str] = None,
         subject: Optional[str] = None,
@@ -24,6 +145,8 @@ def setup_mail_tools(mcp: FastMCP):
         start_date: Optional[str] = None,
         end_date: Optional[str] = None,
         max_results: int = 20,
+        include_body: bool = True,
+        ctx: Context = None,
     ) -> List[dict]:
         """
         Search for emails in your mailbox based on various criteria.
@@ -34,10 +157,11 @@ def setup_mail_tools(mcp: FastMCP):
             body: Text to search for in email body
             start_date: Search for emails received on or after this date (ISO format: YYYY-MM-DD)
             end_date: Search for emails received on or before this date (ISO format: YYYY-MM-DD)
-            max_results: Maximum number of results to return (default: 20, max: 100)
+            max_results: Maximum number of results to return (default: 20, max: 1000)
+            include_body: Whether to return each email's full body (default: true). Set to false to triage by headers, then read the emails you need from outlook://mail/message/{id}
 
         Returns:
-            List of emails matching the search criteria, including subject, sender, delivery time, and body
+            List of emails matching the search criteria, including subject, sender, delivery time, and body (or id and a short preview without include_body)
         """
         token = get_access_token()
         client = get_graph_client(token.token)
@@ -75,57 +199,281 @@ def setup_mail_tools(mcp: FastMCP):
                 "error": "Please provide at least one search criterion (sender, subject, body, start_date, or end_date)"
             }
 
-        # Limit max_results to 100
-        if max_results > 100:
-            max_results = 100
+        # Limit max_results
+        if max_results > search_max_results:
+            max_results = search_max_results
+
+        # Answer from the local index when it holds every message the
+        # search could match
+        search_index = get_search_index()
+        mailbox_cache = get_mailbox_cache()
+        if search_index and mailbox_cache:
+            user_id = get_user_id(token)
+            if search_index.can_answer(user_id, start_date):
+                await mailbox_cache.refresh(user_id, client)
+            # checked again, the refresh may have had to trim the index
+            if search_index.can_answer(user_id, start_date):
+                return apply_body_budget(
+                    search_index.search(
+                        user_id,
+                        sender=sender,
+                        subject=subject,
+                        body=body,
+                        start_date=start_date,
+                        end_date=end_date,
+                        max_results=max_results,
+                        headers_only=not include_body,
+                    )
+                )
+            # otherwise fill it in the background and fall back to graph
+            if not search_index.is_warm(user_id):
+                mailbox_cache.warm(user_id, client)
+
+        # Graph can't combine $search with $filter on messages, so fold
+        # the filters into the search as KQL property restrictions
+        if search_query and filter_query:
+            kql_terms = [search_query.replace('"', "")]
+            if sender:
+                kql_terms.append(f"from:{sender}")
+            if start_date:
+                kql_terms.append(f"received>={start_date}")
+            if end_date:
+                kql_terms.append(f"received<={end_date}")
+            search_query = '"' + " ".join(kql_terms) + '"'
+            filter_query = None
 
         # Build the query parameters
+        from kiota_abstractions.base_request_configuration import RequestConfiguration
+        from msgraph.generated.users.item.messages.messages_request_builder import (
+            MessagesRequestBuilder,
+        )
+
+        # without bodies, graph's preview is all we ask for
+        select = (
+            ["sender", "subject", "receivedDateTime", body_field]
+            if include_body
+            else ["id", "sender", "subject", "receivedDateTime", "bodyPreview"]
+        )
         query_params = MessagesRequestBuilder.MessagesRequestBuilderGetQueryParameters(
             filter=filter_query,
             search=search_query,
-            select=["sender", "subject", "receivedDateTime", "body"],
-            top=max_results,
+            select=select,
+            top=min(max_results, GRAPH_PAGE_SIZE),
         )
 
         request_configuration = RequestConfiguration(
             query_parameters=query_params,
         )
+        # have graph convert bodies to text so we don't have to parse html
+        if include_body:
+            request_configuration.headers.add(
+                "Prefer", 'outlook.body-content-type="text"'
+            )
 
-        # Execute the search
-        message_resp = await client.me.messages.get(
-            request_configuration=request_configuration
+        # Execute the search, following next links until we have enough;
+        # each page is cut down to results as it arrives and then dropped
+        messages = []
+        # what's left of the response's body budget, so later pages
+        # parse no more than can still be returned
+        remaining = response_max_chars
+        pages = iterate_pages(
+            client.me.messages,
+            request_configuration,
+            max_items=max_results,
+            raw=raw_json,
         )
+        page_count = 0
+        async with aclosing(pages):
+            async for page in pages:
+                page_count += 1
+                if not include_body:
+                    messages.extend(
+                        header_from_json(msg) if raw_json else header_from_model(msg)
+                        for msg in page
+                    )
+                else:
+                    max_chars = (
+                        body_max_chars
+                        if remaining is None
+                        else min(remaining, body_max_chars or remaining)
+                    )
+                    results = await (
+                        messages_from_json(page, max_chars)
+                        if raw_json
+                        else messages_from_models(page, max_chars)
+                    )
+                    if remaining is not None:
+                        remaining = max(
+                            0,
+                            remaining - sum(len(msg["body"]) for msg in results),
+                        )
+                    messages.extend(results)
 
-        # Process the results
-        messages = []
-        if message_resp and message_resp.value:
-            for msg in message_resp.value:
-                messages.append(
-                    {
-                        "subject": msg.subject,
-                        "delivery_time": (
-                            msg.received_date_time.isoformat()
-                            if msg.received_date_time
-                            else None
-                        ),
-                        "from_address": {
-                            "name": (
-                                msg.sender.email_address.name
-                                if msg.sender and msg.sender.email_address
-                                else None
-                            ),
-                            "address": (
-                                msg.sender.email_address.address
-                                if msg.sender and msg.sender.email_address
-                                else None
-                            ),
-                        },
-                        "body": (
-                            parse_email_html(msg.body.content)
-                            if msg.body and msg.body.content
-                            else ""
-                        ),
-                    }
+                if ctx:
+                    await ctx.report_progress(
+                        progress=len(messages),
+                        total=max_results,
+                        message=f"page {page_count}: {len(messages)} of up to {max_results} emails",
+                    )
+
+        return apply_body_budget(messages)
+
+    def attachment_from_model(attachment) -> dict:
+        """turns an sdk Attachment model into an attachment listing"""
+        return {
+            "id": attachment.id,
+            "name": attachment.name,
+            "content_type": attachment.content_type,
+            "size": attachment.size,
+            "is_inline": attachment.is_inline,
+            # file, item (an attached email or event) or reference (a link)
+            "kind": (attachment.odata_type or "")
+            .rsplit(".", 1)[-1]
+            .removesuffix("Attachment")
+            .lower()
+            or None,
+        }
+
+    def attachment_from_json(attachment: dict) -> dict:
+        """projects graph's raw attachment JSON into an attachment listing"""
+        return {
+            "id": attachment.get("id"),
+            "name": attachment.get("name"),
+            "content_type": attachment.get("contentType"),
+            "size": attachment.get("size"),
+            "is_inline": attachment.get("isInline"),
+            "kind": (attachment.get("@odata.type") or "")
+            .rsplit(".", 1)[-1]
+            .removesuffix("Attachment")
+            .lower()
+            or None,
+        }
+
+    @mcp.tool()
+    async def list_attachments(message_id: str) -> List[dict]:
+        """
+        List the attachments of an email, without downloading them.
+
+        Args:
+            message_id: The ID of the email, as returned by search_emails or the mail header resources
+
+        Returns:
+            List of attachments, each with its ID, name, content type, size in bytes, whether it's inline, and its kind (file, item or reference)
+        """
+        from kiota_abstractions.base_request_configuration import RequestConfiguration
+        from msgraph.generated.users.item.messages.item.attachments.attachments_request_builder import (
+            AttachmentsRequestBuilder,
+        )
+
+        token = get_access_token()
+        client = get_graph_client(token.token)
+
+        # never ask for contentBytes, that's the whole file base64 encoded
+        query_params = (
+            AttachmentsRequestBuilder.AttachmentsRequestBuilderGetQueryParameters(
+                select=["id", "name", "contentType", "size", "isInline"],
+            )
+        )
+        request_configuration = RequestConfiguration(query_parameters=query_params)
+
+        attachments = []
+        pages = iterate_pages(
+            client.me.messages.by_message_id(message_id).attachments,
+            request_configuration,
+            raw=raw_json,
+        )
+        async with aclosing(pages):
+            async for page in pages:
+                attachments.extend(
+                    (
+                        attachment_from_json(attachment)
+                        if raw_json
+                        else attachment_from_model(attachment)
+                    )
+                    for attachment in page
                 )
+        return attachments
+
+    @mcp.tool()
+    async def read_attachment(
+        message_id: str, attachment_id: str, max_chars: int = 20000
+    ) -> dict:
+        """
+        Download an email attachment and extract its text. Works for plain text, CSV, JSON, XML, HTML, and Word, PowerPoint and Excel (docx, pptx, xlsx) files.
+
+        Args:
+            message_id: The ID of the email
+            attachment_id: The ID of the attachment, as returned by list_attachments
+            max_chars: Maximum number of characters of text to return (default: 20000)
+
+        Returns:
+            The attachment's name, content type, size and extracted text, and whether the text was truncated
+        """
+        from kiota_abstractions.base_request_configuration import RequestConfiguration
+        from msgraph.generated.users.item.messages.item.attachments.item.attachment_item_request_builder import (
+            AttachmentItemRequestBuilder,
+        )
+
+        max_chars = max(1, min(max_chars, attachment_max_chars))
+        token = get_access_token()
+        client = get_graph_client(token.token)
+
+        query_params = (
+            AttachmentItemRequestBuilder.AttachmentItemRequestBuilderGetQueryParameters(
+                select=["id", "name", "contentType", "size", "isInline"],
+            )
+        )
+        request_builder = client.me.messages.by_message_id(
+            message_id
+        ).attachments.by_attachment_id(attachment_id)
+        request_configuration = RequestConfiguration(query_parameters=query_params)
+        if raw_json:
+            attachment = attachment_from_json(
+                await get_json(request_builder, request_configuration)
+            )
+        else:
+            attachment = attachment_from_model(
+                await request_builder.get(request_configuration=request_configuration)
+            )
+
+        if attachment["kind"] != "file":
+            return {
+                **attachment,
+                "error": "Only file attachments have content that can be read",
+            }
+        kind = attachment_format(attachment["name"], attachment["content_type"])
+        if kind is None:
+            return {
+                **attachment,
+                "error": f"Can't extract text from {attachment['content_type']} attachments",
+            }
+        if kind not in ("text", "html") and (attachment["size"] or 0) > (
+            attachment_max_size
+        ):
+            return {
+                **attachment,
+                "error": f"Attachment is larger than {attachment_max_size} bytes",
+            }
+
+        pool = get_client_pool()
+        try:
+            text, truncated = await read_attachment_text(
+                pool.http_client,
+                attachment_value_url(pool.base_url, message_id, attachment_id),
+                token.token,
+                kind,
+                attachment["content_type"],
+                max_chars,
+                chunk_size=attachment_chunk_size,
+                spill_size=attachment_spill_size,
+                max_size=attachment_max_size,
+            )
+        except httpx.HTTPStatusError as e:
+            return {
+                **attachment,
+                "error": f"Couldn't read attachment: Graph returned {e.response.status_code}",
+            }
+        except (ValueError, httpx.HTTPError) as e:
+            return {**attachment, "error": f"Couldn't read attachment: {e}"}
 
-        return messages
+        return {**attachment, "text": text, "truncated": truncated}
@@ -0,0 +1,31 @@
+from msgraph import GraphRequestAdapter
+
+from utils.metrics import timed_sdk_call
+
+# Graph request adapter, imported the first time a client is built
+
+
+class InstrumentedGraphRequestAdapter(GraphRequestAdapter):
+    """
+    A graph request adapter that times how long each request spends
+    being deserialized once graph has answered it.
+    """
+
+    async def send_async(self, *args, **kwargs):
+        return await timed_sdk_call(super().send_async(*args, **kwargs))
+
+    async def send_collection_async(self, *args, **kwargs):
+        return await timed_sdk_call(super().send_collection_async(*args, **kwargs))
+
+    async def send_collection_of_primitive_async(self, *args, **kwargs):
+        return await timed_sdk_call(
+            super().send_collection_of_primitive_async(*args, **kwargs)
+        )
+
+    async def send_primitive_async(self, *args, **kwargs):
+        return await timed_sdk_call(super().send_primitive_async(*args, **kwargs))
+
+    async def send_no_response_content_async(self, *args, **kwargs):
+        return await timed_sdk_call(
+            super().send_no_response_content_async(*args, **kwargs)
+        )
@@ -0,0 +1,338 @@
+from typing import Iterator, Optional, Tuple
+from urllib.parse import quote
+
+from utils.parser import HTMLTextExtractor
+
+import asyncio
+import codecs
+import httpx
+import io
+import mmap
+import os
+import re
+import tempfile
+import xml.etree.ElementTree as ElementTree
+import zipfile
+
+# Streaming attachment downloads and text extraction
+
+# office open xml formats, and the parts of them that hold their text
+OOXML_TYPES = {
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": "docx",
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation": "pptx",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": "xlsx",
+}
+OOXML_PARTS = {
+    "docx": re.compile(r"word/document\.xml"),
+    "pptx": re.compile(r"ppt/slides/slide(\d+)\.xml"),
+    "xlsx": re.compile(r"xl/sharedStrings\.xml"),
+}
+# elements that end a line of text: paragraphs, and shared strings
+OOXML_LINE_TAGS = {"p", "si"}
+
+TEXT_TYPES = {
+    "application/json",
+    "application/xml",
+    "application/csv",
+    "application/x-yaml",
+    "application/javascript",
+}
+EXTENSIONS = {
+    ".txt": "text",
+    ".csv": "text",
+    ".tsv": "text",
+    ".md": "text",
+    ".json": "text",
+    ".xml": "text",
+    ".yaml": "text",
+    ".yml": "text",
+    ".log": "text",
+    ".ics": "text",
+    ".htm": "html",
+    ".html": "html",
+    ".docx": "docx",
+    ".pptx": "pptx",
+    ".xlsx": "xlsx",
+}
+
+
+def attachment_format(
+    name: Optional[str], content_type: Optional[str]
+) -> Optional[str]:
+    """how text can be extracted from an attachment: "text", "html",
+    "docx", "pptx" or "xlsx", or None if it can't be
+    """
+    mime = (content_type or "").split(";")[0].strip().lower()
+    if mime == "text/html":
+        return "html"
+    if mime.startswith("text/") or mime in TEXT_TYPES:
+        return "text"
+    if mime in OOXML_TYPES:
+        return OOXML_TYPES[mime]
+    # senders often label everything application/octet-stream
+    return EXTENSIONS.get(os.path.splitext(name or "")[1].lower())
+
+
+def _charset(content_type: Optional[str]) -> str:
+    match = re.search(r"charset=\"?([\w.-]+)", content_type or "", re.IGNORECASE)
+    if match:
+        try:
+            return codecs.lookup(match.group(1)).name
+        except LookupError:
+            pass
+    return "utf-8"
+
+
+class TextCollector:
+    """collects extracted text until <max_chars> have been gathered"""
+
+    def __init__(self, max_chars: int):
+        self.max_chars = max_chars
+        self.parts = []
+        self.length = 0
+
+    @property
+    def full(self) -> bool:
+        return self.length >= self.max_chars
+
+    def add(self, text: str) -> bool:
+        """adds what fits of <text>, returning whether it's now full"""
+        text = text[: self.max_chars - self.length]
+        if text:
+            self.parts.append(text)
+            self.length += len(text)
+        return self.full
+
+    def text(self) -> str:
+        return "".join(self.parts)
+
+
+class StreamingTextDecoder:
+    """
+    Turns a plain-text or html attachment into text chunk by chunk as
+    it downloads, so neither the bytes nor the document are ever held
+    whole. stops collecting once <max_chars> have been extracted.
+    """
+
+    def __init__(self, kind: str, content_type: Optional[str], max_chars: int):
+        self.decoder = codecs.getincrementaldecoder(_charset(content_type))(
+            errors="replace"
+        )
+        self.html = HTMLTextExtractor() if kind == "html" else None
+        self.collector = TextCollector(max_chars)
+
+    def _collect(self, text: str) -> bool:
+        if self.html is None:
+            return self.collector.add(text)
+        self.html.feed(text)
+        # hand the text over as it's found so the tokenizer never holds much
+        parts, self.html.parts = self.html.parts, []
+        return self.collector.add("".join(part + "\n" for part in parts))
+
+    def feed(self, chunk: bytes) -> bool:
+        """decodes the next chunk, returning whether enough text has
+        been collected to stop downloading
+        """
+        return self._collect(self.decoder.decode(chunk))
+
+    def close(self) -> str:
+        if not self.collector.full:
+            self._collect(self.decoder.decode(b"", final=True))
+            if self.html is not None:
+                self.html.close()
+                self.collector.add("".join(part + "\n" for part in self.html.parts))
+        return self.collector.text()
+
+
+class _MappedFile(io.RawIOBase):
+    """a read-only file over an mmap, which zipfile can't use directly
+    before python 3.13
+    """
+
+    def __init__(self, mapped: mmap.mmap):
+        self._map = mapped
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        return self._map.read(None if size is None or size < 0 else size)
+
+    def readinto(self, buffer) -> int:
+        data = self._map.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        self._map.seek(offset, whence)
+        return self._map.tell()
+
+    def tell(self) -> int:
+        return self._map.tell()
+
+
+class SpillBuffer:
+    """
+    Holds a download in memory until it grows past <spill_size> bytes,
+    then moves it to an anonymous temporary file on disk, so large
+    attachments never sit in memory.
+    """
+
+    def __init__(self, spill_size: int):
+        self.spill_size = spill_size
+        self.size = 0
+        self._buffer: Optional[io.BytesIO] = io.BytesIO()
+        self._file = None
+        self._map: Optional[mmap.mmap] = None
+
+    def write(self, chunk: bytes):
+        if self._file is None and self.size + len(chunk) > self.spill_size:
+            self._file = tempfile.TemporaryFile(prefix="outlook-mcp-attachment-")
+            self._file.write(self._buffer.getbuffer())
+            self._buffer = None
+        (self._file or self._buffer).write(chunk)
+        self.size += len(chunk)
+
+    def open(self):
+        """a seekable view of everything written, memory-mapped if it
+        was spilled to disk
+        """
+        if self._file is None:
+            self._buffer.seek(0)
+            return self._buffer
+        self._file.flush()
+        if self.size == 0:
+            return io.BytesIO()
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return _MappedFile(self._map)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        if self._file is not None:
+            self._file.close()
+        self._buffer = None
+
+
+def _ooxml_parts(archive: zipfile.ZipFile, kind: str) -> Iterator[str]:
+    pattern = OOXML_PARTS[kind]
+    matches = [
+        (match, name)
+        for name in archive.namelist()
+        if (match := pattern.fullmatch(name))
+    ]
+    # slides are numbered, not stored in order
+    matches.sort(key=lambda item: int(item[0].group(1)) if item[0].groups() else 0)
+    return (name for _, name in matches)
+
+
+def extract_ooxml_text(source, kind: str, max_chars: int) -> Tuple[str, bool]:
+    """
+    Extracts the text of a docx, pptx or xlsx file from a seekable
+    <source>, inflating and parsing its xml parts incrementally and
+    dropping each element once it's been read. returns the text and
+    whether it was cut off at <max_chars>.
+    """
+    collector = TextCollector(max_chars)
+    with zipfile.ZipFile(source) as archive:
+        for name in _ooxml_parts(archive, kind):
+            with archive.open(name) as part:
+                stack = []
+                line = []
+                for event, element in ElementTree.iterparse(
+                    part, events=("start", "end")
+                ):
+                    if event == "start":
+                        stack.append(element)
+                        continue
+                    stack.pop()
+                    tag = element.tag.rsplit("}", 1)[-1]
+                    if tag == "t" and element.text:
+                        line.append(element.text)
+                    elif tag in OOXML_LINE_TAGS and line:
+                        if collector.add("".join(line) + "\n"):
+                            return collector.text(), True
+                        line = []
+                    # finished elements are dropped so memory stays flat
+                    if stack:
+                        stack[-1].remove(element)
+                if line and collector.add("".join(line) + "\n"):
+                    return collector.text(), True
+    return collector.text(), False
+
+
+def attachment_value_url(base_url: str, message_id: str, attachment_id: str) -> str:
+    """the url of an attachment's raw content"""
+    return (
+        f"{base_url.rstrip('/')}/me/messages/{quote(message_id, safe='')}"
+        f"/attachments/{quote(attachment_id, safe='')}/$value"
+    )
+
+
+async def read_attachment_text(
+    http_client: httpx.AsyncClient,
+    url: str,
+    token: str,
+    kind: str,
+    content_type: Optional[str],
+    max_chars: int,
+    chunk_size: int = 65536,
+    spill_size: int = 1_048_576,
+    max_size: int = 104_857_600,
+) -> Tuple[str, bool]:
+    """
+    Streams an attachment's content from <url> in <chunk_size> chunks
+    and extracts up to <max_chars> of its text. text and html are
+    decoded as they arrive and the download stops once there's enough;
+    office files are buffered, on disk and memory-mapped past
+    <spill_size> bytes, and read once they're complete. returns the
+    text and whether it was cut off. no more than <max_size> bytes are
+    read: text and html stop there and return what they have, since a
+    tag that never closes or text without tags is held by the tokenizer
+    until it's complete; office files over it raise ValueError, as do
+    ones that aren't valid.
+    """
+    decoder = None
+    buffer = None
+    size = 0
+    if kind in ("text", "html"):
+        decoder = StreamingTextDecoder(kind, content_type, max_chars)
+    else:
+        buffer = SpillBuffer(spill_size)
+
+    try:
+        async with http_client.stream(
+            "GET", url, headers={"Authorization": f"Bearer {token}"}
+        ) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(chunk_size):
+                if decoder is not None:
+                    over = size + len(chunk) > max_size
+                    chunk = chunk[: max_size - size]
+                    size += len(chunk)
+                    # leaving the block closes the connection early
+                    if decoder.feed(chunk) or over:
+                        return decoder.close(), True
+                    continue
+                if buffer.size + len(chunk) > max_size:
+                    raise ValueError(
+                        f"attachment is larger than {max_size} bytes, not reading it"
+                    )
+                buffer.write(chunk)
+
+        if decoder is not None:
+            text = decoder.close()
+            return text, decoder.collector.full
+        # parsing is cpu-bound, keep it off the event loop
+        try:
+            return await asyncio.to_thread(
+                extract_ooxml_text, buffer.open(), kind, max_chars
+            )
+        except (zipfile.BadZipFile, ElementTree.ParseError) as e:
+            raise ValueError(f"not a valid {kind} file: {e}")
+    finally:
+        if buffer is not None:
+            buffer.close()
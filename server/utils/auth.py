@@ -1,18 +1,46 @@
-from azure.core.credentials import AccessToken
-
-from fastmcp.server.auth.providers.azure import AzureProvider
+from fastmcp.server.auth import AccessToken, TokenVerifier
+from fastmcp.server.auth.providers.azure import AzureProvider, AzureTokenVerifier
+from fastmcp.utilities.logging import get_logger
+from fastmcp.server.auth.oauth_proxy import DEFAULT_ACCESS_TOKEN_EXPIRY_SECONDS
 from fastmcp.server.context import Context
+from mcp.server.auth.provider import AuthorizationCode, RefreshToken, TokenError
+from mcp.shared.auth import OAuthClientInformationFull, OAuthToken
 
-from msgraph import GraphServiceClient
+from collections import OrderedDict
+from importlib.util import find_spec
+from typing import TYPE_CHECKING, Optional
 
-from kiota_authentication_azure.azure_identity_authentication_provider import (
-    AzureIdentityAuthenticationProvider,
+from utils.batch import GraphBatchTransport
+from utils.config import load_config
+from utils.metrics import (
+    LATENCY_BUCKETS,
+    GraphMetricsTransport,
+    get_metrics,
+    phase,
 )
+from utils.oauth_state import SQLiteStateStore, use_shared_state
+from utils.scheduler import GraphSchedulerTransport
 
+import asyncio
+import base64
+import hashlib
+import httpx
+import json
+import threading
 import time
 
+# the graph sdk takes a while to import, so it's only imported once a
+# client is first needed (see GRAPH_SDK_PRELOAD)
+if TYPE_CHECKING:
+    from msgraph import GraphServiceClient
+
 # Graph API utilities
 
+logger = get_logger(__name__)
+
+# evict clients this many seconds before their token actually expires
+TOKEN_EXPIRY_SKEW = 60
+
 
 class GraphTokenCredentials:
     def __init__(self, access_token: str, expires_on: int = None):
@@ -26,26 +54,515 @@ class GraphTokenCredentials:
         self.expires_on = expires_on or int(time.time()) + 3600
 
     def get_token(self, *scopes, **kwargs):
+        from azure.core.credentials import AccessToken
+
         return AccessToken(self.access_token, self.expires_on)
 
 
-def get_graph_client(token: str) -> GraphServiceClient:
+def get_token_claims(token: str) -> dict:
+    """reads the claims out of a JWT access token without verifying
+    it. returns an empty dict if the token isn't a readable JWT
+    """
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        return claims if isinstance(claims, dict) else {}
+    except Exception:
+        return {}
+
+
+def get_token_expiry(token: str) -> Optional[int]:
+    """reads the `exp` claim out of a JWT access token without
+    verifying it. returns None if the token isn't a readable JWT
+    """
+    try:
+        return int(get_token_claims(token)["exp"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def hash_token(token: str) -> str:
+    """hashes an access token so it can be used as a cache key
+    without keeping the raw token around as a dict key
+    """
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def get_user_id(token) -> str:
+    """a stable id for the user behind a fastmcp access token,
+    used to key per-user state
+    """
+    claims = token.claims or {}
+    return claims.get("sub") or claims.get("oid") or hash_token(token.token)
+
+
+def _request_keys(request: httpx.Request) -> tuple:
+    """the (user, tenant) a graph request is made for, read from its
+    bearer token, so it can be scheduled against their throttling limits
+    """
+    token = request.headers.get("authorization", "").removeprefix("Bearer ")
+    claims = get_token_claims(token)
+    user = claims.get("oid") or claims.get("sub") or hash_token(token)
+    return user, claims.get("tid") or "unknown"
+
+
+class GraphClientPool:
+    """
+    A bounded pool of graph clients keyed by a hash of the access
+    token. entries are evicted least-recently-used first, and as
+    soon as their token expires. every client shares a single
+    keep-alive HTTP transport so connections are reused across calls
+    and across users, concurrent GETs can be coalesced into `$batch`
+    calls, and every request is scheduled against graph's per-user and
+    per-tenant throttling limits.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 256,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        batch_window: float = 0,
+        scheduler: Optional[dict] = None,
+        base_url: str = "https://graph.microsoft.com/v1.0",
+        instrument: bool = False,
+    ):
+        self.max_size = max_size
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.batch_window = batch_window
+        # GraphSchedulerTransport options, or None to not schedule requests
+        self.scheduler = scheduler
+        self.base_url = base_url
+        # count and time graph requests for the metrics endpoint
+        self.instrument = instrument
+        self._batch_transport: Optional[GraphBatchTransport] = None
+        self._scheduler_transport: Optional[GraphSchedulerTransport] = None
+        self._clients: "OrderedDict[str, tuple[GraphServiceClient, int]]" = (
+            OrderedDict()
+        )
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self._lock = threading.Lock()
+
+    def _build_transport(self) -> httpx.AsyncBaseTransport:
+        transport = httpx.AsyncHTTPTransport(
+            # http/2 needs the optional h2 package
+            http2=find_spec("h2") is not None,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+            ),
+        )
+        if self.batch_window > 0:
+            transport = self._batch_transport = GraphBatchTransport(
+                transport, window=self.batch_window
+            )
+        # scheduled before batching, so each batched request counts
+        # against the limits the way graph counts it
+        if self.scheduler is not None:
+            transport = self._scheduler_transport = GraphSchedulerTransport(
+                transport, key_func=_request_keys, **self.scheduler
+            )
+        if self.instrument:
+            transport = GraphMetricsTransport(transport)
+        return transport
+
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        """the shared http transport, with graph's default middleware"""
+        if self._http_client is None:
+            from msgraph.graph_request_adapter import (
+                options as graph_middleware_options,
+            )
+            from msgraph_core import GraphClientFactory
+
+            from kiota_http.middleware.options import RetryHandlerOption
+
+            client = httpx.AsyncClient(
+                transport=self._build_transport(),
+                timeout=httpx.Timeout(30.0),
+            )
+            # keep the sdk's own middleware options, e.g. rewriting
+            # `/users/me-token-to-replace` to `/me`
+            options = dict(graph_middleware_options)
+            if self.scheduler is not None:
+                # the scheduler retries throttled requests itself, a second
+                # layer of retries would multiply the attempts
+                options[RetryHandlerOption.get_key()] = RetryHandlerOption(
+                    max_retries=0, should_retry=False
+                )
+            self._http_client = GraphClientFactory.create_with_default_middleware(
+                client=client, options=options
+            )
+        return self._http_client
+
+    def _build_client(self, credentials: GraphTokenCredentials) -> "GraphServiceClient":
+        from kiota_authentication_azure.azure_identity_authentication_provider import (
+            AzureIdentityAuthenticationProvider,
+        )
+        from msgraph import GraphServiceClient
+
+        from utils.adapter import InstrumentedGraphRequestAdapter
+
+        auth_provider = AzureIdentityAuthenticationProvider(credentials)
+        request_adapter = InstrumentedGraphRequestAdapter(
+            auth_provider, client=self.http_client
+        )
+        request_adapter.base_url = self.base_url
+        return GraphServiceClient(request_adapter=request_adapter)
+
+    def _evict_expired(self, now: float):
+        expired = [
+            key
+            for key, (_, expires_on) in self._clients.items()
+            if expires_on - TOKEN_EXPIRY_SKEW <= now
+        ]
+        for key in expired:
+            del self._clients[key]
+
+    def get(self, token: str) -> "GraphServiceClient":
+        """returns the pooled client for this token, building one if needed"""
+        key = hash_token(token)
+        now = time.time()
+
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry and entry[1] - TOKEN_EXPIRY_SKEW > now:
+                self._clients.move_to_end(key)
+                return entry[0]
+
+            credentials = GraphTokenCredentials(token, get_token_expiry(token))
+            client = self._build_client(credentials)
+            self._clients[key] = (client, credentials.expires_on)
+            self._clients.move_to_end(key)
+
+            if len(self._clients) > self.max_size:
+                self._evict_expired(now)
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+
+            return client
+
+    def stats(self) -> dict:
+        """counters from the pool and its transports, for /metrics"""
+        stats = {"outlook_mcp_graph_clients": len(self._clients)}
+        if self._batch_transport is not None:
+            stats["outlook_mcp_graph_batches_total"] = (
+                self._batch_transport.batches_sent
+            )
+            stats["outlook_mcp_graph_batched_requests_total"] = (
+                self._batch_transport.requests_batched
+            )
+        if self._scheduler_transport is not None:
+            scheduler = self._scheduler_transport.stats()
+            stats["outlook_mcp_graph_queue_depth"] = scheduler["queue_depth"]
+            stats["outlook_mcp_graph_queue_wait_seconds_total"] = scheduler[
+                "wait_seconds"
+            ]
+            stats["outlook_mcp_graph_throttled_total"] = scheduler["throttled"]
+            stats["outlook_mcp_graph_retries_total"] = scheduler["retries"]
+        return stats
+
+    async def close(self):
+        """drops all pooled clients and closes the shared transport"""
+        with self._lock:
+            self._clients.clear()
+            http_client, self._http_client = self._http_client, None
+        if http_client is not None:
+            await http_client.aclose()
+
+
+_client_pool: Optional[GraphClientPool] = None
+
+
+def get_client_pool() -> GraphClientPool:
+    """get the process-wide graph client pool"""
+    global _client_pool
+    if _client_pool is None:
+        config = load_config()
+        # every worker process has its own pool, but they share graph's
+        # limits, so each one gets its share of them
+        workers = max(1, config.get("workers"))
+        _client_pool = GraphClientPool(
+            max_size=config.get("graph_client_pool_size"),
+            max_connections=config.get("graph_max_connections"),
+            max_keepalive_connections=config.get("graph_max_keepalive_connections"),
+            batch_window=config.get("graph_batch_window_ms") / 1000,
+            scheduler=(
+                {
+                    "user_rate": config.get("graph_user_rate") / workers,
+                    "user_concurrency": max(
+                        1, config.get("graph_user_concurrency") // workers
+                    ),
+                    "tenant_rate": config.get("graph_tenant_rate") / workers,
+                    "tenant_concurrency": max(
+                        1, config.get("graph_tenant_concurrency") // workers
+                    ),
+                    "max_retries": config.get("graph_max_retries"),
+                }
+                if config.get("graph_scheduler")
+                else None
+            ),
+            base_url=config.get("graph_base_url"),
+            instrument=config.get("metrics"),
+        )
+        get_metrics().register_collector(_client_pool.stats)
+    return _client_pool
+
+
+def get_graph_client(token: str) -> "GraphServiceClient":
     """get a microsoft graph API client
     from the access token acquired during
     authentication with the MCP server
     """
-    credentials = GraphTokenCredentials(token)
-    graph_client = GraphServiceClient(credentials=credentials)
-    return graph_client
+    with phase("auth"):
+        return get_client_pool().get(token)
+
+
+# Access token verification
+
+
+class CachedAzureTokenVerifier(AzureTokenVerifier):
+    """
+    Verifies azure access tokens against graph's `/me` like
+    AzureTokenVerifier, over a plain httpx client of its own rather than
+    the graph pool's transports. each verified token is remembered by
+    its hash for up to <ttl> seconds and never past its `exp`, and is
+    re-verified in the background once it's <refresh_after> of the way
+    there. concurrent misses for the same token share one verification.
+    """
+
+    def __init__(
+        self,
+        *,
+        required_scopes: Optional[list] = None,
+        timeout_seconds: int = 10,
+        graph_base_url: str = "https://graph.microsoft.com/v1.0",
+        max_size: int = 1024,
+        ttl: float = 300,
+        refresh_after: float = 0.8,
+    ):
+        super().__init__(
+            required_scopes=required_scopes, timeout_seconds=timeout_seconds
+        )
+        self.graph_base_url = graph_base_url.rstrip("/")
+        self.max_size = max_size
+        self.ttl = ttl
+        self.refresh_after = refresh_after
+        # token hash -> (access token, verified at, trusted until)
+        self._cache: "OrderedDict[str, tuple[AccessToken, float, float]]" = (
+            OrderedDict()
+        )
+        # verifications in flight, background refreshes included, which
+        # also keeps a reference to each task until it's done
+        self._inflight: dict = {}
+        self._client: Optional[httpx.AsyncClient] = None
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        get_metrics().register_collector(self.stats)
+
+    def _http_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout_seconds,
+                headers={"User-Agent": "FastMCP-Azure-OAuth"},
+            )
+        return self._client
+
+    async def _fetch(self, token: str) -> Optional[AccessToken]:
+        start = time.perf_counter()
+        try:
+            response = await self._http_client().get(
+                f"{self.graph_base_url}/me",
+                headers={"Authorization": f"Bearer {token}"},
+            )
+            if response.status_code != 200:
+                logger.debug(
+                    "Azure token verification failed: %d", response.status_code
+                )
+                return None
+            user_data = response.json()
+        except httpx.RequestError as e:
+            logger.debug("Failed to verify Azure token: %s", e)
+            return None
+        except Exception as e:
+            logger.debug("Azure token verification error: %s", e)
+            return None
+        finally:
+            get_metrics().observe(
+                "outlook_mcp_auth_verify_seconds",
+                {},
+                time.perf_counter() - start,
+                LATENCY_BUCKETS,
+            )
+
+        return AccessToken(
+            token=token,
+            client_id=str(user_data.get("id", "unknown")),
+            scopes=self.required_scopes or [],
+            expires_at=None,
+            claims={
+                "sub": user_data.get("id"),
+                "email": user_data.get("mail") or user_data.get("userPrincipalName"),
+                "name": user_data.get("displayName"),
+                "given_name": user_data.get("givenName"),
+                "family_name": user_data.get("surname"),
+                "job_title": user_data.get("jobTitle"),
+                "office_location": user_data.get("officeLocation"),
+            },
+        )
+
+    async def _verify(self, key: str, token: str) -> Optional[AccessToken]:
+        """verifies a token with graph and caches it, or forgets it if
+        graph no longer accepts it
+        """
+        result = await self._fetch(token)
+        if result is None:
+            self._cache.pop(key, None)
+            return None
+
+        now = time.time()
+        trusted_until = now + self.ttl
+        expiry = get_token_expiry(token)
+        if expiry is not None:
+            trusted_until = min(trusted_until, expiry - TOKEN_EXPIRY_SKEW)
+        if trusted_until > now:
+            self._cache[key] = (result, now, trusted_until)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def _start(self, key: str, token: str) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._verify(key, token))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return task
+
+    @staticmethod
+    def _refreshed(task: asyncio.Task):
+        # nobody awaits a background refresh, so its failure is logged
+        # here; the entry stays until it runs out and a caller retries
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Background token verification failed: %s", task.exception())
+
+    async def verify_token(self, token: str) -> Optional[AccessToken]:
+        if self.ttl <= 0:
+            return await self._fetch(token)
+
+        key = hash_token(token)
+        now = time.time()
+        entry = self._cache.get(key)
+        if entry is not None and entry[2] > now:
+            result, verified_at, trusted_until = entry
+            self._cache.move_to_end(key)
+            self.hits += 1
+            # re-verify before the entry runs out, so callers never wait
+            refresh_at = (
+                verified_at + (trusted_until - verified_at) * self.refresh_after
+            )
+            if now >= refresh_at and key not in self._inflight:
+                self.refreshes += 1
+                self._start(key, token).add_done_callback(self._refreshed)
+            return result
+
+        self.misses += 1
+        self._cache.pop(key, None)
+        # one caller going away shouldn't cancel the others' verification
+        return await asyncio.shield(self._start(key, token))
+
+    def stats(self) -> dict:
+        return {
+            "outlook_mcp_auth_token_cache_size": len(self._cache),
+            "outlook_mcp_auth_token_cache_hits_total": self.hits,
+            "outlook_mcp_auth_token_cache_misses_total": self.misses,
+            "outlook_mcp_auth_token_cache_refreshes_total": self.refreshes,
+        }
+
+
+def create_token_verifier(
+    required_scopes: Optional[list] = None,
+) -> CachedAzureTokenVerifier:
+    """the token verifier for incoming requests, configured from the environment"""
+    config = load_config()
+    return CachedAzureTokenVerifier(
+        required_scopes=required_scopes,
+        graph_base_url=config.get("graph_base_url"),
+        max_size=config.get("auth_token_cache_size"),
+        ttl=config.get("auth_token_cache_ttl"),
+    )
 
 
 # Azure Authentication Provider for FastMCP
 
 
 class PatchedAzureProvider(AzureProvider):
+    def __init__(
+        self,
+        *args,
+        state_store: Optional[SQLiteStateStore] = None,
+        token_verifier: Optional[TokenVerifier] = None,
+        **kwargs,
+    ):
+        """
+        An azure OAuth proxy. with a <state_store>, its client registrations,
+        pending authorizations and token mappings are kept there instead of
+        in memory, so several worker processes can share them. incoming
+        tokens are checked with <token_verifier> if one is given
+        """
+        super().__init__(*args, **kwargs)
+        if state_store is not None:
+            use_shared_state(self, state_store)
+        if token_verifier is not None:
+            self._token_validator = token_verifier
+
     def _get_resource_url(self, mcp_path):
         return None  # Force v2.0 behavior
 
+    async def exchange_authorization_code(
+        self,
+        client: OAuthClientInformationFull,
+        authorization_code: AuthorizationCode,
+    ) -> OAuthToken:
+        """
+        Redeems a client code for the tokens stored with it. the parent
+        looks the code up and then discards it, so two workers could both
+        redeem it; here it's popped first, and only the caller that
+        removed it gets the tokens
+        """
+        code_data = self._client_codes.pop(authorization_code.code, None)
+        if not code_data:
+            logger.warning("Authorization code not found or already redeemed")
+            raise TokenError("invalid_grant", "Authorization code not found")
+
+        idp_tokens = code_data["idp_tokens"]
+        access_token_value = idp_tokens["access_token"]
+        refresh_token_value = idp_tokens.get("refresh_token")
+        expires_in = int(
+            idp_tokens.get("expires_in", DEFAULT_ACCESS_TOKEN_EXPIRY_SECONDS)
+        )
+        self._access_tokens[access_token_value] = AccessToken(
+            token=access_token_value,
+            client_id=client.client_id,
+            scopes=authorization_code.scopes,
+            expires_at=int(time.time() + expires_in),
+        )
+        if refresh_token_value:
+            self._refresh_tokens[refresh_token_value] = RefreshToken(
+                token=refresh_token_value,
+                client_id=client.client_id,
+                scopes=authorization_code.scopes,
+                expires_at=None,
+            )
+            self._access_to_refresh[access_token_value] = refresh_token_value
+            self._refresh_to_access[refresh_token_value] = access_token_value
+
+        return OAuthToken(**idp_tokens)
+
     def authorize(self, *args, **kwargs):
         kwargs.pop("resource", None)
         return super().authorize(*args, **kwargs)
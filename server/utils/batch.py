@@ -0,0 +1,316 @@
+from typing import Awaitable, Callable, List, Optional
+from urllib.parse import urlsplit
+
+from utils.scheduler import THROTTLED_STATUS_CODES, retry_after
+
+import asyncio
+import base64
+import httpx
+import json
+import random
+
+# Graph $batch coalescing
+
+# graph accepts at most this many requests in one $batch call
+MAX_BATCH_SIZE = 20
+
+# headers that belong to the outer $batch request, not the sub-requests
+OUTER_HEADERS = {
+    "accept-encoding",
+    "authorization",
+    "connection",
+    "content-length",
+    "host",
+    "user-agent",
+}
+
+
+def _batch_url(request: httpx.Request) -> Optional[str]:
+    """the `$batch` endpoint a request could be sent through, or None
+    if it can't be batched
+    """
+    parts = urlsplit(str(request.url))
+    segments = parts.path.split("/")
+    if len(segments) < 3 or segments[1] not in ("v1.0", "beta"):
+        return None
+    # binary downloads and batches themselves go out on their own
+    if segments[-1] in ("$batch", "$value"):
+        return None
+    return f"{parts.scheme}://{parts.netloc}/{segments[1]}/$batch"
+
+
+def _relative_url(request: httpx.Request) -> str:
+    parts = urlsplit(str(request.url))
+    path = "/" + parts.path.split("/", 2)[2]
+    return f"{path}?{parts.query}" if parts.query else path
+
+
+class GraphBatchTransport(httpx.AsyncBaseTransport):
+    """
+    An httpx transport that coalesces GET requests made by concurrent
+    handlers into graph `$batch` calls. requests for the same user
+    (authorization header) that arrive within <window> seconds of each
+    other are sent as one batch of up to 20, and the sub-responses are
+    fanned back out to the waiting requests as ordinary responses, so
+    the graph middleware (retries, redirects, ...) still sees each one.
+    """
+
+    def __init__(
+        self,
+        transport: httpx.AsyncBaseTransport,
+        window: float = 0.005,
+        max_batch_size: int = MAX_BATCH_SIZE,
+    ):
+        self.transport = transport
+        self.window = window
+        self.max_batch_size = min(max_batch_size, MAX_BATCH_SIZE)
+        self._pending: dict = {}
+        # batches in flight, held so they aren't garbage collected
+        self._sending: set = set()
+        # counters so the effect of batching can be observed
+        self.batches_sent = 0
+        self.requests_batched = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        batch_url = _batch_url(request) if request.method == "GET" else None
+        if batch_url is None or "authorization" not in request.headers:
+            return await self.transport.handle_async_request(request)
+
+        key = (batch_url, request.headers["authorization"])
+        future = asyncio.get_running_loop().create_future()
+        pending = self._pending.setdefault(key, [])
+        pending.append((request, future))
+
+        if len(pending) >= self.max_batch_size:
+            self._flush(key)
+        elif len(pending) == 1:
+            asyncio.get_running_loop().call_later(self.window, self._flush, key)
+
+        return await future
+
+    def _flush(self, key):
+        pending = self._pending.pop(key, None)
+        if pending:
+            task = asyncio.ensure_future(self._send(key, pending))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send_one(self, request: httpx.Request, future: asyncio.Future):
+        try:
+            response = await self.transport.handle_async_request(request)
+            if not future.done():
+                future.set_result(response)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+
+    async def _send(self, key, pending: list):
+        if len(pending) == 1:
+            return await self._send_one(*pending[0])
+
+        batch_url, authorization = key
+        batch = {
+            "requests": [
+                {
+                    "id": str(i),
+                    "method": "GET",
+                    "url": _relative_url(request),
+                    "headers": {
+                        name: value
+                        for name, value in request.headers.items()
+                        if name.lower() not in OUTER_HEADERS
+                    },
+                }
+                for i, (request, _) in enumerate(pending)
+            ]
+        }
+
+        try:
+            response = await self.transport.handle_async_request(
+                httpx.Request(
+                    "POST",
+                    batch_url,
+                    headers={
+                        "Authorization": authorization,
+                        "Content-Type": "application/json",
+                        "Accept": "application/json",
+                    },
+                    content=json.dumps(batch).encode("utf-8"),
+                )
+            )
+            content = await response.aread()
+            await response.aclose()
+            if response.status_code != 200:
+                raise ValueError(f"$batch returned {response.status_code}")
+            sub_responses = json.loads(content).get("responses", [])
+        except Exception:
+            # the batch itself failed, send everything on its own instead
+            await asyncio.gather(
+                *(self._send_one(request, future) for request, future in pending)
+            )
+            return
+
+        self.batches_sent += 1
+        self.requests_batched += len(pending)
+
+        answered = set()
+        for sub in sub_responses:
+            i = int(sub["id"])
+            request, future = pending[i]
+            answered.add(i)
+            if not future.done():
+                future.set_result(self._to_response(request, sub))
+
+        # anything graph didn't answer goes out on its own
+        missing = [item for i, item in enumerate(pending) if i not in answered]
+        if missing:
+            await asyncio.gather(*(self._send_one(*item) for item in missing))
+
+    @staticmethod
+    def _to_response(request: httpx.Request, sub: dict) -> httpx.Response:
+        headers = sub.get("headers") or {}
+        body = sub.get("body")
+        content_type = next(
+            (
+                value
+                for name, value in headers.items()
+                if name.lower() == "content-type"
+            ),
+            "",
+        )
+
+        if body is None:
+            content = b""
+        elif "json" in content_type or not isinstance(body, str):
+            content = json.dumps(body).encode("utf-8")
+        else:
+            # non-json bodies come back base64 encoded
+            content = base64.b64decode(body)
+
+        return httpx.Response(
+            sub.get("status", 500), headers=headers, content=content, request=request
+        )
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def _failed(status: Optional[int], message: str) -> dict:
+    return {
+        "status": status,
+        "headers": {},
+        "body": {"error": {"code": "BatchFailed", "message": message}},
+    }
+
+
+async def _post_batch(
+    http_client: httpx.AsyncClient,
+    batch_url: str,
+    token: str,
+    requests: List[dict],
+    indices: List[int],
+) -> dict:
+    """sends one `$batch` call for the requests at <indices>, returning
+    their sub-responses keyed by index
+    """
+    batch = {
+        "requests": [
+            {
+                "id": str(i),
+                "method": requests[i]["method"],
+                "url": requests[i]["url"],
+                "headers": {
+                    "Content-Type": "application/json",
+                    **(requests[i].get("headers") or {}),
+                },
+                **({"body": requests[i]["body"]} if "body" in requests[i] else {}),
+            }
+            for i in indices
+        ]
+    }
+
+    try:
+        response = await http_client.post(
+            batch_url,
+            headers={"Authorization": f"Bearer {token}"},
+            json=batch,
+        )
+    except httpx.HTTPError as e:
+        return {i: _failed(None, f"$batch request failed: {e}") for i in indices}
+    if response.status_code != 200:
+        return {
+            i: _failed(response.status_code, f"$batch returned {response.status_code}")
+            for i in indices
+        }
+
+    responses = {
+        int(sub["id"]): {
+            "status": sub.get("status"),
+            "headers": sub.get("headers") or {},
+            "body": sub.get("body"),
+        }
+        for sub in response.json().get("responses", [])
+    }
+    return {
+        i: responses.get(i) or _failed(None, "no response in $batch") for i in indices
+    }
+
+
+async def send_batch(
+    http_client: httpx.AsyncClient,
+    base_url: str,
+    token: str,
+    requests: List[dict],
+    concurrency: int = 4,
+    max_retries: int = 3,
+    on_chunk: Optional[Callable[[List[int], List[dict]], Awaitable]] = None,
+) -> List[dict]:
+    """
+    Sends independent graph requests, each a dict with a method, a url
+    relative to <base_url> and optionally a json body and headers,
+    through `$batch` calls of up to 20 with <concurrency> of them in
+    flight. sub-requests graph throttles are sent again once their
+    Retry-After has passed, up to <max_retries> times. returns a
+    {status, headers, body} sub-response for every request, in order;
+    one failing doesn't stop the rest. <on_chunk> is awaited with the
+    indices and final sub-responses of each `$batch` once it's done.
+    """
+    batch_url = f"{base_url.rstrip('/')}/$batch"
+    results: List[Optional[dict]] = [None] * len(requests)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send_chunk(chunk: List[int]):
+        indices = chunk
+        for attempt in range(max_retries + 1):
+            async with semaphore:
+                responses = await _post_batch(
+                    http_client, batch_url, token, requests, indices
+                )
+
+            throttled = []
+            delay = 0.0
+            for i, sub in responses.items():
+                results[i] = sub
+                if sub["status"] in THROTTLED_STATUS_CODES:
+                    throttled.append(i)
+                    wait = retry_after(
+                        httpx.Response(sub["status"], headers=sub["headers"])
+                    )
+                    delay = max(delay, wait if wait is not None else 2**attempt)
+
+            if not throttled or attempt == max_retries:
+                break
+            # jitter so retried chunks don't all land at once
+            await asyncio.sleep(delay + random.uniform(0, 0.1 * (delay or 1)))
+            indices = throttled
+
+        if on_chunk is not None:
+            await on_chunk(chunk, [results[i] for i in chunk])
+
+    await asyncio.gather(
+        *(
+            send_chunk(list(range(start, min(start + MAX_BATCH_SIZE, len(requests)))))
+            for start in range(0, len(requests), MAX_BATCH_SIZE)
+        )
+    )
+    return results
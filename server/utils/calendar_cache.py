@@ -0,0 +1,226 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, List, Optional
+
+from utils.config import load_config
+from utils.metrics import get_metrics
+from utils.schedule import parse_schedule_time
+
+import asyncio
+import threading
+
+if TYPE_CHECKING:
+    from kiota_abstractions.base_request_configuration import RequestConfiguration
+    from msgraph import GraphServiceClient
+
+# Delta-synced calendar window cache
+
+
+def week_window(now: datetime) -> tuple:
+    """the calendar window cached for <now>: the whole week it falls
+    in, from monday midnight to the next monday midnight
+    """
+    start = (now - timedelta(days=now.weekday())).replace(
+        hour=0, minute=0, second=0, microsecond=0
+    )
+    return start, start + timedelta(days=7)
+
+
+class CalendarState:
+    """
+    The cached calendar window of a single user: the event occurrences
+    in it, keyed by id, and the delta link to pick up changes from.
+    """
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.events: dict = {}
+        self.delta_link: Optional[str] = None
+        self.window: Optional[tuple] = None
+        self.lock = asyncio.Lock()
+
+
+class CalendarCache:
+    """
+    A per-user cache of the current week's calendar kept current with
+    graph's `calendarView/delta`. the first read pages in the whole
+    week, every read after that only fetches what changed since the
+    stored delta link. reads for any range inside the week (today,
+    this week) are answered from the same events. users are evicted
+    least-recently-used first.
+    """
+
+    def __init__(self, max_users: int = 100):
+        self.max_users = max_users
+        self._users: "OrderedDict[str, CalendarState]" = OrderedDict()
+        self._lock = threading.Lock()
+        # reads answered from the cache, and passed on to graph
+        self.hits = 0
+        self.misses = 0
+
+    def _get_state(self, user_id: str) -> CalendarState:
+        with self._lock:
+            state = self._users.get(user_id)
+            if state is None:
+                state = self._users[user_id] = CalendarState(user_id)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+            return state
+
+    def _request_configuration(
+        self, window: Optional[tuple] = None
+    ) -> "RequestConfiguration":
+        from kiota_abstractions.base_request_configuration import RequestConfiguration
+        from msgraph.generated.users.item.calendar_view.delta.delta_request_builder import (
+            DeltaRequestBuilder,
+        )
+
+        query_params = None
+        if window:
+            # calendarView/delta takes nothing but the window, $select
+            # and $filter aren't supported
+            query_params = DeltaRequestBuilder.DeltaRequestBuilderGetQueryParameters(
+                start_date_time=window[0].isoformat(),
+                end_date_time=window[1].isoformat(),
+            )
+
+        request_configuration = RequestConfiguration(query_parameters=query_params)
+        request_configuration.headers.add("Prefer", "odata.maxpagesize=100")
+        return request_configuration
+
+    @staticmethod
+    def _apply_page(state: CalendarState, page: list):
+        for event in page:
+            if "@removed" in (event.additional_data or {}):
+                state.events.pop(event.id, None)
+                continue
+
+            entry = {
+                "subject": event.subject,
+                "start_time": event.start.date_time if event.start else None,
+                "end_time": event.end.date_time if event.end else None,
+                "location": event.location.display_name if event.location else None,
+                "organizer": (
+                    event.organizer.email_address.name
+                    if event.organizer and event.organizer.email_address
+                    else None
+                ),
+            }
+
+            # updates may only carry the properties that changed
+            existing = state.events.get(event.id)
+            if existing:
+                entry = {
+                    key: existing[key] if value is None else value
+                    for key, value in entry.items()
+                }
+            state.events[event.id] = entry
+
+    async def _sync(
+        self, client: "GraphServiceClient", state: CalendarState, window: tuple
+    ):
+        from kiota_abstractions.api_error import APIError
+
+        delta = client.me.calendar_view.delta
+        # a new week starts over with a full sync of its own window
+        if state.window != window:
+            state.events = {}
+            state.delta_link = None
+            state.window = window
+        initial = state.delta_link is None
+
+        try:
+            if initial:
+                resp = await delta.get(
+                    request_configuration=self._request_configuration(window)
+                )
+            else:
+                resp = await delta.with_url(state.delta_link).get(
+                    request_configuration=self._request_configuration()
+                )
+        except APIError as e:
+            # the delta token expired, start over with a full sync
+            if e.response_status_code == 410 and not initial:
+                state.events = {}
+                state.delta_link = None
+                return await self._sync(client, state, window)
+            raise
+
+        while resp:
+            self._apply_page(state, resp.value or [])
+            if resp.odata_next_link:
+                resp = await delta.with_url(resp.odata_next_link).get(
+                    request_configuration=self._request_configuration()
+                )
+            else:
+                state.delta_link = resp.odata_delta_link
+                break
+
+    async def sync(self, user_id: str, client: "GraphServiceClient"):
+        """pulls in any changes to a user's current week since the last sync"""
+        state = self._get_state(user_id)
+        async with state.lock:
+            await self._sync(client, state, week_window(datetime.now()))
+
+    async def get_events(
+        self,
+        user_id: str,
+        client: "GraphServiceClient",
+        start: datetime,
+        end: datetime,
+    ) -> Optional[List[dict]]:
+        """returns a user's events overlapping <start> to <end>, sorted
+        by start, syncing any changes first. returns None if the range
+        isn't inside the cached week and the caller should go to graph
+        directly.
+        """
+        window = week_window(start)
+        if end > window[1]:
+            self.misses += 1
+            return None
+
+        state = self._get_state(user_id)
+        async with state.lock:
+            await self._sync(client, state, window)
+            events = []
+            for event in state.events.values():
+                if not event["start_time"] or not event["end_time"]:
+                    continue
+                event_start = parse_schedule_time(event["start_time"])
+                if event_start < end and parse_schedule_time(event["end_time"]) > start:
+                    events.append((event_start, event))
+
+        self.hits += 1
+        events.sort(key=lambda item: item[0])
+        return [dict(event) for _, event in events]
+
+    def stats(self) -> dict:
+        """cache size and hit counters, for /metrics"""
+        with self._lock:
+            users = list(self._users.values())
+        return {
+            "outlook_mcp_calendar_cache_users": len(users),
+            "outlook_mcp_calendar_cache_events": sum(
+                len(state.events) for state in users
+            ),
+            "outlook_mcp_calendar_cache_hits_total": self.hits,
+            "outlook_mcp_calendar_cache_misses_total": self.misses,
+        }
+
+
+_calendar_cache: Optional[CalendarCache] = None
+
+
+def get_calendar_cache() -> Optional[CalendarCache]:
+    """get the process-wide calendar cache, or None if it's disabled"""
+    global _calendar_cache
+    config = load_config()
+    if not config.get("calendar_cache"):
+        return None
+    if _calendar_cache is None:
+        _calendar_cache = CalendarCache(
+            max_users=config.get("calendar_cache_max_users")
+        )
+        get_metrics().register_collector(_calendar_cache.stats)
+    return _calendar_cache
@@ -1,4 +1,4 @@
-from os import getenv
+from os import cpu_count, getenv
 
 
 def load_config():
@@ -23,4 +23,237 @@ def load_config():
             else f"/auth/callback"
         ),
         "azure_client_secret": getenv("AZURE_CLIENT_SECRET"),
+        # serving: worker processes, and where they keep the oauth proxy's
+        # state ("memory", or "sqlite" to share it between workers)
+        "workers": int(getenv("WORKERS")) if getenv("WORKERS") else 1,
+        "auth_state_backend": (
+            getenv("AUTH_STATE_BACKEND")
+            if getenv("AUTH_STATE_BACKEND")
+            else ("sqlite" if int(getenv("WORKERS") or 1) > 1 else "memory")
+        ),
+        "auth_state_path": (
+            getenv("AUTH_STATE_PATH") if getenv("AUTH_STATE_PATH") else "oauth_state.db"
+        ),
+        # verified access tokens are trusted for this many seconds (0
+        # verifies every request with graph)
+        "auth_token_cache_ttl": (
+            float(getenv("AUTH_TOKEN_CACHE_TTL"))
+            if getenv("AUTH_TOKEN_CACHE_TTL")
+            else 300.0
+        ),
+        "auth_token_cache_size": (
+            int(getenv("AUTH_TOKEN_CACHE_SIZE"))
+            if getenv("AUTH_TOKEN_CACHE_SIZE")
+            else 1024
+        ),
+        # when to import the graph sdk: "lazy" (on first use), "startup"
+        # or "background" (on a thread once the server has started)
+        "graph_sdk_preload": (
+            getenv("GRAPH_SDK_PRELOAD") if getenv("GRAPH_SDK_PRELOAD") else "lazy"
+        ),
+        # graph api endpoint, e.g. a national cloud or a local mock
+        "graph_base_url": (
+            getenv("GRAPH_BASE_URL")
+            if getenv("GRAPH_BASE_URL")
+            else "https://graph.microsoft.com/v1.0"
+        ),
+        # graph client pool
+        "graph_client_pool_size": (
+            int(getenv("GRAPH_CLIENT_POOL_SIZE"))
+            if getenv("GRAPH_CLIENT_POOL_SIZE")
+            else 256
+        ),
+        "graph_max_connections": (
+            int(getenv("GRAPH_MAX_CONNECTIONS"))
+            if getenv("GRAPH_MAX_CONNECTIONS")
+            else 100
+        ),
+        "graph_max_keepalive_connections": (
+            int(getenv("GRAPH_MAX_KEEPALIVE_CONNECTIONS"))
+            if getenv("GRAPH_MAX_KEEPALIVE_CONNECTIONS")
+            else 20
+        ),
+        "graph_batch_window_ms": (
+            float(getenv("GRAPH_BATCH_WINDOW_MS"))
+            if getenv("GRAPH_BATCH_WINDOW_MS")
+            else 0.0
+        ),
+        # throttling-aware request scheduling
+        "graph_scheduler": (
+            getenv("GRAPH_SCHEDULER", "true").lower() in ("1", "true", "yes")
+        ),
+        "graph_user_rate": (
+            float(getenv("GRAPH_USER_RATE")) if getenv("GRAPH_USER_RATE") else 15.0
+        ),
+        "graph_user_concurrency": (
+            int(getenv("GRAPH_USER_CONCURRENCY"))
+            if getenv("GRAPH_USER_CONCURRENCY")
+            else 4
+        ),
+        "graph_tenant_rate": (
+            float(getenv("GRAPH_TENANT_RATE")) if getenv("GRAPH_TENANT_RATE") else 150.0
+        ),
+        "graph_tenant_concurrency": (
+            int(getenv("GRAPH_TENANT_CONCURRENCY"))
+            if getenv("GRAPH_TENANT_CONCURRENCY")
+            else 32
+        ),
+        "graph_max_retries": (
+            int(getenv("GRAPH_MAX_RETRIES")) if getenv("GRAPH_MAX_RETRIES") else 3
+        ),
+        # skip sdk model deserialization on read paths
+        "graph_raw_json": (
+            getenv("GRAPH_RAW_JSON", "").lower() in ("1", "true", "yes")
+        ),
+        # mail bodies
+        "mail_unique_body": (
+            getenv("MAIL_UNIQUE_BODY", "").lower() in ("1", "true", "yes")
+        ),
+        # delta-synced mailbox cache
+        "mail_cache": getenv("MAIL_CACHE", "false").lower() in ("1", "true", "yes"),
+        "mail_cache_max_users": (
+            int(getenv("MAIL_CACHE_MAX_USERS"))
+            if getenv("MAIL_CACHE_MAX_USERS")
+            else 100
+        ),
+        "mail_cache_max_messages": (
+            int(getenv("MAIL_CACHE_MAX_MESSAGES"))
+            if getenv("MAIL_CACHE_MAX_MESSAGES")
+            else 500
+        ),
+        # seconds before folders other than the inbox are synced again
+        "mail_cache_folder_refresh": (
+            float(getenv("MAIL_CACHE_FOLDER_REFRESH"))
+            if getenv("MAIL_CACHE_FOLDER_REFRESH")
+            else 300.0
+        ),
+        # delta-synced cache of the current week's calendar
+        "calendar_cache": (
+            getenv("CALENDAR_CACHE", "true").lower() in ("1", "true", "yes")
+        ),
+        "calendar_cache_max_users": (
+            int(getenv("CALENDAR_CACHE_MAX_USERS"))
+            if getenv("CALENDAR_CACHE_MAX_USERS")
+            else 100
+        ),
+        # background syncs of the mail and calendar caches for active users
+        "prefetch": getenv("PREFETCH", "false").lower() in ("1", "true", "yes"),
+        "prefetch_interval": (
+            float(getenv("PREFETCH_INTERVAL")) if getenv("PREFETCH_INTERVAL") else 60.0
+        ),
+        "prefetch_active_window": (
+            float(getenv("PREFETCH_ACTIVE_WINDOW"))
+            if getenv("PREFETCH_ACTIVE_WINDOW")
+            else 900.0
+        ),
+        "prefetch_concurrency": (
+            int(getenv("PREFETCH_CONCURRENCY")) if getenv("PREFETCH_CONCURRENCY") else 2
+        ),
+        "prefetch_tenant_concurrency": (
+            int(getenv("PREFETCH_TENANT_CONCURRENCY"))
+            if getenv("PREFETCH_TENANT_CONCURRENCY")
+            else 1
+        ),
+        "prefetch_tenant_rate": (
+            float(getenv("PREFETCH_TENANT_RATE"))
+            if getenv("PREFETCH_TENANT_RATE")
+            else 1.0
+        ),
+        # per-user cache of slow-changing resources (folders, categories)
+        "resource_cache": (
+            getenv("RESOURCE_CACHE", "true").lower() in ("1", "true", "yes")
+        ),
+        "resource_cache_max_users": (
+            int(getenv("RESOURCE_CACHE_MAX_USERS"))
+            if getenv("RESOURCE_CACHE_MAX_USERS")
+            else 1000
+        ),
+        "resource_cache_folders_ttl": (
+            float(getenv("RESOURCE_CACHE_FOLDERS_TTL"))
+            if getenv("RESOURCE_CACHE_FOLDERS_TTL")
+            else 300.0
+        ),
+        "resource_cache_categories_ttl": (
+            float(getenv("RESOURCE_CACHE_CATEGORIES_TTL"))
+            if getenv("RESOURCE_CACHE_CATEGORIES_TTL")
+            else 3600.0
+        ),
+        # folder tree crawl: child folder lists fetched at once
+        "mail_folder_tree_concurrency": (
+            int(getenv("MAIL_FOLDER_TREE_CONCURRENCY"))
+            if getenv("MAIL_FOLDER_TREE_CONCURRENCY")
+            else 8
+        ),
+        # create_calendar_events: events accepted in one call
+        "calendar_bulk_max_events": (
+            int(getenv("CALENDAR_BULK_MAX_EVENTS"))
+            if getenv("CALENDAR_BULK_MAX_EVENTS")
+            else 100
+        ),
+        # attachments: most text read_attachment returns, download chunk
+        # size, how much is held in memory before spilling to a temporary
+        # file, and the largest office file it will download
+        "attachment_max_chars": (
+            int(getenv("ATTACHMENT_MAX_CHARS"))
+            if getenv("ATTACHMENT_MAX_CHARS")
+            else 100_000
+        ),
+        "attachment_chunk_size": (
+            int(getenv("ATTACHMENT_CHUNK_SIZE"))
+            if getenv("ATTACHMENT_CHUNK_SIZE")
+            else 65536
+        ),
+        "attachment_spill_size": (
+            int(getenv("ATTACHMENT_SPILL_SIZE"))
+            if getenv("ATTACHMENT_SPILL_SIZE")
+            else 1_048_576
+        ),
+        "attachment_max_size": (
+            int(getenv("ATTACHMENT_MAX_SIZE"))
+            if getenv("ATTACHMENT_MAX_SIZE")
+            else 104_857_600
+        ),
+        # local full-text search index
+        "mail_search_index": (
+            getenv("MAIL_SEARCH_INDEX", "").lower() in ("1", "true", "yes")
+        ),
+        "mail_search_index_path": (
+            getenv("MAIL_SEARCH_INDEX_PATH")
+            if getenv("MAIL_SEARCH_INDEX_PATH")
+            else ":memory:"
+        ),
+        # instrumentation
+        "metrics": getenv("METRICS", "true").lower() in ("1", "true", "yes"),
+        "otel_spans": getenv("OTEL_SPANS", "").lower() in ("1", "true", "yes"),
+        # search tools
+        "search_max_results": (
+            int(getenv("SEARCH_MAX_RESULTS")) if getenv("SEARCH_MAX_RESULTS") else 1000
+        ),
+        # body parsing worker pool
+        "parser_pool": getenv("PARSER_POOL") if getenv("PARSER_POOL") else "thread",
+        "parser_pool_size": (
+            int(getenv("PARSER_POOL_SIZE"))
+            if getenv("PARSER_POOL_SIZE")
+            else min(4, cpu_count() or 1)
+        ),
+        "parser_max_body_size": (
+            int(getenv("PARSER_MAX_BODY_SIZE"))
+            if getenv("PARSER_MAX_BODY_SIZE")
+            else 1_000_000
+        ),
+        # most text kept per body, and across all bodies in one response
+        # (0 for no limit)
+        "parser_max_body_chars": (
+            int(getenv("PARSER_MAX_BODY_CHARS"))
+            if getenv("PARSER_MAX_BODY_CHARS")
+            else 100_000
+        ),
+        "parser_max_response_chars": (
+            int(getenv("PARSER_MAX_RESPONSE_CHARS"))
+            if getenv("PARSER_MAX_RESPONSE_CHARS")
+            else 1_000_000
+        ),
+        "parser_timeout": (
+            float(getenv("PARSER_TIMEOUT")) if getenv("PARSER_TIMEOUT") else 5.0
+        ),
     }
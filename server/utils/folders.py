@@ -0,0 +1,183 @@
+from contextlib import aclosing
+from typing import TYPE_CHECKING, List, Optional
+
+import asyncio
+
+if TYPE_CHECKING:
+    from msgraph import GraphServiceClient
+
+# Delta-synced mail folder hierarchy
+
+
+async def sync_mail_folders(
+    client: "GraphServiceClient", state: Optional[dict] = None
+) -> dict:
+    """
+    Brings a user's mail folders up to date with graph's
+    `mailFolders/delta`. <state> is what the last sync returned, with
+    every folder keyed by id and the delta link to continue from. the
+    first sync (or one whose delta link has expired) pages in every
+    folder, later ones only fetch the folders that changed.
+    """
+    from kiota_abstractions.api_error import APIError
+    from kiota_abstractions.base_request_configuration import RequestConfiguration
+    from msgraph.generated.users.item.mail_folders.delta.delta_request_builder import (
+        DeltaRequestBuilder,
+    )
+
+    delta = client.me.mail_folders.delta
+    initial = state is None or not state.get("delta_link")
+    folders = {} if initial else dict(state["folders"])
+
+    try:
+        if initial:
+            query_params = DeltaRequestBuilder.DeltaRequestBuilderGetQueryParameters(
+                select=[
+                    "displayName",
+                    "parentFolderId",
+                    "childFolderCount",
+                    "unreadItemCount",
+                    "totalItemCount",
+                ]
+            )
+            resp = await delta.get(
+                request_configuration=RequestConfiguration(
+                    query_parameters=query_params
+                )
+            )
+        else:
+            resp = await delta.with_url(state["delta_link"]).get()
+    except APIError as e:
+        # the delta token expired, start over with a full sync
+        if e.response_status_code == 410 and not initial:
+            return await sync_mail_folders(client)
+        raise
+
+    while resp:
+        for folder in resp.value or []:
+            if "@removed" in (folder.additional_data or {}):
+                folders.pop(folder.id, None)
+                continue
+            entry = {
+                "id": folder.id,
+                "name": folder.display_name,
+                "parent_id": folder.parent_folder_id,
+                "child_folder_count": folder.child_folder_count,
+                "unread_item_count": folder.unread_item_count,
+                "total_item_count": folder.total_item_count,
+            }
+            # updates may only carry the properties that changed
+            existing = folders.get(folder.id)
+            if existing:
+                entry = {
+                    key: existing[key] if value is None else value
+                    for key, value in entry.items()
+                }
+            folders[folder.id] = entry
+
+        if resp.odata_next_link:
+            resp = await delta.with_url(resp.odata_next_link).get()
+        else:
+            return {"folders": folders, "delta_link": resp.odata_delta_link}
+
+    return {"folders": folders, "delta_link": None}
+
+
+def top_level_folders(folders: dict) -> List[dict]:
+    """the folders directly under the mailbox root, which is the one
+    parent that isn't itself a folder we've been sent
+    """
+    return [folder for folder in folders.values() if folder["parent_id"] not in folders]
+
+
+# Concurrent crawl of the whole folder tree
+
+# the folder properties a tree node needs
+TREE_FIELDS = [
+    "displayName",
+    "parentFolderId",
+    "childFolderCount",
+    "unreadItemCount",
+    "totalItemCount",
+]
+
+
+def _tree_node(folder, parent_path: str, raw: bool) -> dict:
+    if raw:
+        name = folder.get("displayName")
+        node = {
+            "id": folder.get("id"),
+            "unread_item_count": folder.get("unreadItemCount"),
+            "total_item_count": folder.get("totalItemCount"),
+            "child_folder_count": folder.get("childFolderCount") or 0,
+        }
+    else:
+        name = folder.display_name
+        node = {
+            "id": folder.id,
+            "unread_item_count": folder.unread_item_count,
+            "total_item_count": folder.total_item_count,
+            "child_folder_count": folder.child_folder_count or 0,
+        }
+    return {
+        "name": name,
+        "path": f"{parent_path}/{name}" if parent_path else name,
+        **node,
+        "children": [],
+    }
+
+
+async def crawl_mail_folders(
+    client: "GraphServiceClient", concurrency: int = 8, raw: bool = False
+) -> List[dict]:
+    """
+    Walks a user's whole mail folder hierarchy, following paging at
+    every level. the child folders of up to <concurrency> folders are
+    fetched at once, and only for folders that have any. returns the
+    top-level folders, each with its full path, item counts and
+    children.
+    """
+    from kiota_abstractions.base_request_configuration import RequestConfiguration
+    from msgraph.generated.users.item.mail_folders.mail_folders_request_builder import (
+        MailFoldersRequestBuilder,
+    )
+
+    from utils.paging import iterate_pages
+
+    # the child folder query parameters are the same shape
+    query_params = (
+        MailFoldersRequestBuilder.MailFoldersRequestBuilderGetQueryParameters(
+            select=TREE_FIELDS, top=100
+        )
+    )
+    request_configuration = RequestConfiguration(query_parameters=query_params)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def list_folders(request_builder, parent_path: str) -> List[dict]:
+        nodes = []
+        # only hold a slot while fetching, not while children are crawled
+        async with semaphore:
+            pages = iterate_pages(request_builder, request_configuration, raw=raw)
+            async with aclosing(pages):
+                async for page in pages:
+                    nodes.extend(
+                        _tree_node(folder, parent_path, raw) for folder in page
+                    )
+
+        children = await asyncio.gather(
+            *(
+                list_folders(
+                    client.me.mail_folders.by_mail_folder_id(node["id"]).child_folders,
+                    node["path"],
+                )
+                for node in nodes
+                if node["child_folder_count"]
+            )
+        )
+        for node, node_children in zip(
+            (node for node in nodes if node["child_folder_count"]), children
+        ):
+            node["children"] = node_children
+        return nodes
+
+    return await list_folders(client.me.mail_folders, "")
@@ -0,0 +1,496 @@
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, List, Optional
+
+from utils.config import load_config
+from utils.folders import crawl_mail_folders
+from utils.metrics import get_metrics
+from utils.parser import body_preview, parse_email_bodies
+from utils.search_index import MailSearchIndex, get_search_index
+
+import asyncio
+import threading
+import time
+
+if TYPE_CHECKING:
+    from kiota_abstractions.base_request_configuration import RequestConfiguration
+    from msgraph import GraphServiceClient
+
+# Delta-synced mailbox cache
+
+# sort key for messages that somehow have no received time
+OLDEST = datetime.min.replace(tzinfo=timezone.utc)
+
+
+class MailboxState:
+    """
+    The cached mailbox of a single user: the messages we've seen so far,
+    keyed by id, its folders, and the delta link to pick up each
+    folder's changes from.
+    """
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.messages: dict = {}
+        self.inbox: Optional[str] = None
+        self.folders: Optional[List[str]] = None
+        self.folders_listed_at = 0.0
+        # when every folder was last synced
+        self.synced_at = 0.0
+        self.delta_links: dict = {}
+        # every message received after this is cached, or every message
+        # in the mailbox while it's None
+        self.since: Optional[datetime] = None
+        self.synced = False
+        # one sync of the whole mailbox at a time, and of each folder
+        self.lock = asyncio.Lock()
+        self.folder_locks: dict = {}
+
+
+class MailboxCache:
+    """
+    A per-user cache of the newest messages across every mail folder,
+    the same messages `/me/messages` lists, kept current with each
+    folder's `messages/delta`. graph has no delta for the mailbox as a
+    whole, so the first read starts crawling every folder in the
+    background and goes to graph itself. once that's done, each read
+    syncs the inbox, and the other folders are synced again in the
+    background once they're <folder_refresh> seconds old. users are
+    evicted least-recently-used first.
+    """
+
+    def __init__(
+        self,
+        body_field: str = "body",
+        max_users: int = 100,
+        max_messages: int = 500,
+        folder_refresh: float = 300,
+        folder_concurrency: int = 8,
+        search_index: Optional[MailSearchIndex] = None,
+    ):
+        self.body_field = body_field
+        self.max_users = max_users
+        self.max_messages = max_messages
+        self.folder_refresh = folder_refresh
+        self.folder_concurrency = folder_concurrency
+        self.search_index = search_index
+        self._users: "OrderedDict[str, MailboxState]" = OrderedDict()
+        self._lock = threading.Lock()
+        # background syncs started by warm(), keyed by user
+        self._warming: dict = {}
+        # reads answered from the cache, and passed on to graph
+        self.hits = 0
+        self.misses = 0
+
+    def _get_state(self, user_id: str) -> MailboxState:
+        with self._lock:
+            state = self._users.get(user_id)
+            if state is None:
+                state = self._users[user_id] = MailboxState(user_id)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                evicted, _ = self._users.popitem(last=False)
+                if self.search_index:
+                    self.search_index.drop_user(evicted)
+            return state
+
+    def _request_configuration(self, initial: bool = False) -> "RequestConfiguration":
+        """the request configuration for a delta call. the <initial> call
+        asks for only the newest <max_messages> messages, so graph ends
+        the round, with its delta link, once the cache could be full
+        """
+        from kiota_abstractions.base_request_configuration import RequestConfiguration
+        from msgraph.generated.users.item.mail_folders.item.messages.delta.delta_request_builder import (
+            DeltaRequestBuilder,
+        )
+
+        query_params = None
+        if initial:
+            query_params = DeltaRequestBuilder.DeltaRequestBuilderGetQueryParameters(
+                select=[
+                    "sender",
+                    "subject",
+                    "receivedDateTime",
+                    "isRead",
+                    self.body_field,
+                ],
+                orderby=["receivedDateTime desc"],
+                top=self.max_messages,
+            )
+
+        request_configuration = RequestConfiguration(query_parameters=query_params)
+        # have graph convert bodies to text so we don't have to parse html
+        request_configuration.headers.add(
+            "Prefer", ['outlook.body-content-type="text"', "odata.maxpagesize=100"]
+        )
+        return request_configuration
+
+    async def _apply_page(self, state: MailboxState, folder_id: str, page: list):
+        changed = []
+        removed = []
+        for msg in page:
+            if "@removed" in (msg.additional_data or {}):
+                # a message moved here may already have been seen
+                existing = state.messages.get(msg.id)
+                if existing and existing["folder_id"] == folder_id:
+                    del state.messages[msg.id]
+                    removed.append(msg.id)
+            elif (
+                msg.id not in state.messages
+                and state.since is not None
+                and (
+                    msg.received_date_time is None
+                    or msg.received_date_time <= state.since
+                )
+            ):
+                # a change to a message older than anything cached
+                continue
+            else:
+                changed.append(msg)
+
+        if self.search_index and removed:
+            self.search_index.delete(state.user_id, removed)
+
+        bodies = await parse_email_bodies(
+            [
+                msg.unique_body if self.body_field == "uniqueBody" else msg.body
+                for msg in changed
+            ]
+        )
+        for msg, (body_text, truncated) in zip(changed, bodies):
+            entry = {
+                "subject": msg.subject,
+                "delivery_time": msg.received_date_time,
+                "from_address": (
+                    {
+                        "name": msg.sender.email_address.name,
+                        "address": msg.sender.email_address.address,
+                    }
+                    if msg.sender and msg.sender.email_address
+                    else None
+                ),
+                "body": body_text if msg.body or msg.unique_body else None,
+                "body_truncated": (truncated if msg.body or msg.unique_body else None),
+                "is_read": msg.is_read,
+                "folder_id": folder_id,
+            }
+
+            # updates may only carry the properties that changed
+            existing = state.messages.get(msg.id)
+            if existing:
+                entry = {
+                    key: existing[key] if value is None else value
+                    for key, value in entry.items()
+                }
+            state.messages[msg.id] = entry
+            if self.search_index:
+                self.search_index.upsert(state.user_id, msg.id, entry)
+
+    def _drop(self, state: MailboxState, message_ids: List[str]):
+        for message_id in message_ids:
+            state.messages.pop(message_id, None)
+        if self.search_index and message_ids:
+            self.search_index.delete(state.user_id, message_ids)
+
+    def _drop_folder(self, state: MailboxState, folder_id: str):
+        state.delta_links.pop(folder_id, None)
+        self._drop(
+            state,
+            [
+                message_id
+                for message_id, msg in state.messages.items()
+                if msg["folder_id"] == folder_id
+            ],
+        )
+
+    def _trim(self, state: MailboxState):
+        """drops whatever is no newer than <since>, then the oldest
+        messages past the size cap, moving <since> up to the newest one
+        dropped, so every message after it is still cached
+        """
+        if state.since is not None:
+            self._drop(
+                state,
+                [
+                    message_id
+                    for message_id, msg in state.messages.items()
+                    if (msg["delivery_time"] or OLDEST) <= state.since
+                ],
+            )
+        if len(state.messages) <= self.max_messages:
+            return
+        newest = sorted(
+            state.messages.items(),
+            key=lambda item: item[1]["delivery_time"] or OLDEST,
+            reverse=True,
+        )
+        dropped = newest[self.max_messages :]
+        self._raise_since(state, dropped[0][1]["delivery_time"] or OLDEST)
+        self._drop(state, [message_id for message_id, _ in dropped])
+
+    def _raise_since(self, state: MailboxState, since: datetime):
+        """narrows the cached window to messages received after <since>"""
+        if state.since is None or since > state.since:
+            state.since = since
+        if self.search_index and state.synced:
+            self.search_index.mark_synced(state.user_id, state.since)
+
+    async def _sync_folder(
+        self, client: "GraphServiceClient", state: MailboxState, folder_id: str
+    ):
+        lock = state.folder_locks.setdefault(folder_id, asyncio.Lock())
+        async with lock:
+            await self._pull_folder(client, state, folder_id)
+
+    async def _pull_folder(
+        self, client: "GraphServiceClient", state: MailboxState, folder_id: str
+    ):
+        """pulls in the changes to one folder. an initial sync that
+        reaches the cap raises <since> to the oldest message it fetched,
+        since anything older in the folder was left out
+        """
+        from kiota_abstractions.api_error import APIError
+
+        delta = client.me.mail_folders.by_mail_folder_id(folder_id).messages.delta
+        delta_link = state.delta_links.get(folder_id)
+        initial = delta_link is None
+
+        try:
+            if initial:
+                resp = await delta.get(
+                    request_configuration=self._request_configuration(initial=True)
+                )
+            else:
+                resp = await delta.with_url(delta_link).get(
+                    request_configuration=self._request_configuration()
+                )
+        except APIError as e:
+            # the delta token expired, start this folder over
+            if e.response_status_code == 410 and not initial:
+                self._drop_folder(state, folder_id)
+                return await self._pull_folder(client, state, folder_id)
+            raise
+
+        fetched = 0
+        oldest = None
+        while resp:
+            page = resp.value or []
+            if initial:
+                # in case graph pages past $top anyway, whatever is beyond
+                # the cap is only paged through for the delta link
+                page = page[: self.max_messages - fetched]
+                fetched += len(page)
+                for msg in page:
+                    received = msg.received_date_time or OLDEST
+                    oldest = received if oldest is None else min(oldest, received)
+            await self._apply_page(state, folder_id, page)
+            if resp.odata_next_link:
+                resp = await delta.with_url(resp.odata_next_link).get(
+                    request_configuration=self._request_configuration()
+                )
+            else:
+                state.delta_links[folder_id] = resp.odata_delta_link
+                break
+
+        if initial and fetched >= self.max_messages:
+            self._raise_since(state, oldest)
+
+    async def _sync(self, client: "GraphServiceClient", state: MailboxState):
+        from kiota_abstractions.base_request_configuration import RequestConfiguration
+        from msgraph.generated.users.item.mail_folders.item.mail_folder_item_request_builder import (
+            MailFolderItemRequestBuilder,
+        )
+
+        now = time.monotonic()
+        if state.inbox is None:
+            query_params = MailFolderItemRequestBuilder.MailFolderItemRequestBuilderGetQueryParameters(
+                select=["id"]
+            )
+            inbox = await client.me.mail_folders.by_mail_folder_id("inbox").get(
+                request_configuration=RequestConfiguration(
+                    query_parameters=query_params
+                )
+            )
+            state.inbox = inbox.id
+        if (
+            state.folders is None
+            or now - state.folders_listed_at >= self.folder_refresh
+        ):
+            folders = []
+            stack = await crawl_mail_folders(client, self.folder_concurrency)
+            while stack:
+                node = stack.pop()
+                folders.append(node["id"])
+                stack.extend(node["children"])
+            for folder_id in set(state.delta_links) - set(folders):
+                self._drop_folder(state, folder_id)
+            state.folders = folders
+            state.folders_listed_at = now
+
+        semaphore = asyncio.Semaphore(self.folder_concurrency)
+
+        async def sync_folder(folder_id: str):
+            async with semaphore:
+                await self._sync_folder(client, state, folder_id)
+
+        # every folder finishes before any error is raised, so a failed
+        # sync doesn't leave others running past the lock
+        results = await asyncio.gather(
+            *(sync_folder(folder_id) for folder_id in state.folders),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+        state.synced = True
+        state.synced_at = now
+        self._trim(state)
+        if self.search_index:
+            self.search_index.mark_synced(state.user_id, state.since)
+
+    async def sync(self, user_id: str, client: "GraphServiceClient"):
+        """pulls in any changes to every folder of a user's mailbox"""
+        state = self._get_state(user_id)
+        async with state.lock:
+            await self._sync(client, state)
+
+    def warm(self, user_id: str, client: "GraphServiceClient"):
+        """starts syncing a user's mailbox in the background"""
+        if user_id in self._warming:
+            return
+
+        def done(task: asyncio.Task):
+            self._warming.pop(user_id, None)
+            # a failed warm-up just means a later read starts another
+            if not task.cancelled():
+                task.exception()
+
+        task = asyncio.create_task(self.sync(user_id, client))
+        task.add_done_callback(done)
+        self._warming[user_id] = task
+
+    async def refresh(self, user_id: str, client: "GraphServiceClient") -> bool:
+        """brings a synced mailbox up to date for a read: new inbox mail
+        right away, the other folders in the background once they're
+        due. a mailbox that was never synced starts warming instead, and
+        False is returned, the caller should go to graph directly
+        """
+        state = self._get_state(user_id)
+        if not state.synced:
+            self.warm(user_id, client)
+            return False
+        await self._sync_folder(client, state, state.inbox)
+        self._trim(state)
+        if time.monotonic() - state.synced_at >= self.folder_refresh:
+            self.warm(user_id, client)
+        return True
+
+    async def get_messages(
+        self,
+        user_id: str,
+        client: "GraphServiceClient",
+        count: int,
+        unread_only: bool = False,
+        headers_only: bool = False,
+    ) -> Optional[List[dict]]:
+        """returns the <count> most recent messages for a user, bringing
+        the cache up to date first. with <headers_only>, messages have their id
+        and a preview instead of the body. returns None if the cache
+        can't answer the request and the caller should go to graph
+        directly.
+        """
+        if not await self.refresh(user_id, client):
+            self.misses += 1
+            return None
+
+        state = self._get_state(user_id)
+        messages = [
+            (message_id, msg)
+            for message_id, msg in state.messages.items()
+            if not unread_only or msg["is_read"] is False
+        ]
+        # a cache holding the whole mailbox can come up short, one
+        # holding only its newest part leaves the rest to graph
+        if count > len(messages) and state.since is not None:
+            self.misses += 1
+            return None
+        self.hits += 1
+
+        messages.sort(key=lambda item: item[1]["delivery_time"] or OLDEST, reverse=True)
+        if headers_only:
+            return [
+                {
+                    "id": message_id,
+                    "subject": msg["subject"],
+                    "delivery_time": msg["delivery_time"],
+                    "from_address": msg["from_address"],
+                    "preview": body_preview(msg["body"]),
+                }
+                for message_id, msg in messages[:count]
+            ]
+        return [
+            {
+                "subject": msg["subject"],
+                "delivery_time": msg["delivery_time"],
+                "from_address": msg["from_address"],
+                "body": msg["body"] or "",
+                "body_truncated": bool(msg["body_truncated"]),
+            }
+            for _, msg in messages[:count]
+        ]
+
+    def get_message(self, user_id: str, message_id: str) -> Optional[dict]:
+        """returns one cached message with its body, or None if
+        it isn't cached and the caller should go to graph directly
+        """
+        with self._lock:
+            state = self._users.get(user_id)
+        msg = state.messages.get(message_id) if state else None
+        if msg is None or msg["body"] is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {
+            "id": message_id,
+            "subject": msg["subject"],
+            "delivery_time": msg["delivery_time"],
+            "from_address": msg["from_address"],
+            "body": msg["body"],
+            "body_truncated": bool(msg["body_truncated"]),
+        }
+
+    def stats(self) -> dict:
+        """cache size and hit counters, for /metrics"""
+        with self._lock:
+            users = list(self._users.values())
+        return {
+            "outlook_mcp_mail_cache_users": len(users),
+            "outlook_mcp_mail_cache_messages": sum(
+                len(state.messages) for state in users
+            ),
+            "outlook_mcp_mail_cache_hits_total": self.hits,
+            "outlook_mcp_mail_cache_misses_total": self.misses,
+        }
+
+
+_mailbox_cache: Optional[MailboxCache] = None
+
+
+def get_mailbox_cache() -> Optional[MailboxCache]:
+    """get the process-wide mailbox cache, or None if it's disabled"""
+    global _mailbox_cache
+    config = load_config()
+    if not config.get("mail_cache"):
+        return None
+    if _mailbox_cache is None:
+        _mailbox_cache = MailboxCache(
+            body_field="uniqueBody" if config.get("mail_unique_body") else "body",
+            max_users=config.get("mail_cache_max_users"),
+            max_messages=config.get("mail_cache_max_messages"),
+            folder_refresh=config.get("mail_cache_folder_refresh"),
+            folder_concurrency=config.get("mail_folder_tree_concurrency"),
+            search_index=get_search_index(),
+        )
+        get_metrics().register_collector(_mailbox_cache.stats)
+    return _mailbox_cache
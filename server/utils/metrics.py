@@ -0,0 +1,458 @@
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from importlib.util import find_spec
+from typing import Callable, Optional
+
+from fastmcp.server.middleware import Middleware, MiddlewareContext
+
+from utils.config import load_config
+
+import httpx
+import threading
+import time
+
+# Hot-path metrics, exposed in the prometheus text format
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# type and help text for everything we export
+METRICS = {
+    "outlook_mcp_requests_total": ("counter", "Tool and resource calls"),
+    "outlook_mcp_request_seconds": ("histogram", "Tool and resource latency"),
+    "outlook_mcp_phase_seconds": (
+        "histogram",
+        "Time spent per call in each phase: auth, graph, deserialize, parse, transform",
+    ),
+    "outlook_mcp_response_bytes": ("histogram", "Size of tool and resource results"),
+    "outlook_mcp_graph_requests_total": ("counter", "Graph requests made"),
+    "outlook_mcp_graph_response_bytes_total": ("counter", "Bytes read from Graph"),
+    "outlook_mcp_graph_clients": ("gauge", "Pooled Graph clients"),
+    "outlook_mcp_graph_batches_total": ("counter", "$batch calls sent"),
+    "outlook_mcp_graph_batched_requests_total": (
+        "counter",
+        "Graph requests sent inside a $batch call",
+    ),
+    "outlook_mcp_graph_queue_depth": (
+        "gauge",
+        "Graph requests waiting on the throttling scheduler",
+    ),
+    "outlook_mcp_graph_queue_wait_seconds_total": (
+        "counter",
+        "Time Graph requests spent waiting on the throttling scheduler",
+    ),
+    "outlook_mcp_graph_throttled_total": ("counter", "Graph 429/503 responses"),
+    "outlook_mcp_graph_retries_total": ("counter", "Throttled Graph requests retried"),
+    "outlook_mcp_single_flight_calls_total": (
+        "counter",
+        "Handler executions started by single-flight",
+    ),
+    "outlook_mcp_single_flight_shared_total": (
+        "counter",
+        "Handler calls answered by an execution already in flight",
+    ),
+    "outlook_mcp_single_flight_in_flight": ("gauge", "Handler executions in flight"),
+    "outlook_mcp_auth_verify_seconds": (
+        "histogram",
+        "Time spent verifying access tokens with Graph",
+    ),
+    "outlook_mcp_auth_token_cache_size": ("gauge", "Verified access tokens cached"),
+    "outlook_mcp_auth_token_cache_hits_total": (
+        "counter",
+        "Requests whose access token was already verified",
+    ),
+    "outlook_mcp_auth_token_cache_misses_total": (
+        "counter",
+        "Requests whose access token had to be verified",
+    ),
+    "outlook_mcp_auth_token_cache_refreshes_total": (
+        "counter",
+        "Cached access tokens re-verified in the background",
+    ),
+    "outlook_mcp_resource_cache_entries": (
+        "gauge",
+        "Folder and category lists in the resource cache",
+    ),
+    "outlook_mcp_resource_cache_hits_total": (
+        "counter",
+        "Resource reads answered by the resource cache",
+    ),
+    "outlook_mcp_resource_cache_misses_total": (
+        "counter",
+        "Resource reads loaded from Graph for the first time",
+    ),
+    "outlook_mcp_resource_cache_revalidations_total": (
+        "counter",
+        "Expired resource cache entries brought up to date from Graph",
+    ),
+    "outlook_mcp_mail_cache_users": ("gauge", "Users in the mailbox cache"),
+    "outlook_mcp_mail_cache_messages": ("gauge", "Messages in the mailbox cache"),
+    "outlook_mcp_mail_cache_hits_total": ("counter", "Reads answered by the cache"),
+    "outlook_mcp_mail_cache_misses_total": (
+        "counter",
+        "Reads the cache passed on to Graph",
+    ),
+    "outlook_mcp_prefetch_users": (
+        "gauge",
+        "Recently active users whose caches are kept warm",
+    ),
+    "outlook_mcp_prefetches_total": ("counter", "Background cache syncs run"),
+    "outlook_mcp_prefetch_failures_total": (
+        "counter",
+        "Background cache syncs that failed",
+    ),
+    "outlook_mcp_prefetch_deferred_total": (
+        "counter",
+        "Background cache syncs held back to leave room for live requests",
+    ),
+    "outlook_mcp_calendar_cache_users": ("gauge", "Users in the calendar cache"),
+    "outlook_mcp_calendar_cache_events": ("gauge", "Events in the calendar cache"),
+    "outlook_mcp_calendar_cache_hits_total": (
+        "counter",
+        "Calendar reads answered by the cache",
+    ),
+    "outlook_mcp_calendar_cache_misses_total": (
+        "counter",
+        "Calendar reads the cache passed on to Graph",
+    ),
+}
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class _Histogram:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms keyed by name and labels, plus collectors
+    that report other components' own counters when scraped.
+    """
+
+    def __init__(self):
+        self._counters: dict = {}
+        self._histograms: dict = {}
+        self._collectors: list = []
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, labels: dict, value: float = 1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, labels: dict, value: float, buckets: tuple):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    def register_collector(self, collector: Callable[[], dict]):
+        """registers a function returning {metric name: value}, called
+        every time the metrics are rendered
+        """
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """renders every metric in the prometheus text exposition format"""
+        samples: dict = {}
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                samples.setdefault(name, []).append((name, labels, value))
+            for (name, labels), histogram in self._histograms.items():
+                lines = samples.setdefault(name, [])
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(
+                        (f"{name}_bucket", labels + (("le", bound),), cumulative)
+                    )
+                lines.append(
+                    (f"{name}_bucket", labels + (("le", "+Inf"),), histogram.count)
+                )
+                lines.append((f"{name}_sum", labels, histogram.sum))
+                lines.append((f"{name}_count", labels, histogram.count))
+
+        for collector in self._collectors:
+            for name, value in collector().items():
+                samples.setdefault(name, []).append((name, (), value))
+
+        output = []
+        for name in sorted(samples):
+            kind, description = METRICS.get(name, ("untyped", name))
+            output.append(f"# HELP {name} {description}")
+            output.append(f"# TYPE {name} {kind}")
+            for sample, labels, value in samples[name]:
+                output.append(f"{sample}{_format_labels(labels)} {value}")
+        return "\n".join(output) + "\n"
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics() -> MetricsRegistry:
+    """get the process-wide metrics registry"""
+    return _registry
+
+
+_tracer = None
+
+
+def _get_tracer():
+    """the opentelemetry tracer, or None if spans are turned off"""
+    global _tracer
+    if _tracer is None:
+        _tracer = False
+        # spans need the optional opentelemetry api (installed with kiota)
+        if load_config().get("otel_spans") and find_spec("opentelemetry"):
+            from opentelemetry import trace
+
+            _tracer = trace.get_tracer("outlook-mcp")
+    return _tracer or None
+
+
+def _span(name: str, attributes: dict):
+    tracer = _get_tracer()
+    if tracer is None:
+        return nullcontext()
+    return tracer.start_as_current_span(name, attributes=attributes)
+
+
+# Per-call phase timings
+
+
+class _CallMetrics:
+    """the time one tool or resource call has spent in each phase"""
+
+    def __init__(self, handler: str):
+        self.handler = handler
+        self.phases: dict = {}
+
+    def add(self, phase: str, seconds: float):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+
+_current_call: ContextVar[Optional[_CallMetrics]] = ContextVar(
+    "metrics_current_call", default=None
+)
+# graph time spent inside the current sdk call, see timed_sdk_call
+_sdk_graph_time: ContextVar[Optional[list]] = ContextVar(
+    "metrics_sdk_graph_time", default=None
+)
+
+
+def _handler() -> str:
+    call = _current_call.get()
+    return call.handler if call else "none"
+
+
+@contextmanager
+def phase(name: str):
+    """times a block as one phase of the current tool or resource call"""
+    start = time.perf_counter()
+    with _span(name, {"outlook_mcp.handler": _handler()}):
+        try:
+            yield
+        finally:
+            call = _current_call.get()
+            if call is not None:
+                call.add(name, time.perf_counter() - start)
+
+
+async def timed_sdk_call(awaitable):
+    """awaits an sdk request, counting the time it spends after graph
+    has answered (deserializing the response) as the deserialize phase
+    """
+    graph_time = [0.0]
+    token = _sdk_graph_time.set(graph_time)
+    start = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        _sdk_graph_time.reset(token)
+        call = _current_call.get()
+        if call is not None:
+            elapsed = time.perf_counter() - start
+            call.add("deserialize", max(0.0, elapsed - graph_time[0]))
+
+
+class _MeteredStream(httpx.AsyncByteStream):
+    def __init__(self, stream, on_close: Callable[[int], None]):
+        self.stream = stream
+        self.on_close = on_close
+        self.size = 0
+        self.closed = False
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            self.size += len(chunk)
+            yield chunk
+
+    async def aclose(self):
+        if hasattr(self.stream, "aclose"):
+            await self.stream.aclose()
+        if not self.closed:
+            self.closed = True
+            self.on_close(self.size)
+
+
+class GraphMetricsTransport(httpx.AsyncBaseTransport):
+    """
+    An httpx transport that counts graph requests and the bytes they
+    return, and times each one from being sent until its body has been
+    read, as the graph phase of the call that made it.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        call = _current_call.get()
+        graph_time = _sdk_graph_time.get()
+        handler = call.handler if call else "none"
+        start = time.perf_counter()
+
+        def record(status: str, size: int = 0):
+            elapsed = time.perf_counter() - start
+            if call is not None:
+                call.add("graph", elapsed)
+            if graph_time is not None:
+                graph_time[0] += elapsed
+            labels = {"handler": handler, "method": request.method, "status": status}
+            _registry.inc("outlook_mcp_graph_requests_total", labels)
+            _registry.inc(
+                "outlook_mcp_graph_response_bytes_total", {"handler": handler}, size
+            )
+
+        try:
+            # no urls on spans, they carry message ids and search terms
+            with _span(
+                f"graph {request.method}",
+                {"outlook_mcp.handler": handler, "http.method": request.method},
+            ):
+                response = await self.transport.handle_async_request(request)
+        except Exception:
+            record("error")
+            raise
+
+        def on_close(size: int):
+            record(str(response.status_code), size)
+
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_MeteredStream(response.stream, on_close),
+            extensions=response.extensions,
+            request=request,
+        )
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def _result_size(result) -> int:
+    if isinstance(result, list):
+        # resource contents
+        return sum(
+            (
+                len(item.content.encode("utf-8"))
+                if isinstance(item.content, str)
+                else len(item.content)
+            )
+            for item in result
+        )
+    return sum(
+        len(block.text.encode("utf-8"))
+        for block in getattr(result, "content", None) or []
+        if getattr(block, "text", None)
+    )
+
+
+class MetricsMiddleware(Middleware):
+    """
+    FastMCP middleware that records the latency, result size and
+    per-phase timings of every tool call and resource read. whatever
+    time isn't spent in another phase is counted as transform.
+    """
+
+    async def on_call_tool(self, context: MiddlewareContext, call_next):
+        return await self._measure(context.message.name, context, call_next)
+
+    async def on_read_resource(self, context: MiddlewareContext, call_next):
+        handler = await self._resource_handler(context)
+        return await self._measure(handler, context, call_next)
+
+    @staticmethod
+    async def _resource_handler(context: MiddlewareContext) -> str:
+        """the uri or uri template the resource was registered with, so
+        templated reads don't each get their own label
+        """
+        uri = str(context.message.uri)
+        server = context.fastmcp_context.fastmcp if context.fastmcp_context else None
+        if server is None or uri in await server.get_resources():
+            return uri
+        for template_uri, template in (await server.get_resource_templates()).items():
+            if template.matches(uri) is not None:
+                return template_uri
+        return "unknown"
+
+    async def _measure(self, handler: str, context: MiddlewareContext, call_next):
+        call = _CallMetrics(handler)
+        token = _current_call.set(call)
+        status = "error"
+        start = time.perf_counter()
+        try:
+            with _span(handler, {"outlook_mcp.handler": handler}):
+                result = await call_next(context)
+            status = "ok"
+            _registry.observe(
+                "outlook_mcp_response_bytes",
+                {"handler": handler},
+                _result_size(result),
+                SIZE_BUCKETS,
+            )
+            return result
+        finally:
+            _current_call.reset(token)
+            elapsed = time.perf_counter() - start
+            labels = {"handler": handler}
+            _registry.inc("outlook_mcp_requests_total", {**labels, "status": status})
+            _registry.observe(
+                "outlook_mcp_request_seconds", labels, elapsed, LATENCY_BUCKETS
+            )
+            # phases can overlap (e.g. prefetching the next page while
+            # parsing this one), so transform is never less than zero
+            phases = dict(call.phases)
+            phases["transform"] = max(0.0, elapsed - sum(phases.values()))
+            for name, seconds in phases.items():
+                _registry.observe(
+                    "outlook_mcp_phase_seconds",
+                    {**labels, "phase": name},
+                    seconds,
+                    LATENCY_BUCKETS,
+                )
@@ -0,0 +1,219 @@
+from collections.abc import MutableMapping
+from typing import Any, Optional
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# OAuth proxy state shared between worker processes
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS oauth_state (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires_at REAL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS oauth_state_expiry ON oauth_state (expires_at);
+"""
+
+# pending authorizations and unredeemed codes are dropped after this
+# many seconds, the same as an abandoned sign-in
+PENDING_TTL = 3600
+
+
+class SQLiteStateStore:
+    """
+    A small key-value store in a SQLite file, which every worker opens
+    so OAuth registrations, pending authorizations and token mappings
+    made by one worker are seen by all of them. values are JSON and
+    are namespaced, with an optional expiry.
+
+    the file holds access and refresh tokens in plain text, so it's
+    created readable by its owner only (sqlite gives its -wal and -shm
+    files the same mode), and expired rows are deleted as it's used.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        # opened on first use, so each worker process gets its own
+        if self._conn is None:
+            if self.path != ":memory:":
+                os.close(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600))
+                os.chmod(self.path, 0o600)
+            conn = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None, check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            conn.execute(
+                "DELETE FROM oauth_state WHERE expires_at <= ?", (time.time(),)
+            )
+            self._conn = conn
+        return self._conn
+
+    def get(self, namespace: str, key: str) -> Optional[str]:
+        with self._lock:
+            row = (
+                self._connection()
+                .execute(
+                    "SELECT value FROM oauth_state WHERE namespace = ? AND key = ?"
+                    " AND (expires_at IS NULL OR expires_at > ?)",
+                    (namespace, key, time.time()),
+                )
+                .fetchone()
+            )
+        return row[0] if row else None
+
+    def set(self, namespace: str, key: str, value: str, ttl: Optional[float] = None):
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO oauth_state (namespace, key, value, expires_at)"
+                " VALUES (?, ?, ?, ?)",
+                (namespace, key, value, now + ttl if ttl else None),
+            )
+            conn.execute("DELETE FROM oauth_state WHERE expires_at <= ?", (now,))
+
+    def pop(self, namespace: str, key: str) -> Optional[str]:
+        """removes a key and returns its value, so a one-time code can
+        only be redeemed by one worker
+        """
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT value, expires_at FROM oauth_state"
+                    " WHERE namespace = ? AND key = ?",
+                    (namespace, key),
+                ).fetchone()
+                conn.execute(
+                    "DELETE FROM oauth_state WHERE namespace = ? AND key = ?",
+                    (namespace, key),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None
+        return row[0]
+
+    def keys(self, namespace: str) -> list:
+        with self._lock:
+            rows = (
+                self._connection()
+                .execute(
+                    "SELECT key FROM oauth_state WHERE namespace = ?"
+                    " AND (expires_at IS NULL OR expires_at > ?)",
+                    (namespace, time.time()),
+                )
+                .fetchall()
+            )
+        return [row[0] for row in rows]
+
+
+class SharedStateDict(MutableMapping):
+    """
+    A dict view of one namespace of a SQLiteStateStore, which stands in
+    for the OAuth proxy's in-memory dicts. values are JSON, or pydantic
+    models of <model> if one is given. values expire after <ttl>, or
+    when a model's own expires_at passes.
+    """
+
+    def __init__(
+        self,
+        store: SQLiteStateStore,
+        namespace: str,
+        model: Any = None,
+        ttl: Optional[float] = None,
+    ):
+        self._store = store
+        self._namespace = namespace
+        self._model = model
+        self._ttl = ttl
+
+    def _encode(self, value) -> str:
+        if self._model is not None:
+            return value.model_dump_json()
+        return json.dumps(value)
+
+    def _decode(self, value: str):
+        if self._model is not None:
+            return self._model.model_validate_json(value)
+        return json.loads(value)
+
+    def __getitem__(self, key: str):
+        value = self._store.get(self._namespace, key)
+        if value is None:
+            raise KeyError(key)
+        return self._decode(value)
+
+    def __setitem__(self, key: str, value):
+        ttl = self._ttl
+        expires_at = getattr(value, "expires_at", None)
+        if expires_at is not None:
+            ttl = max(expires_at - time.time(), 1)
+        self._store.set(self._namespace, key, self._encode(value), ttl)
+
+    def __delitem__(self, key: str):
+        if self._store.pop(self._namespace, key) is None:
+            raise KeyError(key)
+
+    def pop(self, key: str, *default):
+        value = self._store.pop(self._namespace, key)
+        if value is None:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        return self._decode(value)
+
+    def __iter__(self):
+        return iter(self._store.keys(self._namespace))
+
+    def __len__(self) -> int:
+        return len(self._store.keys(self._namespace))
+
+
+class SQLiteClientStorage:
+    """the OAuth proxy's client registration storage, in a SQLiteStateStore"""
+
+    def __init__(self, store: SQLiteStateStore):
+        self._store = store
+
+    async def get(self, key: str) -> Optional[dict]:
+        value = self._store.get("clients", key)
+        return json.loads(value) if value is not None else None
+
+    async def set(self, key: str, value: dict):
+        self._store.set("clients", key, json.dumps(value))
+
+    async def delete(self, key: str):
+        self._store.pop("clients", key)
+
+
+def use_shared_state(provider, store: SQLiteStateStore):
+    """swaps an OAuth proxy's in-memory state for <store>, so any worker
+    can finish a sign-in or token refresh another worker started
+    """
+    from mcp.server.auth.provider import AccessToken, RefreshToken
+
+    provider._client_storage = SQLiteClientStorage(store)
+    provider._access_tokens = SharedStateDict(store, "access_tokens", AccessToken)
+    provider._refresh_tokens = SharedStateDict(store, "refresh_tokens", RefreshToken)
+    provider._access_to_refresh = SharedStateDict(store, "access_to_refresh")
+    provider._refresh_to_access = SharedStateDict(store, "refresh_to_access")
+    provider._oauth_transactions = SharedStateDict(
+        store, "oauth_transactions", ttl=PENDING_TTL
+    )
+    provider._client_codes = SharedStateDict(store, "client_codes", ttl=PENDING_TTL)
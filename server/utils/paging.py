@@ -0,0 +1,70 @@
+from typing import TYPE_CHECKING, AsyncIterator, Optional
+
+from utils.raw import get_json
+
+import asyncio
+
+if TYPE_CHECKING:
+    from kiota_abstractions.base_request_configuration import RequestConfiguration
+
+# Graph paging utilities
+
+# the most graph will return in a single page for messages and events
+GRAPH_PAGE_SIZE = 100
+
+
+async def iterate_pages(
+    request_builder,
+    request_configuration: Optional["RequestConfiguration"] = None,
+    max_items: Optional[int] = None,
+    raw: bool = False,
+) -> AsyncIterator[list]:
+    """
+    Yields pages of results from a graph collection request, following
+    `@odata.nextLink` until <max_items> have been yielded or there are
+    no more pages. the next page is requested as soon as the current one
+    arrives so fetching overlaps with the caller's processing, and at
+    most one page is ever held ahead of the caller. with <raw> set,
+    pages are lists of graph's JSON objects instead of sdk models.
+    """
+    from kiota_abstractions.base_request_configuration import RequestConfiguration
+
+    # next links already carry the query, so only headers carry over
+    page_configuration = RequestConfiguration()
+    if request_configuration and request_configuration.headers:
+        page_configuration.headers.add_all(request_configuration.headers)
+
+    async def fetch(builder, configuration):
+        if raw:
+            resp = await get_json(builder, configuration)
+            return resp.get("value") or [], resp.get("@odata.nextLink")
+        resp = await builder.get(request_configuration=configuration)
+        if not resp:
+            return [], None
+        return resp.value or [], resp.odata_next_link
+
+    yielded = 0
+    resp = await fetch(request_builder, request_configuration)
+
+    while resp:
+        page, next_link = resp
+        if max_items is not None:
+            page = page[: max_items - yielded]
+        yielded += len(page)
+
+        next_page = None
+        if next_link and (max_items is None or yielded < max_items):
+            next_page = asyncio.ensure_future(
+                fetch(request_builder.with_url(next_link), page_configuration)
+            )
+
+        try:
+            if page:
+                yield page
+        except GeneratorExit:
+            # the caller stopped early, don't leave the prefetch running
+            if next_page:
+                next_page.cancel()
+            raise
+
+        resp = await next_page if next_page else None
@@ -1,21 +1,351 @@
-from bs4 import BeautifulSoup
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from html.parser import HTMLParser
+from typing import List, Optional, Tuple
 
+from utils.config import load_config
+from utils.metrics import phase
 
-def parse_email_html(html_content: str) -> str:
-    """Parses an HTML email body and extracts the text."""
+import asyncio
+import re
+
+# tags whose text never makes it into the extracted output. script and
+# style are dropped outright, the rest are string types that
+# BeautifulSoup's get_text() leaves out by default
+SKIPPED_TAGS = {"script", "style", "template", "rt", "rp"}
+
+# elements that never have content or an end tag, so never stay open
+VOID_TAGS = {
+    "area",
+    "base",
+    "basefont",
+    "bgsound",
+    "br",
+    "col",
+    "command",
+    "embed",
+    "frame",
+    "hr",
+    "image",
+    "img",
+    "input",
+    "isindex",
+    "keygen",
+    "link",
+    "menuitem",
+    "meta",
+    "nextid",
+    "param",
+    "source",
+    "spacer",
+    "track",
+    "wbr",
+}
+
+# graph's bodyPreview is the first 255 characters of the body text
+PREVIEW_LENGTH = 255
+
+# how much html is handed to the tokenizer between budget checks
+BODY_CHUNK_SIZE = 65536
+
+# the line boundaries str.splitlines() splits on
+LINE = re.compile(r"[^\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]+")
+
+
+class HTMLTextExtractor(HTMLParser):
+    """
+    A streaming HTML tokenizer that collects text nodes as it goes,
+    without ever building a document tree.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._buffer = []
+        # characters of text waiting in _buffer for the next tag
+        self.buffered = 0
+        # open elements, innermost last, with how many of each are open
+        # and how many of them suppress text
+        self._open = []
+        self._open_counts = {}
+        self._skipping = 0
+        # void elements whose redundant end tag, e.g. </br>, may follow
+        self._closed_voids = {}
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        text = "".join(self._buffer).strip()
+        self._buffer = []
+        self.buffered = 0
+        if text and not self._skipping:
+            self.parts.append(text)
+
+    def _push(self, tag):
+        self._open.append(tag)
+        self._open_counts[tag] = self._open_counts.get(tag, 0) + 1
+        if tag in SKIPPED_TAGS:
+            self._skipping += 1
+
+    def handle_starttag(self, tag, attrs):
+        self._flush()
+        if tag in VOID_TAGS:
+            self._closed_voids[tag] = self._closed_voids.get(tag, 0) + 1
+            return
+        self._push(tag)
+
+    def handle_endtag(self, tag):
+        if self._closed_voids.get(tag):
+            # the end tag of a void element that was already closed,
+            # which the tree builder checks off without ending the text
+            self._closed_voids[tag] -= 1
+            return
+        self._flush()
+        if not self._open_counts.get(tag):
+            # like the tree builder, an end tag with nothing to close is ignored
+            return
+        # close back to the most recent matching element, along with
+        # anything left open inside it, like the tree builder does
+        while True:
+            name = self._open.pop()
+            self._open_counts[name] -= 1
+            if name in SKIPPED_TAGS:
+                self._skipping -= 1
+            if name == tag:
+                break
+
+    def handle_startendtag(self, tag, attrs):
+        # <tag/> opens an element and closes it straight away
+        self._flush()
+        self._push(tag)
+        self.handle_endtag(tag)
+
+    def handle_data(self, data):
+        self._buffer.append(data)
+        self.buffered += len(data)
+
+    def handle_comment(self, data):
+        self._flush()
+
+    def handle_decl(self, decl):
+        self._flush()
+
+    def handle_pi(self, data):
+        self._flush()
+
+    def unknown_decl(self, data):
+        self._flush()
+        if data.startswith("CDATA["):
+            # cdata is kept even inside elements whose text is dropped
+            text = data[len("CDATA[") :].strip()
+            if text:
+                self.parts.append(text)
+
+    def close(self):
+        super().close()
+        self._flush()
+
+
+def _extract_text_stream(html_content: str, max_chars: Optional[int] = None) -> str:
+    """extracts text with the streaming tokenizer, a chunk at a time,
+    stopping once more than <max_chars> characters have been found,
+    counting text that's still waiting for a tag to end it
+    """
+    extractor = HTMLTextExtractor()
+    length = 0
+    counted = 0
+    for offset in range(0, len(html_content), BODY_CHUNK_SIZE):
+        extractor.feed(html_content[offset : offset + BODY_CHUNK_SIZE])
+        if max_chars is None:
+            continue
+        length += sum(len(part) + 1 for part in extractor.parts[counted:])
+        counted = len(extractor.parts)
+        if length + extractor.buffered > max_chars:
+            # the rest of the body is never tokenized
+            extractor._flush()
+            return "\n".join(extractor.parts)
+    extractor.close()
+    return "\n".join(extractor.parts)
+
+
+def _extract_text_soup(html_content: str) -> str:
+    """extracts text by building a full BeautifulSoup tree"""
+    # only imported if the streaming parser ever fails
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html_content, "html.parser")
+
+    # Remove script and style elements
+    for element in soup(["script", "style"]):
+        element.decompose()
+
+    return soup.get_text(separator="\n", strip=True)
+
+
+def parse_email_html(html_content: str, max_chars: Optional[int] = None) -> str:
+    """Parses an HTML email body and extracts the text. with <max_chars>,
+    parsing stops soon after that many characters have been extracted,
+    so the text may run a little past it."""
     if not html_content:
         return ""
 
     try:
-        soup = BeautifulSoup(html_content, "html.parser")
+        text = _extract_text_stream(html_content, max_chars)
+    except Exception:
+        # fall back to the slower tree-based parser
+        try:
+            text = _extract_text_soup(html_content)
+        except Exception:
+            # Fallback for any parsing errors
+            return ""
 
-        # Remove script and style elements
-        for element in soup(["script", "style"]):
-            element.decompose()
+    # clean up whitespace
+    return "\n".join(line for line in text.splitlines() if line)
 
-        # Get text and clean up whitespace
-        text = soup.get_text(separator="\n", strip=True)
-        return "\n".join(line for line in text.splitlines() if line)
-    except Exception:
-        # Fallback for any parsing errors
-        return ""
+
+def _clean_text(text: str, max_chars: Optional[int] = None) -> str:
+    """strips each line of a plain-text body and drops the empty ones,
+    stopping once more than <max_chars> characters have been kept
+    """
+    lines = []
+    length = 0
+    for match in LINE.finditer(text):
+        line = match.group().strip()
+        if not line:
+            continue
+        lines.append(line)
+        length += len(line) + 1
+        if max_chars is not None and length > max_chars:
+            break
+    return "\n".join(lines)
+
+
+def _body_content(body) -> Tuple[Optional[str], bool]:
+    """the content of a Graph item body and whether it's plain text.
+    accepts either an sdk ItemBody or graph's raw JSON for one.
+    """
+    if not body:
+        return None, False
+    if isinstance(body, dict):
+        return body.get("content"), body.get("contentType") == "text"
+
+    from msgraph.generated.models.body_type import BodyType
+
+    return body.content, body.content_type == BodyType.Text
+
+
+# body parsing worker pool
+
+_executor: Optional[Executor] = None
+
+
+def body_preview(text: Optional[str]) -> str:
+    """the bodyPreview graph would give for a body we've already parsed"""
+    return " ".join((text or "").split())[:PREVIEW_LENGTH]
+
+
+def get_parser_executor() -> Executor:
+    """get the process-wide pool that html bodies are parsed on"""
+    global _executor
+    if _executor is None:
+        config = load_config()
+        if config.get("parser_pool") == "process":
+            _executor = ProcessPoolExecutor(max_workers=config.get("parser_pool_size"))
+        else:
+            _executor = ThreadPoolExecutor(
+                max_workers=config.get("parser_pool_size"),
+                thread_name_prefix="parser",
+            )
+    return _executor
+
+
+def _cap_bytes(content: str, max_size: int) -> Tuple[str, bool]:
+    """cuts a body to at most <max_size> bytes of UTF-8, without splitting
+    a character, and says whether anything was cut. every character is
+    at least a byte, so only the first <max_size> are ever encoded
+    """
+    head = content[:max_size]
+    encoded = head.encode("utf-8", "surrogatepass")
+    if len(encoded) <= max_size:
+        return head, len(content) > max_size
+    return encoded[:max_size].decode("utf-8", "ignore"), True
+
+
+async def parse_email_bodies(
+    bodies: list, max_chars: Optional[int] = None
+) -> List[Tuple[str, bool]]:
+    """Extracts the text from a list of Graph item bodies in parallel,
+    returning each one's text and whether it was truncated. html
+    bodies are parsed on the worker pool so the event loop stays free;
+    each one is capped at the configured size in UTF-8 bytes, cut to
+    <max_chars> characters (by default the configured budget per body),
+    and given up on after a timeout.
+
+    the timeout only stops waiting: a worker can't be interrupted, so it
+    carries on with the body regardless. what bounds its work is the
+    cap on the input and the <max_chars> cutoff, which it checks itself
+    between chunks.
+    """
+    config = load_config()
+    max_size = config.get("parser_max_body_size")
+    if max_chars is None:
+        max_chars = config.get("parser_max_body_chars") or None
+    timeout = config.get("parser_timeout")
+    executor = get_parser_executor()
+    loop = asyncio.get_running_loop()
+
+    async def parse_one(body) -> Tuple[str, bool]:
+        content, is_text = _body_content(body)
+        if not content:
+            return "", False
+        if max_chars == 0:
+            # the response's budget is already spent
+            return "", True
+
+        content, truncated = _cap_bytes(content, max_size)
+        if is_text:
+            text = _clean_text(content, max_chars)
+        else:
+            try:
+                text = await asyncio.wait_for(
+                    loop.run_in_executor(
+                        executor, parse_email_html, content, max_chars
+                    ),
+                    timeout,
+                )
+            except asyncio.TimeoutError:
+                return "", True
+
+        if max_chars is not None and len(text) > max_chars:
+            text = text[:max_chars]
+            truncated = True
+        return text, truncated
+
+    with phase("parse"):
+        return await asyncio.gather(*(parse_one(body) for body in bodies))
+
+
+def apply_body_budget(
+    messages: List[dict], total_chars: Optional[int] = None
+) -> List[dict]:
+    """Cuts the bodies of a response's messages so that together they
+    are no longer than <total_chars> (by default the configured budget
+    per response), keeping the earliest messages whole. every message
+    with a body gets a `body_truncated` flag.
+    """
+    if total_chars is None:
+        total_chars = load_config().get("parser_max_response_chars") or None
+
+    remaining = total_chars
+    for message in messages:
+        body = message.get("body")
+        if body is None:
+            # a headers-only result
+            continue
+        message.setdefault("body_truncated", False)
+        if remaining is None:
+            continue
+        if len(body) > remaining:
+            message["body"] = body[:remaining]
+            message["body_truncated"] = True
+        remaining -= len(message["body"])
+    return messages
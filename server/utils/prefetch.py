@@ -0,0 +1,265 @@
+from collections import OrderedDict
+from typing import Optional
+
+from fastmcp.server.dependencies import get_access_token
+from fastmcp.server.middleware import Middleware, MiddlewareContext
+from fastmcp.utilities.logging import get_logger
+
+from utils.auth import (
+    TOKEN_EXPIRY_SKEW,
+    get_client_pool,
+    get_graph_client,
+    get_token_claims,
+    get_token_expiry,
+    get_user_id,
+)
+from utils.calendar_cache import get_calendar_cache
+from utils.config import load_config
+from utils.mailbox import get_mailbox_cache
+from utils.metrics import get_metrics
+from utils.scheduler import TokenBucket
+
+import asyncio
+import threading
+import time
+
+# Background cache warming for active users
+
+logger = get_logger(__name__)
+
+# how soon prefetches held back by live requests are tried again
+DEFER_SECONDS = 1.0
+
+
+class _ActiveUser:
+    def __init__(self, user_id: str, tenant: str):
+        self.user_id = user_id
+        self.tenant = tenant
+        self.token: Optional[str] = None
+        self.expires_at = 0.0
+        self.last_active = 0.0
+        self.last_prefetched = 0.0
+
+
+class PrefetchScheduler:
+    """
+    Keeps the mailbox and calendar caches of recently active users
+    warm. every request records its user (by the `sub` claim) and
+    token, and every <interval> seconds the inbox and this week's
+    calendar of each user active in the last <active_window> seconds
+    are synced in the background, as long as their token is still
+    valid, so their next read finds the caches current. a user's first
+    request also triggers a sync straight away, before they get to the
+    resources. prefetches never run more than <concurrency> at once,
+    <tenant_concurrency> per tenant, or faster than <tenant_rate> per
+    second per tenant, and a round is skipped while live requests are
+    queued for graph.
+    """
+
+    def __init__(
+        self,
+        interval: float = 60,
+        active_window: float = 900,
+        concurrency: int = 2,
+        tenant_concurrency: int = 1,
+        tenant_rate: float = 1.0,
+        max_users: int = 1000,
+    ):
+        self.interval = interval
+        self.active_window = active_window
+        self.tenant_concurrency = tenant_concurrency
+        self.tenant_rate = tenant_rate
+        self.max_users = max_users
+        self._users: "OrderedDict[str, _ActiveUser]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # per tenant: prefetches in flight, and a bucket pacing them
+        self._tenant_in_flight: dict = {}
+        self._tenant_buckets: dict = {}
+        self._running: set = set()
+        self._task: Optional[asyncio.Task] = None
+        # the loop only keeps weak references to tasks, so running
+        # prefetches are held here until they finish
+        self._prefetching: set = set()
+        self._wake: Optional[asyncio.Event] = None
+        # counters
+        self.prefetches = 0
+        self.failures = 0
+        self.deferred = 0
+
+    def record(self, token):
+        """notes that the user behind a fastmcp access token is active"""
+        user_id = get_user_id(token)
+        now = time.time()
+        expires_at = get_token_expiry(token.token) or token.expires_at or now + 3600
+
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None:
+                tenant = get_token_claims(token.token).get("tid") or "unknown"
+                user = self._users[user_id] = _ActiveUser(user_id, tenant)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+            user.token = token.token
+            user.expires_at = expires_at
+            user.last_active = now
+            new = user.last_prefetched == 0
+
+        self._start()
+        if new:
+            self._wake.set()
+
+    def _start(self):
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                self._round()
+            except Exception:
+                logger.exception("prefetch round failed")
+
+    @staticmethod
+    def _live_requests_waiting() -> bool:
+        stats = get_client_pool().stats()
+        return stats.get("outlook_mcp_graph_queue_depth", 0) > 0
+
+    def _round(self):
+        now = time.time()
+        with self._lock:
+            # forget users who went quiet or whose token ran out
+            for user_id in [
+                user_id
+                for user_id, user in self._users.items()
+                if now - user.last_active > self.active_window
+                or user.expires_at - TOKEN_EXPIRY_SKEW <= now
+            ]:
+                del self._users[user_id]
+            due = sorted(
+                (
+                    user
+                    for user in self._users.values()
+                    if now - user.last_prefetched >= self.interval
+                    and user.user_id not in self._running
+                ),
+                key=lambda user: user.last_prefetched,
+            )
+
+        if due and self._live_requests_waiting():
+            self.deferred += len(due)
+            self._retry_soon()
+            return
+
+        deferred = 0
+        for user in due:
+            in_flight = self._tenant_in_flight.get(user.tenant, 0)
+            if in_flight >= self.tenant_concurrency:
+                deferred += 1
+                continue
+            self._tenant_in_flight[user.tenant] = in_flight + 1
+            self._running.add(user.user_id)
+            task = asyncio.create_task(self._prefetch(user))
+            self._prefetching.add(task)
+            task.add_done_callback(self._prefetching.discard)
+
+        # users whose tenant is at its limit go in a later round
+        if deferred:
+            self.deferred += deferred
+            self._retry_soon()
+
+    def _retry_soon(self):
+        asyncio.get_running_loop().call_later(DEFER_SECONDS, self._wake.set)
+
+    async def _prefetch(self, user: _ActiveUser):
+        try:
+            bucket = self._tenant_buckets.get(user.tenant)
+            if bucket is None:
+                bucket = self._tenant_buckets[user.tenant] = TokenBucket(
+                    self.tenant_rate, capacity=max(1.0, self.tenant_rate)
+                )
+            delay = bucket.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+
+            async with self._semaphore:
+                # the token may have run out while this waited its turn
+                if user.expires_at - TOKEN_EXPIRY_SKEW <= time.time():
+                    return
+                user.last_prefetched = time.time()
+                client = get_graph_client(user.token)
+                syncs = []
+                mailbox_cache = get_mailbox_cache()
+                if mailbox_cache:
+                    syncs.append(mailbox_cache.sync(user.user_id, client))
+                calendar_cache = get_calendar_cache()
+                if calendar_cache:
+                    syncs.append(calendar_cache.sync(user.user_id, client))
+                results = await asyncio.gather(*syncs, return_exceptions=True)
+
+            errors = [result for result in results if isinstance(result, Exception)]
+            self.prefetches += 1
+            if errors:
+                # the next read just syncs on its own instead
+                self.failures += 1
+                logger.debug("prefetch for %s failed: %s", user.user_id, errors[0])
+        finally:
+            self._tenant_in_flight[user.tenant] -= 1
+            self._running.discard(user.user_id)
+
+    def stats(self) -> dict:
+        """active users and prefetch counters, for /metrics"""
+        with self._lock:
+            users = len(self._users)
+        return {
+            "outlook_mcp_prefetch_users": users,
+            "outlook_mcp_prefetches_total": self.prefetches,
+            "outlook_mcp_prefetch_failures_total": self.failures,
+            "outlook_mcp_prefetch_deferred_total": self.deferred,
+        }
+
+
+class PrefetchMiddleware(Middleware):
+    """FastMCP middleware that tells the prefetch scheduler which users
+    are active
+    """
+
+    def __init__(self, scheduler: PrefetchScheduler):
+        self.scheduler = scheduler
+
+    async def on_request(self, context: MiddlewareContext, call_next):
+        token = get_access_token()
+        if token is not None:
+            self.scheduler.record(token)
+        return await call_next(context)
+
+
+_prefetch_scheduler: Optional[PrefetchScheduler] = None
+
+
+def get_prefetch_scheduler() -> Optional[PrefetchScheduler]:
+    """get the process-wide prefetch scheduler, or None if it's disabled"""
+    global _prefetch_scheduler
+    config = load_config()
+    # with both caches off there's nothing to keep warm
+    if not config.get("prefetch") or not (
+        config.get("mail_cache") or config.get("calendar_cache")
+    ):
+        return None
+    if _prefetch_scheduler is None:
+        _prefetch_scheduler = PrefetchScheduler(
+            interval=config.get("prefetch_interval"),
+            active_window=config.get("prefetch_active_window"),
+            concurrency=config.get("prefetch_concurrency"),
+            tenant_concurrency=config.get("prefetch_tenant_concurrency"),
+            tenant_rate=config.get("prefetch_tenant_rate"),
+        )
+        get_metrics().register_collector(_prefetch_scheduler.stats)
+    return _prefetch_scheduler
@@ -0,0 +1,59 @@
+import importlib
+import threading
+
+# Graph SDK preloading
+
+# the sdk modules the tools and resources import on first use
+GRAPH_SDK_MODULES = (
+    "msgraph",
+    "msgraph_core",
+    "kiota_authentication_azure.azure_identity_authentication_provider",
+    "kiota_abstractions.base_request_configuration",
+    "utils.adapter",
+    "msgraph.generated.users.item.user_item_request_builder",
+    "msgraph.generated.users.item.messages.messages_request_builder",
+    "msgraph.generated.users.item.messages.item.message_item_request_builder",
+    "msgraph.generated.users.item.mail_folders.mail_folders_request_builder",
+    "msgraph.generated.users.item.mail_folders.delta.delta_request_builder",
+    "msgraph.generated.users.item.mail_folders.item.messages.delta.delta_request_builder",
+    "msgraph.generated.users.item.calendar.events.events_request_builder",
+    "msgraph.generated.users.item.calendar_view.calendar_view_request_builder",
+    "msgraph.generated.users.item.outlook.master_categories.master_categories_request_builder",
+)
+
+# models only import the types of their fields the first time they're
+# deserialized, which is most of the sdk's cold-start cost
+GRAPH_SDK_MODELS = (
+    ("msgraph.generated.models.message", "Message"),
+    (
+        "msgraph.generated.models.message_collection_response",
+        "MessageCollectionResponse",
+    ),
+    (
+        "msgraph.generated.users.item.mail_folders.item.messages.delta.delta_get_response",
+        "DeltaGetResponse",
+    ),
+    ("msgraph.generated.models.mail_folder", "MailFolder"),
+    ("msgraph.generated.models.event", "Event"),
+    ("msgraph.generated.models.event_collection_response", "EventCollectionResponse"),
+    ("msgraph.generated.models.outlook_category", "OutlookCategory"),
+)
+
+
+def preload_graph_sdk():
+    """imports the graph sdk ahead of the first call that needs it"""
+    for name in GRAPH_SDK_MODULES:
+        importlib.import_module(name)
+    for module, name in GRAPH_SDK_MODELS:
+        getattr(importlib.import_module(module), name)().get_field_deserializers()
+
+
+def start_graph_sdk_preload() -> threading.Thread:
+    """preloads the graph sdk on a background thread, so the server can
+    start listening straight away
+    """
+    thread = threading.Thread(
+        target=preload_graph_sdk, name="graph-sdk-preload", daemon=True
+    )
+    thread.start()
+    return thread
@@ -0,0 +1,46 @@
+from typing import TYPE_CHECKING, Optional
+
+from datetime import datetime
+
+from utils.metrics import phase
+
+import json
+import re
+
+if TYPE_CHECKING:
+    from kiota_abstractions.base_request_configuration import RequestConfiguration
+
+# Raw JSON access to graph, skipping kiota model deserialization
+
+
+async def get_json(
+    request_builder, request_configuration: Optional["RequestConfiguration"] = None
+) -> dict:
+    """sends a GET through the sdk's request adapter (so auth and
+    middleware still apply) and returns graph's JSON response as-is
+    """
+    from msgraph.generated.models.o_data_errors.o_data_error import ODataError
+
+    request_info = request_builder.to_get_request_information(request_configuration)
+    content = await request_builder.request_adapter.send_primitive_async(
+        request_info, "bytes", {"XXX": ODataError}
+    )
+    with phase("deserialize"):
+        return json.loads(content) if content else {}
+
+
+def to_isoformat(value: Optional[str]) -> Optional[str]:
+    """normalizes a graph timestamp the way datetime.isoformat() would
+    render the parsed value, e.g. `...Z` becomes `...+00:00`. graph
+    sends up to 7 fractional digits, which are cut to the 6 that
+    fromisoformat() takes before python 3.11, as the sdk does
+    """
+    if not value:
+        return None
+    trimmed = re.sub(
+        r"\.(\d+)", lambda match: "." + match[1][:6].ljust(6, "0"), value, count=1
+    )
+    try:
+        return datetime.fromisoformat(trimmed.replace("Z", "+00:00")).isoformat()
+    except ValueError:
+        return value
@@ -0,0 +1,111 @@
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+from utils.config import load_config
+from utils.metrics import get_metrics
+
+import asyncio
+import threading
+import time
+
+# Per-user cache of slow-changing resources
+
+# loads a resource given what the last load left behind (None the first
+# time), returning its value and what to pass to the next load
+Loader = Callable[[Any], Awaitable[Tuple[Any, Any]]]
+
+
+class _Entry:
+    def __init__(self):
+        self.value = None
+        # e.g. a delta link, so the next load only fetches changes
+        self.state = None
+        self.loaded = False
+        self.expires_at = 0.0
+        self.lock = asyncio.Lock()
+
+
+class ResourceCache:
+    """
+    Caches resources that hardly ever change, like mail folders and
+    categories, per user for a TTL. once an entry expires, it's
+    revalidated by calling its loader with the state the last load
+    returned, so loaders that can ask graph for just the changes (with
+    a delta link) don't download the whole resource again. users are
+    evicted least-recently-used first.
+    """
+
+    def __init__(self, max_users: int = 1000):
+        self.max_users = max_users
+        self._users: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        # reads answered from the cache, first loads, and reloads of
+        # expired entries
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+    def _get_entry(self, user_id: str, name: str) -> _Entry:
+        with self._lock:
+            entries = self._users.get(user_id)
+            if entries is None:
+                entries = self._users[user_id] = {}
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+            entry = entries.get(name)
+            if entry is None:
+                entry = entries[name] = _Entry()
+            return entry
+
+    async def get(self, user_id: str, name: str, ttl: float, load: Loader):
+        """returns a user's cached <name> resource, loading it with
+        <load> if it isn't cached or has been cached for over <ttl> seconds
+        """
+        entry = self._get_entry(user_id, name)
+        if entry.loaded and entry.expires_at > time.monotonic():
+            self.hits += 1
+            return entry.value
+
+        async with entry.lock:
+            # someone else may have reloaded it while we waited
+            if entry.loaded and entry.expires_at > time.monotonic():
+                self.hits += 1
+                return entry.value
+
+            if entry.loaded:
+                self.revalidations += 1
+            else:
+                self.misses += 1
+            entry.value, entry.state = await load(entry.state)
+            entry.loaded = True
+            entry.expires_at = time.monotonic() + ttl
+            return entry.value
+
+    def stats(self) -> dict:
+        """cache size and hit counters, for /metrics"""
+        with self._lock:
+            entries = sum(len(entries) for entries in self._users.values())
+        return {
+            "outlook_mcp_resource_cache_entries": entries,
+            "outlook_mcp_resource_cache_hits_total": self.hits,
+            "outlook_mcp_resource_cache_misses_total": self.misses,
+            "outlook_mcp_resource_cache_revalidations_total": self.revalidations,
+        }
+
+
+_resource_cache: Optional[ResourceCache] = None
+
+
+def get_resource_cache() -> Optional[ResourceCache]:
+    """get the process-wide resource cache, or None if it's disabled"""
+    global _resource_cache
+    config = load_config()
+    if not config.get("resource_cache"):
+        return None
+    if _resource_cache is None:
+        _resource_cache = ResourceCache(
+            max_users=config.get("resource_cache_max_users")
+        )
+        get_metrics().register_collector(_resource_cache.stats)
+    return _resource_cache
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+from typing import Iterable, List, Tuple
+
+# Free/busy interval arithmetic
+
+# graph's getSchedule looks at most this far ahead in one request
+MAX_SCHEDULE_SPAN = timedelta(days=62)
+
+# and answers for at most this many schedules at once
+MAX_SCHEDULES = 20
+
+Interval = Tuple[datetime, datetime]
+
+
+def parse_schedule_time(value: str) -> datetime:
+    """parses one of graph's `dateTime` values, which can have seven
+    fractional digits, as a naive datetime in the requested time zone
+    """
+    value = value.rstrip("Z")
+    if "." in value:
+        whole, fraction = value.split(".", 1)
+        value = f"{whole}.{fraction[:6]}"
+    return datetime.fromisoformat(value)
+
+
+def split_span(start: datetime, end: datetime) -> List[Interval]:
+    """splits a window into pieces getSchedule will accept"""
+    spans = []
+    while start < end:
+        spans.append((start, min(end, start + MAX_SCHEDULE_SPAN)))
+        start += MAX_SCHEDULE_SPAN
+    return spans
+
+
+def merge_busy(intervals: Iterable[Interval]) -> List[Interval]:
+    """
+    Merges overlapping or touching busy intervals, from any number of
+    calendars, into disjoint ones sorted by start: one sort, then a
+    single sweep that extends the current block until the next
+    interval starts after it ends.
+    """
+    merged: List[Interval] = []
+    for start, end in sorted(intervals):
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def free_slots(
+    busy: List[Interval],
+    start: datetime,
+    end: datetime,
+    duration: timedelta,
+) -> List[Interval]:
+    """the gaps of at least <duration> between <start> and <end> that
+    none of the merged <busy> intervals cover
+    """
+    slots = []
+    cursor = start
+    for busy_start, busy_end in busy:
+        if busy_end <= cursor:
+            continue
+        if busy_start >= end:
+            break
+        if busy_start - cursor >= duration:
+            slots.append((cursor, busy_start))
+        cursor = max(cursor, busy_end)
+    if end - cursor >= duration:
+        slots.append((cursor, end))
+    return slots
@@ -0,0 +1,234 @@
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Callable, Optional, Tuple
+
+import asyncio
+import httpx
+import random
+import time
+
+# Throttling-aware Graph request scheduling
+
+THROTTLED_STATUS_CODES = (429, 503)
+
+# methods that are safe to send again whatever graph did with them
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+
+class TokenBucket:
+    """
+    A token bucket that refills at <rate> tokens per second up to
+    <capacity>. taking a token never blocks: it reserves one and returns
+    how long the caller has to wait before using it.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class AdaptiveLimit:
+    """
+    A concurrency limit that grows by one slot per window of successful
+    requests and halves whenever graph throttles us (AIMD), staying
+    between <minimum> and <maximum>.
+    """
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = 64):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            while self.in_flight >= int(self.limit):
+                await self._condition.wait()
+            self.in_flight += 1
+
+    async def release(self):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def on_success(self):
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def on_throttle(self):
+        self.limit = max(self.minimum, self.limit / 2)
+
+
+class _SchedulerState:
+    """the buckets, limit and backoff for one user or one tenant"""
+
+    def __init__(self, rate: float, concurrency: int, max_concurrency: int):
+        self.bucket = TokenBucket(rate, capacity=rate)
+        self.limit = AdaptiveLimit(concurrency, maximum=max_concurrency)
+        self.blocked_until = 0.0
+
+
+def retry_after(response: httpx.Response) -> Optional[float]:
+    """seconds graph asked us to wait, from the Retry-After header"""
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class GraphSchedulerTransport(httpx.AsyncBaseTransport):
+    """
+    An httpx transport that schedules every graph request through a
+    per-user and a per-tenant token bucket and adaptive concurrency
+    limit. throttled responses (429/503) back the user off for as long
+    as `Retry-After` says, plus jitter, and shrink the concurrency
+    limits. they're retried here before being handed back to the caller
+    if the request is idempotent, or if graph sent `Retry-After` and so
+    turned it away without acting on it. this is the only layer that
+    retries, the sdk's retry middleware is turned off on the pool.
+    """
+
+    def __init__(
+        self,
+        transport: httpx.AsyncBaseTransport,
+        key_func: Callable[[httpx.Request], Tuple[str, str]],
+        user_rate: float = 15.0,
+        user_concurrency: int = 4,
+        tenant_rate: float = 150.0,
+        tenant_concurrency: int = 32,
+        max_retries: int = 3,
+        max_states: int = 1024,
+    ):
+        self.transport = transport
+        self.key_func = key_func
+        self.user_rate = user_rate
+        self.user_concurrency = user_concurrency
+        self.tenant_rate = tenant_rate
+        self.tenant_concurrency = tenant_concurrency
+        self.max_retries = max_retries
+        self.max_states = max_states
+        self._users: "OrderedDict[str, _SchedulerState]" = OrderedDict()
+        self._tenants: "OrderedDict[str, _SchedulerState]" = OrderedDict()
+        # metrics
+        self.queue_depth = 0
+        self.requests = 0
+        self.throttled = 0
+        self.retries = 0
+        self.wait_seconds = 0.0
+
+    def _state(self, states: OrderedDict, key: str, rate: float, concurrency: int):
+        state = states.get(key)
+        if state is None:
+            state = states[key] = _SchedulerState(rate, concurrency, concurrency)
+        states.move_to_end(key)
+        # only drop idle states, an in-use limit still has waiters
+        while len(states) > self.max_states:
+            oldest_key, oldest = next(iter(states.items()))
+            if oldest.limit.in_flight or oldest_key == key:
+                break
+            states.popitem(last=False)
+        return state
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        return min(30.0, 2**attempt)
+
+    async def _wait_turn(self, user: _SchedulerState, tenant: _SchedulerState):
+        delay = max(
+            user.blocked_until - time.monotonic(),
+            tenant.blocked_until - time.monotonic(),
+            user.bucket.reserve(),
+            tenant.bucket.reserve(),
+            0.0,
+        )
+        if delay:
+            await asyncio.sleep(delay)
+        await user.limit.acquire()
+        try:
+            await tenant.limit.acquire()
+        except BaseException:
+            await user.limit.release()
+            raise
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        user_key, tenant_key = self.key_func(request)
+        user = self._state(self._users, user_key, self.user_rate, self.user_concurrency)
+        tenant = self._state(
+            self._tenants, tenant_key, self.tenant_rate, self.tenant_concurrency
+        )
+        self.requests += 1
+
+        for attempt in range(self.max_retries + 1):
+            queued = time.monotonic()
+            self.queue_depth += 1
+            try:
+                await self._wait_turn(user, tenant)
+            finally:
+                self.queue_depth -= 1
+                self.wait_seconds += time.monotonic() - queued
+
+            try:
+                response = await self.transport.handle_async_request(request)
+            finally:
+                await tenant.limit.release()
+                await user.limit.release()
+
+            if response.status_code not in THROTTLED_STATUS_CODES:
+                user.limit.on_success()
+                tenant.limit.on_success()
+                return response
+
+            self.throttled += 1
+            user.limit.on_throttle()
+            tenant.limit.on_throttle()
+            wait = retry_after(response)
+            if attempt == self.max_retries or (
+                wait is None and request.method not in IDEMPOTENT_METHODS
+            ):
+                return response
+
+            # back off for as long as graph asked, plus jitter so every
+            # waiting request doesn't come back at the same moment
+            delay = wait or self._backoff(attempt)
+            delay *= random.uniform(1.0, 1.25)
+            user.blocked_until = max(user.blocked_until, time.monotonic() + delay)
+            if response.status_code == 503:
+                tenant.blocked_until = max(
+                    tenant.blocked_until, time.monotonic() + delay
+                )
+
+            await response.aclose()
+            self.retries += 1
+
+        return response
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "retries": self.retries,
+            "wait_seconds": self.wait_seconds,
+            "tenant_limits": {
+                key: state.limit.limit for key, state in self._tenants.items()
+            },
+        }
+
+    async def aclose(self):
+        await self.transport.aclose()
@@ -0,0 +1,254 @@
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from utils.config import load_config
+from utils.parser import body_preview
+
+import re
+import sqlite3
+import threading
+
+# Local full-text index of synced mail
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    rowid INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    subject TEXT,
+    sender_name TEXT,
+    sender_address TEXT,
+    received TEXT,
+    body TEXT,
+    body_truncated INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (user_id, message_id)
+);
+CREATE INDEX IF NOT EXISTS messages_user_received ON messages (user_id, received);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    subject, sender, body, content='messages', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, subject, sender, body) VALUES (
+        new.rowid, new.subject,
+        coalesce(new.sender_name, '') || ' ' || coalesce(new.sender_address, ''),
+        new.body
+    );
+END;
+CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, subject, sender, body) VALUES (
+        'delete', old.rowid, old.subject,
+        coalesce(old.sender_name, '') || ' ' || coalesce(old.sender_address, ''),
+        old.body
+    );
+END;
+"""
+
+# subject matches count for more than body matches when ranking
+BM25_WEIGHTS = (3.0, 2.0, 1.0)
+
+
+def _to_utc_string(value: Optional[datetime]) -> Optional[str]:
+    if value is None:
+        return None
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _match_terms(column: str, text: str) -> Optional[str]:
+    """turns free text into an fts5 query on one column, quoting
+    every word so user input can't inject query syntax
+    """
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    quoted = " ".join('"' + word.replace('"', '""') + '"' for word in words)
+    return f"{column} : ({quoted})"
+
+
+class MailSearchIndex:
+    """
+    A SQLite FTS5 index over each user's synced messages. it is filled
+    incrementally by the mailbox cache as messages are added, changed
+    or removed, and answers `search_emails` queries with bm25 ranking.
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        # indexes written before bodies could be truncated lack the flag
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(messages)")]
+        if "body_truncated" not in columns:
+            self._conn.execute(
+                "ALTER TABLE messages ADD COLUMN"
+                " body_truncated INTEGER NOT NULL DEFAULT 0"
+            )
+        self._lock = threading.Lock()
+        # users whose initial sync finished: how far back it reaches,
+        # and whether it holds every inbox message since then
+        self._synced: dict = {}
+
+    def upsert(self, user_id: str, message_id: str, entry: dict):
+        """adds or replaces one message in a user's index"""
+        from_address = entry.get("from_address") or {}
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM messages WHERE user_id = ? AND message_id = ?",
+                (user_id, message_id),
+            )
+            self._conn.execute(
+                "INSERT INTO messages (user_id, message_id, subject, sender_name,"
+                " sender_address, received, body, body_truncated)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    user_id,
+                    message_id,
+                    entry.get("subject"),
+                    from_address.get("name"),
+                    from_address.get("address"),
+                    _to_utc_string(entry.get("delivery_time")),
+                    entry.get("body"),
+                    bool(entry.get("body_truncated")),
+                ),
+            )
+
+    def delete(self, user_id: str, message_ids: List[str]):
+        """removes messages from a user's index"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM messages WHERE user_id = ? AND message_id = ?",
+                [(user_id, message_id) for message_id in message_ids],
+            )
+
+    def drop_user(self, user_id: str):
+        """forgets everything indexed for a user"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
+            self._synced.pop(user_id, None)
+
+    def mark_synced(self, user_id: str, since: Optional[datetime]):
+        """records that a user's index is warm, and holds every message
+        in the mailbox received after <since>, or every message at all
+        while it's None
+        """
+        self._synced[user_id] = since
+
+    def is_warm(self, user_id: str) -> bool:
+        """whether the initial sync has filled the index for this user"""
+        return user_id in self._synced
+
+    def can_answer(self, user_id: str, start_date: Optional[str] = None) -> bool:
+        """whether the index holds every message the search could match,
+        in any folder: it's warm for this user, and either holds the
+        whole mailbox or the search starts after the oldest message it
+        holds
+        """
+        if user_id not in self._synced:
+            return False
+        since = self._synced[user_id]
+        if since is None:
+            return True
+        return start_date is not None and f"{start_date}T00:00:00Z" > _to_utc_string(
+            since
+        )
+
+    def search(
+        self,
+        user_id: str,
+        sender: Optional[str] = None,
+        subject: Optional[str] = None,
+        body: Optional[str] = None,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        max_results: int = 20,
+        headers_only: bool = False,
+    ) -> List[dict]:
+        """searches a user's messages, best matches first, or newest
+        first when there is no text to match on. with <headers_only>,
+        results have their id and a preview instead of the body
+        """
+        conditions = ["m.user_id = ?"]
+        params = [user_id]
+
+        if sender:
+            conditions.append(
+                "(m.sender_address = ? COLLATE NOCASE OR m.sender_name = ? COLLATE NOCASE)"
+            )
+            params += [sender, sender]
+        if start_date:
+            conditions.append("m.received >= ?")
+            params.append(f"{start_date}T00:00:00Z")
+        if end_date:
+            conditions.append("m.received <= ?")
+            params.append(f"{end_date}T23:59:59Z")
+
+        match_terms = [
+            terms
+            for terms in (
+                _match_terms("subject", subject or ""),
+                _match_terms("body", body or ""),
+            )
+            if terms
+        ]
+
+        if match_terms:
+            query = (
+                "SELECT m.message_id, m.subject, m.received, m.sender_name,"
+                " m.sender_address, m.body, m.body_truncated"
+                " FROM messages_fts JOIN messages m ON m.rowid = messages_fts.rowid"
+                f" WHERE messages_fts MATCH ? AND {' AND '.join(conditions)}"
+                " ORDER BY bm25(messages_fts, ?, ?, ?) LIMIT ?"
+            )
+            params = [" AND ".join(match_terms)] + params + list(BM25_WEIGHTS)
+        else:
+            query = (
+                "SELECT m.message_id, m.subject, m.received, m.sender_name,"
+                " m.sender_address, m.body, m.body_truncated"
+                f" FROM messages m WHERE {' AND '.join(conditions)}"
+                " ORDER BY m.received DESC LIMIT ?"
+            )
+
+        with self._lock:
+            rows = self._conn.execute(query, params + [max_results]).fetchall()
+
+        results = []
+        for (
+            message_id,
+            subject,
+            received,
+            sender_name,
+            sender_address,
+            body,
+            truncated,
+        ) in rows:
+            result = {
+                "subject": subject,
+                "delivery_time": (
+                    datetime.strptime(received, "%Y-%m-%dT%H:%M:%SZ")
+                    .replace(tzinfo=timezone.utc)
+                    .isoformat()
+                    if received
+                    else None
+                ),
+                "from_address": {"name": sender_name, "address": sender_address},
+            }
+            if headers_only:
+                result = {"id": message_id, **result, "preview": body_preview(body)}
+            else:
+                result["body"] = body or ""
+                result["body_truncated"] = bool(truncated)
+            results.append(result)
+        return results
+
+
+_search_index: Optional[MailSearchIndex] = None
+
+
+def get_search_index() -> Optional[MailSearchIndex]:
+    """get the process-wide search index, or None if it's disabled"""
+    global _search_index
+    config = load_config()
+    # the index is filled by the mailbox cache, so it needs it enabled
+    if not config.get("mail_search_index") or not config.get("mail_cache"):
+        return None
+    if _search_index is None:
+        _search_index = MailSearchIndex(config.get("mail_search_index_path"))
+    return _search_index
@@ -0,0 +1,152 @@
+from typing import Awaitable, Callable, Optional
+
+from fastmcp.server.context import Context
+from fastmcp.server.dependencies import get_access_token
+from fastmcp.utilities.logging import get_logger
+
+from utils.auth import get_user_id
+from utils.metrics import get_metrics
+
+import asyncio
+import functools
+import json
+
+# Single-flight deduplication of identical in-flight requests
+
+logger = get_logger(__name__)
+
+
+class SharedProgress:
+    """
+    Stands in for the Context of a shared call, which runs on behalf of
+    every caller waiting on it rather than the one that started it.
+    progress it reports goes to each of those callers, and one that
+    joins late is sent the latest progress straight away.
+    """
+
+    def __init__(self):
+        # caller -> (session, progress token, request id)
+        self._callers: dict = {}
+        self._last: Optional[tuple] = None
+
+    async def join(self, ctx: Context) -> object:
+        """adds a caller's context, and returns a handle to leave with.
+        its session and progress token are read here, in the caller's
+        own request, since the shared call runs outside of it
+        """
+        handle = object()
+        meta = ctx.request_context.meta
+        if meta is not None and meta.progressToken is not None:
+            caller = (ctx.session, meta.progressToken, ctx.request_id)
+            self._callers[handle] = caller
+            if self._last is not None:
+                await self._send(caller, *self._last)
+        return handle
+
+    def leave(self, handle: object):
+        self._callers.pop(handle, None)
+
+    async def report_progress(
+        self, progress: float, total: Optional[float] = None, message: str = None
+    ):
+        self._last = (progress, total, message)
+        for caller in list(self._callers.values()):
+            await self._send(caller, progress, total, message)
+
+    async def _send(self, caller: tuple, progress, total, message):
+        session, progress_token, request_id = caller
+        try:
+            await session.send_progress_notification(
+                progress_token=progress_token,
+                progress=progress,
+                total=total,
+                message=message,
+                related_request_id=request_id,
+            )
+        except Exception as e:
+            # a caller that's gone away shouldn't fail the call for the rest
+            logger.debug("Failed to send progress: %s", e)
+
+
+class SingleFlight:
+    """
+    Shares one in-flight call between every caller that asks for the
+    same key while it's running. the first caller starts the call, the
+    rest wait on its result instead of making their own. the call is
+    given a SharedProgress rather than any one caller's context, and
+    each caller that passes <ctx> gets its progress.
+    """
+
+    def __init__(self):
+        self._inflight: dict = {}
+        # calls actually made, and calls answered by one already in flight
+        self.calls = 0
+        self.shared = 0
+
+    async def do(
+        self,
+        key,
+        fn: Callable[[SharedProgress], Awaitable],
+        ctx: Optional[Context] = None,
+    ):
+        entry = self._inflight.get(key)
+        if entry is not None:
+            self.shared += 1
+            task, progress = entry
+        else:
+            self.calls += 1
+            progress = SharedProgress()
+            task = asyncio.ensure_future(fn(progress))
+            self._inflight[key] = (task, progress)
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        handle = await progress.join(ctx) if ctx is not None else None
+        try:
+            # a caller going away shouldn't cancel the call for everyone else
+            return await asyncio.shield(task)
+        finally:
+            progress.leave(handle)
+
+    def stats(self) -> dict:
+        """call and sharing counters, for /metrics"""
+        return {
+            "outlook_mcp_single_flight_calls_total": self.calls,
+            "outlook_mcp_single_flight_shared_total": self.shared,
+            "outlook_mcp_single_flight_in_flight": len(self._inflight),
+        }
+
+
+_single_flight = SingleFlight()
+get_metrics().register_collector(_single_flight.stats)
+
+
+def single_flight(fn):
+    """
+    Decorates a tool or resource handler so concurrent calls from the
+    same user with the same arguments share a single execution. a
+    Context argument isn't part of the key; the shared execution gets
+    a SharedProgress in its place, which reports to every caller.
+    """
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        token = get_access_token()
+        contexts = [
+            name for name, value in kwargs.items() if isinstance(value, Context)
+        ]
+        arguments = {
+            name: value for name, value in kwargs.items() if name not in contexts
+        }
+        key = (
+            get_user_id(token),
+            fn.__qualname__,
+            json.dumps([args, arguments], sort_keys=True, default=str),
+        )
+
+        def call(progress: SharedProgress):
+            return fn(*args, **arguments, **{name: progress for name in contexts})
+
+        ctx = kwargs[contexts[0]] if contexts else None
+        return await _single_flight.do(key, call, ctx)
+
+    return wrapper